@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Check of workqueue.py with several local worker processes: a synthetic
+volume is split between the workers against a mock Grobid, some of the
+contributions with expired leases of a crashed worker. Every contribution
+must be sent to Grobid exactly once and be done at the end, and the merge
+must not send any of them again.
+
+USAGE EXAMPLES:
+$ python benchmarks/check_workqueue.py
+$ python benchmarks/check_workqueue.py -n 8 -c 40
+$ python benchmarks/check_workqueue.py --slim    # workers with --slim
+"""
+
+from __future__ import print_function
+
+import getopt
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'grobid_proceedings'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+import mock_grobid
+
+
+def worker(input_dir, url, number, slim=False):
+    """One worker process, as python workqueue.py -i <input_dir>."""
+    import execute_grobid
+    import workqueue
+    execute_grobid.GROBID_HOST = url
+    workqueue.work(input_dir, worker='worker%i' % number, poll=0.2, slim=slim)
+
+
+def crash_leases(input_dir, names):
+    """Expired leases of a crashed worker on names."""
+    import workqueue
+    work_queue = workqueue.WorkQueue(workqueue.default_queue_dir(input_dir), 'crashed', -60)
+    for name in names:
+        work_queue.link_lease(name, 0)
+
+
+def check(nworkers=4, ncontributions=20, delay=0.05, work_dir=None, slim=False):
+    """Run the workers and the merge (without --slim), return list of errors."""
+    import execute_grobid
+    import workqueue
+    volume = synthetic.make_volume(work_dir, npages=ncontributions * 5,
+                                   ncontributions=ncontributions)
+    input_dir = volume['dir_for_grobid']
+    names = sorted(workqueue.pdf_names(input_dir))
+    crash_leases(input_dir, names[::3])
+
+    server, url = mock_grobid.start(3, 50, 5, delay)
+    server.bodies = []
+    start = time.time()
+    try:
+        processes = [multiprocessing.Process(target=worker, args=(input_dir, url, number, slim))
+                     for number in range(nworkers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        print('%i workers, %i contributions in %.2f s' % (nworkers, len(names), time.time() - start))
+        nbodies = len(server.bodies)
+        execute_grobid.GROBID_HOST = url
+        output_dir = os.path.join(work_dir, 'output')
+        os.mkdir(output_dir)
+        merged = workqueue.merge(input_dir, output_dir, volume['page_file'])
+        resent = len(server.bodies) - nbodies
+    finally:
+        server.shutdown()
+
+    errors = []
+    for process in processes:
+        if process.exitcode:
+            errors.append('worker exited with %i' % process.exitcode)
+    work_queue = workqueue.WorkQueue(workqueue.default_queue_dir(input_dir))
+    for name in names:
+        with open(os.path.join(input_dir, name), 'rb') as pdf_file:
+            pdf = pdf_file.read()
+        sent = len([body for body in server.bodies if pdf in body])
+        if sent != 1:
+            errors.append('%s sent to Grobid %i times' % (name, sent))
+        if not os.path.exists(work_queue.path(name, 'done')):
+            errors.append('%s is not done' % name)
+    if merged is None or merged[0] != len(names):
+        errors.append('merge wrote %s records' % (merged and merged[0]))
+    if resent:
+        errors.append('merge sent %i contributions to Grobid again' % resent)
+    return errors
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: python check_workqueue.py [-n workers] [-c contributions] [-d work_dir] [--slim]\n"
+                "defaults: 4 workers, 20 contributions")
+    try:
+        opts, args = getopt.getopt(argv, "hn:c:d:", ["slim"])
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    params = {'nworkers': 4, 'ncontributions': 20}
+    work_dir = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-n':
+            params['nworkers'] = int(arg)
+        elif opt == '-c':
+            params['ncontributions'] = int(arg)
+        elif opt == '-d':
+            work_dir = arg
+        elif opt == '--slim':
+            params['slim'] = True
+    keep = bool(work_dir)
+    work_dir = work_dir or tempfile.mkdtemp(prefix='grobid_workqueue_')
+    try:
+        errors = check(work_dir=work_dir, **params)
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    for error in errors:
+        print('ERROR: %s' % error)
+    if errors:
+        sys.exit(1)
+    print('Every contribution was processed exactly once')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
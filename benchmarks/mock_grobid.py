@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Local mock of the Grobid service for the benchmarks.
+Every POST to .../process<Something> gets a synthetic TEI document.
+With server.bodies a list, the bodies of the requests are kept there.
+GET .../version answers server.version (404 if None).
+"""
+
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+import synthetic
+
+
+class MockGrobidHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer every request with the TEI of the server, optionally after a delay."""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = self.rfile.read(length)
+        if self.server.bodies is not None:
+            self.server.bodies.append(request)
+        if self.server.delay:
+            threading.Event().wait(self.server.delay)
+        body = self.server.tei
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.endswith('/version') or self.server.version is None:
+            self.send_error(404)
+            return
+        body = self.server.version.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockGrobidServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server with the answer as attribute."""
+    daemon_threads = True
+
+
+def start(nauthors=5, abstract_words=200, nreferences=20, delay=0.0, port=0):
+    """Start the mock in a thread, return the server and its base URL."""
+    server = MockGrobidServer(('127.0.0.1', port), MockGrobidHandler)
+    server.tei = synthetic.make_tei(nauthors, abstract_words, nreferences).encode('utf-8')
+    server.delay = delay
+    server.bodies = None
+    server.version = '0.7.3-mock'
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%i/api' % server.server_address[1]
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for grobid_proceedings on synthetic proceedings.
+
+Times read_pages, cut_pdf (if poppler is installed), tei_to_dict,
+legacy_export_as_marc, the mapping of a collaboration paper with thousands of
+authors and a complete build_marc_xml against a local mock Grobid.
+Results are written as json, so runs of different versions can be compared.
+
+USAGE EXAMPLES:
+$ python benchmarks/run_benchmarks.py
+$ python benchmarks/run_benchmarks.py -p 5000 -c 1000 -a 50 -o bench_results.json
+$ python benchmarks/run_benchmarks.py -A 20000 -m 50
+"""
+
+from __future__ import print_function
+
+import getopt
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'grobid_proceedings'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+import mock_grobid
+
+
+def have_command(command):
+    """Is command in the PATH?"""
+    return any([os.access(os.path.join(path, command), os.X_OK)
+                for path in os.environ.get('PATH', '').split(os.pathsep)])
+
+
+def timed(func, repeat=3):
+    """Run func repeat times with stdout suppressed, return best and mean seconds."""
+    times = []
+    stdout = sys.stdout
+    devnull = open(os.devnull, 'w')
+    try:
+        for i in range(repeat):
+            sys.stdout = devnull
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    return {'best': min(times), 'mean': sum(times) / len(times), 'repeat': repeat}
+
+
+def version():
+    """git description of the checkout, None outside of git."""
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=BENCH_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def author_record(nauthors):
+    """Record dictionary as built by build_marc_xml with nauthors authors."""
+    authors = [{'a': 'Surname%i, F.' % i, 'v': [synthetic.INSTITUTIONS[i % 10]]}
+               for i in range(nauthors)]
+    return {'100': authors[:1], '700': authors[1:],
+            '245': {'a': 'A synthetic title'},
+            '520': {'a': synthetic.sentence(random.Random(1), 200), '9': 'Grobid'},
+            '773': [{'w': 'C99-99-99.1', 'c': '1-10'}],
+            'FFT': {'a': 'https://example.org/x.pdf', 'd': 'Fulltext', 't': 'INSPIRE-PUBLIC'}}
+
+
+def collaboration_record(tei, max_authors=0):
+    """Map the TEI of a collaboration paper and export it like build_marc_xml."""
+    import execute_grobid
+    import mapping
+    import utils
+    dic = mapping.tei_to_dict(tei, max_authors=max_authors)
+    marcdict = {}
+    execute_grobid.add_metadata(marcdict, dic, {"authors": 0, "title": 0, "abstract": 0})
+    return utils.legacy_export_as_marc(marcdict, no_empty_fields=False)
+
+
+def run(npages=100, ncontributions=10, nauthors=5, abstract_words=200, repeat=3, work_dir=None,
+        collaboration_authors=5000, max_authors=50):
+    """Run all benchmarks, return results dictionary."""
+    from cutpdf_for_grobid import read_pages, cut_pdf
+    import execute_grobid
+    import mapping
+    import utils
+
+    results = {}
+    work_dir = work_dir or tempfile.mkdtemp(prefix='grobid_bench_')
+    volume = synthetic.make_volume(work_dir, npages=npages, ncontributions=ncontributions,
+                                   nauthors=nauthors)
+
+    results['read_pages'] = timed(lambda: read_pages(volume['page_file']), repeat)
+
+    if have_command('pdfseparate') and have_command('pdfunite') and os.path.exists('/usr/bin/pdfinfo'):
+        cut_dir = os.path.join(work_dir, 'cut')
+
+        def cut():
+            shutil.rmtree(cut_dir, ignore_errors=True)
+            cut_pdf(volume['fulltext'], volume['page_file'], cut_dir)
+        results['cut_pdf'] = timed(cut, 1)
+    else:
+        results['cut_pdf'] = {'skipped': 'poppler-utils not installed'}
+
+    tei = synthetic.make_tei(nauthors, abstract_words)
+    results['tei_to_dict'] = timed(lambda: mapping.tei_to_dict(tei), repeat)
+
+    record = author_record(nauthors)
+    results['legacy_export_as_marc'] = timed(
+        lambda: utils.legacy_export_as_marc(record, no_empty_fields=False), repeat)
+
+    tei = synthetic.make_tei(collaboration_authors, abstract_words, collaboration='ATLAS')
+    results['collaboration_tei_to_dict'] = timed(lambda: mapping.tei_to_dict(tei), repeat)
+    results['collaboration_record'] = timed(lambda: collaboration_record(tei), repeat)
+    results['collaboration_collapsed'] = timed(lambda: collaboration_record(tei, max_authors),
+                                               repeat)
+
+    server, url = mock_grobid.start(nauthors, abstract_words)
+    host = execute_grobid.GROBID_HOST
+    execute_grobid.GROBID_HOST = url
+    output_dir = os.path.join(work_dir, 'output')
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir)
+
+    def build():
+        execute_grobid.tei_cache.clear()
+        execute_grobid.build_marc_xml(volume['dir_for_grobid'], output_dir, volume['page_file'])
+    try:
+        results['build_marc_xml'] = timed(build, 1)
+    finally:
+        execute_grobid.GROBID_HOST = host
+        server.shutdown()
+    return results
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: python run_benchmarks.py [-p pages] [-c contributions] [-a authors]\n"
+                "       [-w abstract_words] [-r repeat] [-o results.json] [-d work_dir]\n"
+                "       [-A collaboration_authors] [-m max_authors]\n"
+                "defaults: 100 pages, 10 contributions, 5 authors, 200 words, 3 repeats,\n"
+                "collaboration paper with 5000 authors collapsed to 50, results to bench_results.json")
+    try:
+        opts, args = getopt.getopt(argv, "hp:c:a:w:r:o:d:A:m:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    params = {'npages': 100, 'ncontributions': 10, 'nauthors': 5, 'abstract_words': 200,
+              'repeat': 3, 'collaboration_authors': 5000, 'max_authors': 50}
+    output = 'bench_results.json'
+    work_dir = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-p':
+            params['npages'] = int(arg)
+        elif opt == '-c':
+            params['ncontributions'] = int(arg)
+        elif opt == '-a':
+            params['nauthors'] = int(arg)
+        elif opt == '-w':
+            params['abstract_words'] = int(arg)
+        elif opt == '-r':
+            params['repeat'] = int(arg)
+        elif opt == '-A':
+            params['collaboration_authors'] = int(arg)
+        elif opt == '-m':
+            params['max_authors'] = int(arg)
+        elif opt == '-o':
+            output = arg
+        elif opt == '-d':
+            work_dir = arg
+
+    keep = bool(work_dir)
+    work_dir = work_dir or tempfile.mkdtemp(prefix='grobid_bench_')
+    try:
+        results = run(work_dir=work_dir, **params)
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'version': version(), 'python': platform.python_version(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': params, 'results': results}
+    output_file = open(output, 'w')
+    json.dump(report, output_file, indent=2, sort_keys=True)
+    output_file.close()
+    for name in sorted(results):
+        if 'best' in results[name]:
+            print('%-24s %10.4f s' % (name, results[name]['best']))
+        else:
+            print('%-24s %s' % (name, results[name].get('skipped')))
+    print('Results written to %s' % output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
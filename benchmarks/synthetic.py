@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic proceedings for the benchmarks:
+fulltext pdf, page file, metadata file, contribution pdfs and Grobid TEI.
+No external tools are needed, the pdfs are written directly.
+"""
+
+import os
+import random
+
+WORDS = ('quark gluon lattice neutrino collider symmetry boson anomaly detector '
+         'luminosity cross section decay spectrum jet hadron lepton scattering '
+         'calorimeter trigger vertex flavour gauge string dark matter').split()
+FIRST_NAMES = ('Anna Bernd Carla David Eva Felix Greta Hans Ines Jan Klara Lars '
+               'Maria Nils Olga Peter Rosa Stefan Tina Uwe').split()
+SURNAMES = ('Abel Becker Cohen Dietrich Engel Fischer Gruber Hoffmann Ivanov Jung '
+            'Keller Lorenz Meyer Novak Ostrowski Peters Quinn Richter Schmidt Wagner').split()
+INSTITUTIONS = ['CERN', 'DESY', 'Fermilab', 'SLAC', 'KEK', 'INFN Sezione di Roma',
+                'University of Hamburg', 'MIT', 'IHEP Beijing', 'TIFR Mumbai']
+
+
+def sentence(rng, nwords):
+    """Random words."""
+    return ' '.join([rng.choice(WORDS) for i in range(nwords)])
+
+
+def escape_pdf(text):
+    """Escape text for a pdf string."""
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def page_stream(lines):
+    """
+    Content stream writing lines of text from the top of an A4 page.
+    A line (text, size) is written in font size instead of 10.
+    """
+    commands = ['BT', '/F1 10 Tf', '12 TL', '50 800 Td']
+    size = 10
+    for line in lines:
+        if isinstance(line, tuple):
+            line, line_size = line
+        else:
+            line_size = 10
+        if line_size != size:
+            size = line_size
+            commands.append('/F1 %i Tf %i TL' % (size, int(size * 1.2)))
+        commands.append('(%s) Tj T*' % escape_pdf(line))
+    commands.append('ET')
+    return '\n'.join(commands)
+
+
+def write_pdf(filename, pages):
+    """Write a pdf, pages is a list of lists of text lines."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for lines in pages:
+        stream = page_stream(lines)
+        objects.append('<< /Length %i >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_number = len(objects)
+        objects.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       '/Resources << /Font << /F1 3 0 R >> >> /Contents %i 0 R >>' % content_number)
+        kids.append('%i 0 R' % len(objects))
+    objects[1] = '<< /Type /Pages /Kids [%s] /Count %i >>' % (' '.join(kids), len(kids))
+
+    out = ['%PDF-1.4\n']
+    offsets = []
+    position = len(out[0])
+    for number, obj in enumerate(objects, 1):
+        chunk = '%i 0 obj\n%s\nendobj\n' % (number, obj)
+        offsets.append(position)
+        out.append(chunk)
+        position += len(chunk)
+    xref = ['xref\n0 %i\n' % (len(objects) + 1), '0000000000 65535 f \n']
+    xref += ['%010i 00000 n \n' % offset for offset in offsets]
+    out += xref
+    out.append('trailer\n<< /Size %i /Root 1 0 R >>\nstartxref\n%i\n%%%%EOF\n'
+               % (len(objects) + 1, position))
+    pdf_file = open(filename, 'wb')
+    pdf_file.write(''.join(out))
+    pdf_file.close()
+
+
+def contribution_pages(rng, number, first_page, npages, nauthors):
+    """Text of the pages of one contribution."""
+    pages = []
+    for page in range(npages):
+        lines = []
+        if page == 0:
+            lines.append(('Contribution %i: %s' % (number, sentence(rng, 6).title()), 16))
+            lines.append(', '.join(['%s %s' % (rng.choice(FIRST_NAMES), rng.choice(SURNAMES))
+                                    for i in range(min(nauthors, 8))]))
+            lines.append('Abstract')
+        lines += [sentence(rng, 12) for i in range(40)]
+        lines.append('%i' % (first_page + page))
+        pages.append(lines)
+    return pages
+
+
+def plan(npages, ncontributions):
+    """Split npages into ncontributions page ranges (1-based, inclusive)."""
+    ncontributions = max(1, min(ncontributions, npages))
+    ranges = []
+    first = 1
+    for number in range(ncontributions):
+        remaining = ncontributions - number
+        length = max(1, (npages - first + 1) // remaining)
+        last = npages if remaining == 1 else first + length - 1
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def make_volume(base_dir, recid=999999, npages=100, ncontributions=10, nauthors=5, seed=1):
+    """
+    Create a synthetic volume in base_dir:
+        <recid>_fulltext.pdf, <recid>.txt (page file),
+        <recid>_for_grobid/ with <recid>_metadata.txt and the contribution pdfs.
+    Return dictionary with the file names.
+    """
+    rng = random.Random(seed)
+    ranges = plan(npages, ncontributions)
+    all_pages = []
+    dir_for_grobid = os.path.join(base_dir, '%s_for_grobid' % recid)
+    if not os.path.isdir(dir_for_grobid):
+        os.makedirs(dir_for_grobid)
+    for number, (first, last) in enumerate(ranges, 1):
+        pages = contribution_pages(rng, number, first, last - first + 1, nauthors)
+        all_pages += pages
+        write_pdf(os.path.join(dir_for_grobid, '%s_%i-%i.pdf' % (recid, first, last)), pages)
+    fulltext = os.path.join(base_dir, '%s_fulltext.pdf' % recid)
+    write_pdf(fulltext, all_pages)
+
+    page_filename = os.path.join(base_dir, '%s.txt' % recid)
+    page_file = open(page_filename, 'w')
+    for first, last in ranges:
+        page_file.write('%i-%i\n' % (first, last))
+    page_file.close()
+
+    metadata_filename = os.path.join(dir_for_grobid, '%s_metadata.txt' % recid)
+    metadata_file = open(metadata_filename, 'w')
+    metadata_file.write('%09i 269__ $$c2021-01-01\n' % recid)
+    metadata_file.write('%09i 773__ $$wC99-99-99.1\n' % recid)
+    metadata_file.write('%09i 980__ $$aConferencePaper\n' % recid)
+    metadata_file.close()
+    return {'fulltext': fulltext, 'page_file': page_filename,
+            'dir_for_grobid': dir_for_grobid, 'metadata': metadata_filename,
+            'ranges': ranges}
+
+
+def make_tei(nauthors=5, abstract_words=200, nreferences=20, seed=1, collaboration=None):
+    """Grobid-like TEI document with nauthors authors, after collaboration if given."""
+    rng = random.Random(seed)
+    authors = []
+    if collaboration:
+        authors.append('<author><persName><surname>%s Collaboration</surname></persName></author>'
+                       % collaboration)
+    for i in range(nauthors):
+        authors.append(
+            '<author><persName><forename type="first">%s</forename>'
+            '<forename type="middle">%s</forename><surname>%s</surname></persName>'
+            '<affiliation><orgName type="institution">%s</orgName></affiliation></author>'
+            % (rng.choice(FIRST_NAMES), rng.choice('ABCDEFGH'), rng.choice(SURNAMES),
+               rng.choice(INSTITUTIONS)))
+    references = []
+    for i in range(nreferences):
+        references.append(
+            '<biblStruct><analytic><title level="a" type="main">%s</title>'
+            '<author><persName><forename type="first">%s</forename><surname>%s</surname></persName></author>'
+            '</analytic><monogr><title level="j">Phys. Rev. D</title><imprint>'
+            '<biblScope unit="volume">%i</biblScope><biblScope unit="page" from="%i" to="%i"/>'
+            '<date type="published" when="%i"/></imprint></monogr></biblStruct>'
+            % (sentence(rng, 5), rng.choice(FIRST_NAMES), rng.choice(SURNAMES),
+               rng.randint(1, 99), i + 1, i + 10, rng.randint(1970, 2020)))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc>'
+        '<titleStmt><title level="a" type="main">%s</title></titleStmt>'
+        '<sourceDesc><biblStruct><analytic>%s</analytic></biblStruct></sourceDesc></fileDesc>'
+        '<profileDesc><abstract><p>%s</p></abstract></profileDesc></teiHeader>'
+        '<text><body><p>%s</p></body><back><div><listBibl>%s</listBibl></div></back></text></TEI>'
+        % (sentence(rng, 8).title(), ''.join(authors), sentence(rng, abstract_words),
+           sentence(rng, 500), ''.join(references)))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Per-volume table of affiliations.
+
+In a proceedings volume the same few institutions are listed for thousands
+of authors. Every affiliation is stored once; author records refer to it by
+an integer id until the record is exported (resolve_record).
+Variants which differ only in spacing or enclosing parentheses get the same id.
+"""
+
+import re
+import threading
+
+RE_SPACES = re.compile(r'\s+')
+
+AFFILIATION_FIELDS = ('100', '110', '700')
+
+
+def clean_affiliation(value):
+    """Affiliation without enclosing parentheses and with single spaces, to compare spellings."""
+    return RE_SPACES.sub(' ', value).strip(' ()')
+
+
+class AffiliationTable(object):
+    """Intern affiliations of one volume."""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        """
+        Return the id for value, the first spelling seen is kept
+        (without enclosing parentheses, as exported before).
+        """
+        try:
+            return self.index[value]
+        except KeyError:
+            pass
+        value = value or ''
+        key = clean_affiliation(value)
+        with self.lock:
+            if key not in self.index:
+                self.index[key] = len(self.values)
+                self.values.append(value.strip('()'))
+            self.index[value] = self.index[key]
+            return self.index[key]
+
+    def resolve(self, ids):
+        """Affiliation strings for a list of ids."""
+        return [self.values[aff_id] for aff_id in ids]
+
+    def intern_record(self, marcdict):
+        """Intern the affiliation strings in $$v of the author fields of an exported record."""
+        for tag in AFFILIATION_FIELDS:
+            for field in marcdict.get(tag) or []:
+                for value in field.get('v') or []:
+                    self.intern(value)
+
+    def resolve_record(self, marcdict):
+        """Copy of marcdict with the ids in $$v of author fields replaced by strings."""
+        resolved = dict(marcdict)
+        for tag in AFFILIATION_FIELDS:
+            if tag not in marcdict:
+                continue
+            fields = []
+            for field in marcdict[tag]:
+                if field.get('v'):
+                    field = dict(field)
+                    field['v'] = self.resolve(field['v'])
+                fields.append(field)
+            resolved[tag] = fields
+        return resolved
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch runner: process many proceedings volumes in one invocation,
+without the questions of start_grobid.py.
+
+The jobs file has one volume per line (whitespace separated, # for comments):
+    <recid> <fulltext_pdf> <page_file> [<metadata_file>]
+Without metadata file a dummy metadata file is created (see start_grobid.py).
+
+Volumes are processed in parallel. Cutting of pdfs and requests to Grobid
+are limited globally, all volumes share one HTTP connection pool and the
+Grobid results cache of execute_grobid.
+A json report with status and exit code of every job is written at the end.
+
+USAGE EXAMPLES:
+$ python batch_grobid.py -j jobs.txt
+$ python batch_grobid.py -j jobs.txt -o xml/ -w 4 -c 2 -g 8 -r report.json
+"""
+
+from __future__ import print_function
+
+import getopt
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+
+from six.moves import queue
+
+from cutpdf_for_grobid import cut_pdf
+import execute_grobid
+import pdf_upload_path
+import pdfstore
+import staging
+from resultstore import ResultStore
+from start_grobid import setup_dir_for_grobid
+
+# exit codes of a job
+EXIT_OK = 0
+EXIT_INPUT = 1
+EXIT_CUT = 2
+EXIT_GROBID = 3
+EXIT_NO_RECORDS = 4
+
+cut_slots = threading.BoundedSemaphore(1)
+
+
+def set_cut_concurrency(ncut):
+    """Limit the number of pdfs cut at the same time."""
+    global cut_slots
+    cut_slots = threading.BoundedSemaphore(ncut)
+
+
+def read_jobs(jobs_filename):
+    """Read jobs file, return list of job dictionaries."""
+    jobs = []
+    jobs_file = open(jobs_filename)
+    for line in jobs_file.readlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        job = {'recid': fields[0],
+               'fulltext': fields[1] if len(fields) > 1 else '',
+               'page_file': fields[2] if len(fields) > 2 else '',
+               'metadata': fields[3] if len(fields) > 3 else ''}
+        jobs.append(job)
+    jobs_file.close()
+    return jobs
+
+
+def job_status(recid, **values):
+    """Status dictionary of a job, ok unless values say otherwise."""
+    status = {'recid': recid, 'exit_code': EXIT_OK, 'status': 'ok',
+              'output': None, 'records': 0, 'failed': [], 'message': ''}
+    status.update(values)
+    return status
+
+
+def run_job(job, output_dir, dir_pdf, extract_metadata=True, cut=True,
+            output_format='marcxml', archive=True, stage=True, objects_dir=None,
+            optimize=False, slim=False, memory_limit=None, references=False, store=None,
+            local_header=None, parallel=1, delta=False, verify=False, deadline=None,
+            user=None, max_records=0, max_bytes=0):
+    """
+    Cut and process one volume. Return a status dictionary.
+    With stage the volume is cut and processed in local scratch
+    and the contributions are published to dir_pdf afterwards,
+    into the content-addressed store objects_dir if given.
+    optimize: optimize size of the contributions, slim: send slim copies to Grobid,
+    memory_limit: bounded-memory mode of build_marc_xml (bytes),
+    references: add 999C5 fields, store: resultstore.ResultStore for the results,
+    local_header: local guess of the header (execute_grobid.LOCAL_MODES),
+    parallel: contributions of the volume sent to Grobid at the same time,
+    delta: also write the records changed since the previous run (delta.py),
+    verify: check the page file against the text of the fulltext before the cut,
+    deadline: seconds since the epoch by which the volume is to be finished, the
+    contributions left over get PBN-only records, status 'partial' and 'topup' lists them.
+    Contributions Grobid could not process are listed in 'failed', the status is
+    'degraded' (or 'partial' with a top-up), or 'failed' with EXIT_GROBID if none was processed.
+    user: login for the 595 note of the records, default is the login of this process.
+    max_records, max_bytes: split the output in shards (execute_grobid.build_marc_xml).
+    """
+    status = job_status(job['recid'])
+    start = time.time()
+    if not job['recid'].isdigit():
+        status.update(exit_code=EXIT_INPUT, status='failed', message='recid is not a number')
+    elif cut and not os.path.isfile(job['fulltext']):
+        status.update(exit_code=EXIT_INPUT, status='failed',
+                      message="can't read fulltext %s" % job['fulltext'])
+    elif not os.path.isfile(job['page_file']):
+        status.update(exit_code=EXIT_INPUT, status='failed',
+                      message="can't read page file %s" % job['page_file'])
+    elif job['metadata'] and not os.path.isfile(job['metadata']):
+        status.update(exit_code=EXIT_INPUT, status='failed',
+                      message="can't read metadata %s" % job['metadata'])
+    if status['exit_code']:
+        status['seconds'] = time.time() - start
+        return status
+
+    dir_for_grobid, metadata_filename = setup_dir_for_grobid(job['recid'], dir_pdf)
+    if job['metadata']:
+        shutil.copyfile(job['metadata'], metadata_filename)
+
+    work_dir = dir_for_grobid
+    publish_dir = None
+    if cut:
+        if stage:
+            work_dir = staging.local_dir(dir_for_grobid)
+            publish_dir = dir_for_grobid
+        try:
+            with cut_slots:
+                cut_pdf(job['fulltext'], job['page_file'], work_dir, optimize, verify=verify)
+            if stage:
+                staging.publish(work_dir, dir_for_grobid, objects_dir)
+            elif objects_dir:
+                pdfstore.store_dir(dir_for_grobid, objects_dir)
+        except Exception:
+            status.update(exit_code=EXIT_CUT, status='failed', message=traceback.format_exc())
+            status['seconds'] = time.time() - start
+            if stage:
+                staging.remove_local_dir(work_dir)
+            return status
+
+    topup = []
+    try:
+        nrecs, output, failed = execute_grobid.build_marc_xml(
+            work_dir, output_dir, job['page_file'], extract_metadata,
+            output_format, max_records, max_bytes, archive=archive, publish_dir=publish_dir,
+            slim=slim, memory_limit=memory_limit, references=references, store=store,
+            local_header=local_header, parallel=parallel, delta=delta, deadline=deadline,
+            topup=topup, user=user)
+    except Exception:
+        status.update(exit_code=EXIT_GROBID, status='failed', message=traceback.format_exc())
+    else:
+        status.update(records=nrecs, output=output, failed=failed)
+        messages = []
+        if failed:
+            messages.append('%i of %i contributions not processed by Grobid: %s'
+                            % (len(failed), nrecs, ', '.join(failed)))
+        if topup:
+            messages.append('%i contributions PBN only because of the deadline, '
+                            'top up with retry_grobid.py' % len(topup))
+            status.update(topup=topup)
+        if not nrecs:
+            status.update(exit_code=EXIT_NO_RECORDS, status='failed', message='no records')
+        elif len(failed) == nrecs:
+            status.update(exit_code=EXIT_GROBID, status='failed', message='; '.join(messages))
+        elif topup:
+            # the top-up is the next step, failed contributions stay listed in 'failed'
+            status.update(status='partial', message='; '.join(messages))
+        elif failed:
+            status.update(status='degraded', message='; '.join(messages))
+    if publish_dir:
+        staging.remove_local_dir(work_dir)
+    status['seconds'] = time.time() - start
+    return status
+
+
+def run_batch(jobs, output_dir, dir_pdf, nworkers=2, ncut=1, ngrobid=4, **kwargs):
+    """Run all jobs with nworkers volumes in parallel. Return list of status dictionaries."""
+    set_cut_concurrency(ncut)
+    execute_grobid.set_grobid_concurrency(ngrobid)
+
+    job_queue = queue.Queue()
+    for number, job in enumerate(jobs):
+        job_queue.put((number, job))
+    statuses = [None] * len(jobs)
+
+    def worker():
+        while True:
+            try:
+                number, job = job_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                statuses[number] = run_job(job, output_dir, dir_pdf, **kwargs)
+            except Exception:
+                statuses[number] = job_status(job['recid'], exit_code=EXIT_GROBID,
+                                              status='failed', message=traceback.format_exc())
+            print('Job %s: %s' % (job['recid'], statuses[number]['status']))
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, nworkers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def submit_batch(url, jobs, output_dir, dir_pdf, **kwargs):
+    """
+    Submit all jobs to the job service at url (see jobservice.py) and wait for them.
+    Return list of status dictionaries.
+    """
+    import jobservice
+    job_ids = [jobservice.submit(url, job, dir_pdf, output_dir, **kwargs)['id'] for job in jobs]
+    return [job['result'] for job in jobservice.wait(url, job_ids)]
+
+
+def write_report(statuses, report_filename):
+    """Write status of all jobs as json, return exit code of the batch (worst job)."""
+    exit_code = max([status['exit_code'] for status in statuses] or [EXIT_OK])
+    report_file = open(report_filename, 'w')
+    json.dump({'exit_code': exit_code, 'jobs': statuses}, report_file, indent=2, sort_keys=True)
+    report_file.close()
+    return exit_code
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("\v* Usage: python batch_grobid.py -j <jobs_file> [-o <output_dir>] [-r <report>]\n\v"
+        "* <jobs_file> has one line per volume:\n"
+        "  <recid> <fulltext_pdf> <page_file> [<metadata_file>]\n"
+        "* -o: directory for the output, default is '.'\n"
+        "* -d: directory for the contributions, default is the personal web directory\n"
+        "* -r: json report, default is batch_report.json in <output_dir>\n"
+        "* -w: number of volumes processed in parallel (default 2)\n"
+        "* -c: number of pdfs cut in parallel (default 1)\n"
+        "* -g: number of requests to Grobid in parallel (default 4)\n"
+        "* -f <format>: output format (default marcxml)\n"
+        "* -s: Skip extraction of metadata from pdf.\n"
+        "* -k: Keep existing contributions, don't cut the fulltexts.\n"
+        "* -l: Cut directly in the web directory instead of local scratch.\n"
+        "* -x: Store contributions and Grobid results by content in <dir_pdf>/.objects\n"
+        "      (pdfstore.py -g removes unused ones)\n"
+        "* -z: Optimize size of the contributions.\n"
+        "* -m: Send copies with downsampled images to Grobid.\n"
+        "* -M <MB>: Bounded-memory mode, keep at most <MB> of records per volume in memory.\n"
+        "* -b: Add the references (999C5) of the contributions.\n"
+        "* -S <file>: Save the results per contribution in this SQLite store (see resultstore.py).\n"
+        "* -L fallback|prepass: Guess the header locally if Grobid fails / before Grobid.\n"
+        "* -C <0..1>: Confidence of the local guess to skip Grobid with -L prepass (default 1.0).\n"
+        "* -P <n>: Contributions of a volume sent to Grobid at the same time, largest first.\n"
+        "* -H <url,url,...>: Spread the contributions over these Grobid hosts.\n"
+        "* -D: Delta, also write only the records changed since the previous run.\n"
+        "* -A <n>: Keep only the collaboration and the first <n> of longer author lists.\n"
+        "* -T <HH:MM|+minutes>: Deadline of the batch, contributions Grobid has not done by\n"
+        "      then get PBN-only records and are listed as 'topup' in the report.\n"
+        "* -V: Check first pages and page numbers of the contributions before cutting.\n"
+        "* -u <url>: Submit the jobs to the job service at <url> (see jobservice.py)\n"
+        "      and wait for them. -w, -c and -g are up to the service, -x, -S, -H, -A and -C\n"
+        "      are options of the service (jobservice.py) and can't be given with -u.\n"
+        )
+    try:
+        opts, args = getopt.getopt(argv, "hsklxzmbDVj:o:d:r:w:c:g:f:M:S:L:C:P:H:u:A:T:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+
+    jobs_filename = ''
+    output_dir = '.'
+    dir_pdf = None
+    report_filename = None
+    use_store = False
+    service_url = None
+    service_options = []
+    options = {'nworkers': 2, 'ncut': 1, 'ngrobid': 4,
+               'extract_metadata': True, 'cut': True, 'output_format': 'marcxml'}
+    for opt, arg in opts:
+        if opt in ('-x', '-S', '-H', '-A', '-C'):
+            service_options.append(opt)
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-j':
+            jobs_filename = arg
+        elif opt == '-o':
+            output_dir = arg
+        elif opt == '-d':
+            dir_pdf = arg
+        elif opt == '-r':
+            report_filename = arg
+        elif opt == '-w':
+            options['nworkers'] = int(arg)
+        elif opt == '-c':
+            options['ncut'] = int(arg)
+        elif opt == '-g':
+            options['ngrobid'] = int(arg)
+        elif opt == '-f':
+            options['output_format'] = arg
+        elif opt == '-s':
+            options['extract_metadata'] = False
+        elif opt == '-k':
+            options['cut'] = False
+        elif opt == '-l':
+            options['stage'] = False
+        elif opt == '-x':
+            use_store = True
+        elif opt == '-z':
+            options['optimize'] = True
+        elif opt == '-m':
+            options['slim'] = True
+        elif opt == '-u':
+            service_url = arg
+        elif opt == '-A':
+            execute_grobid.set_max_authors(int(arg))
+        elif opt == '-T':
+            try:
+                options['deadline'] = execute_grobid.parse_deadline(arg)
+            except ValueError:
+                print(helptext)
+                sys.exit(2)
+        elif opt == '-V':
+            options['verify'] = True
+        elif opt == '-D':
+            options['delta'] = True
+        elif opt == '-P':
+            options['parallel'] = int(arg)
+        elif opt == '-H':
+            execute_grobid.set_grobid_hosts(arg.split(','))
+        elif opt == '-L':
+            if arg not in execute_grobid.LOCAL_MODES:
+                print(helptext)
+                sys.exit(2)
+            options['local_header'] = arg
+        elif opt == '-C':
+            try:
+                execute_grobid.set_local_confidence(float(arg))
+            except ValueError:
+                print(helptext)
+                sys.exit(2)
+        elif opt == '-S':
+            options['store'] = ResultStore(arg)
+        elif opt == '-b':
+            options['references'] = True
+        elif opt == '-M':
+            options['memory_limit'] = int(float(arg) * 1024 * 1024)
+
+    if not os.path.isfile(jobs_filename) or not os.path.isdir(output_dir):
+        print(helptext)
+        sys.exit(2)
+    if service_url and service_options:
+        print('%s: options of the job service, start jobservice.py with them'
+              % ', '.join(service_options))
+        sys.exit(2)
+    if not dir_pdf:
+        dir_pdf = pdf_upload_path.dir_pdf(os.getcwd())
+    if use_store:
+        options['objects_dir'] = pdfstore.default_objects_dir(dir_pdf)
+        execute_grobid.set_tei_cache_dir(options['objects_dir'])
+    if not report_filename:
+        report_filename = os.path.join(output_dir, 'batch_report.json')
+
+    jobs = read_jobs(jobs_filename)
+    if service_url:
+        statuses = submit_batch(service_url, jobs, output_dir, dir_pdf, **options)
+    else:
+        statuses = run_batch(jobs, output_dir, dir_pdf, **options)
+    exit_code = write_report(statuses, report_filename)
+    if options.get('store'):
+        options['store'].close()
+    print('%i of %i jobs ok, report in %s'
+          % (len([s for s in statuses if s['exit_code'] == EXIT_OK]), len(statuses), report_filename))
+    degraded = [s['recid'] for s in statuses
+                if s['status'] in ('degraded', 'partial') and s.get('failed')]
+    if degraded:
+        print('%i jobs with contributions Grobid could not process: %s'
+              % (len(degraded), ', '.join(degraded)))
+    partial = [s['recid'] for s in statuses if s['status'] == 'partial']
+    if partial:
+        print('%i jobs need a top-up run: %s' % (len(partial), ', '.join(partial)))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
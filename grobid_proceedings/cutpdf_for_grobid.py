@@ -10,11 +10,19 @@ import os
 import re
 import sys
 import getopt
+import shutil
+import subprocess
+import tempfile
 
-USER = os.getlogin()
-DIR_TMP = '/tmp/tmp_%s' % USER
-if not os.path.isdir(DIR_TMP):
-    os.system('mkdir %s' % DIR_TMP)
+from pdf_upload_path import get_user
+import profiling
+
+def tmp_dir():
+    """ /tmp/tmp_<user>, created on first use """
+    dir_tmp = '/tmp/tmp_%s' % get_user()
+    if not os.path.isdir(dir_tmp):
+        os.system('mkdir %s' % dir_tmp)
+    return dir_tmp
 
 def byPage(a,b):
     """compare: if both fields are numeric or num-num sort numeric, alphabetic otherwise"""
@@ -81,17 +89,37 @@ def read_pages(page_filename):
     return page_ranges, add_pages
 
 
-def extract_pages(pdf_filename, cut_page, for_grobid, out_filename):
-    """ replacement for pdftk """
+def extract_pages(pdf_filename, cut_page, for_grobid, out_filename, dir_tmp=None):
+    """
+    replacement for pdftk
+    out_filename is replaced, not overwritten: it may be a link into the pdfstore
+    """
     (first_page, last_page) = cut_page.split('-')
+    if not dir_tmp:
+        dir_tmp = tmp_dir()
 
-    command = 'pdfseparate -f %s -l %s %s %s/' % (first_page, last_page, pdf_filename, DIR_TMP) + 'extracted_%d.pdf'
-    os.system(command)
     pages = range(int(first_page), int(last_page)+1)
-    files = ['%s/extracted_%s.pdf' % (DIR_TMP, page) for page in pages]
-    command = 'pdfunite %s %s/%s' % (' '.join(files) , for_grobid, out_filename)
-    os.system(command)
-    os.system('rm %s' % ' '.join(files))
+    files = ['%s/extracted_%s.pdf' % (dir_tmp, page) for page in pages]
+    tmp_filename = os.path.join(for_grobid, '.%s.%i.tmp' % (out_filename, os.getpid()))
+    try:
+        run_tool(['pdfseparate', '-f', first_page, '-l', last_page, pdf_filename,
+                  '%s/extracted_%%d.pdf' % dir_tmp])
+        missing = [filename for filename in files if not os.path.isfile(filename)]
+        if missing:
+            raise IOError('pdfseparate did not extract pages %s of %s' % (cut_page, pdf_filename))
+        run_tool(['pdfunite'] + files + [tmp_filename])
+        os.rename(tmp_filename, os.path.join(for_grobid, out_filename))
+    finally:
+        for filename in files + [tmp_filename]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+def run_tool(command):
+    """Run a poppler tool, IOError if it fails."""
+    try:
+        subprocess.check_call(command)
+    except (OSError, subprocess.CalledProcessError) as err:
+        raise IOError('%s failed: %s' % (command[0], err))
 
 def convert_version(pdf_filename):
     """ to avoid error from pdfunite, convert pdf to v1.4 if necessary """
@@ -105,18 +133,78 @@ def convert_version(pdf_filename):
         os.system(command)
     
     
-def cut_pdf(pdf_filename, page_filename, working_dir=None):
+def optimize_pdf(pdf_filename, linearize=False):
+    """
+    pdfunite gives every contribution its own copies of fonts and images.
+    Rewrite the pdf with ghostscript: drop unused objects, share duplicate
+    resources, linearize on request. Keep the result only if it is smaller.
+    """
+    optimized_filename = pdf_filename.replace(".pdf", "_optimized.pdf")
+    command = "gs -q -dBATCH -dNOPAUSE -sDEVICE=pdfwrite -dCompatibilityLevel=1.4 " \
+              "-dDetectDuplicateImages=true -dCompressFonts=true -dSubsetFonts=true " \
+              "-dFastWebView=%s -o %s %s" % ('true' if linearize else 'false',
+                                             optimized_filename, pdf_filename)
+    if os.system(command) == 0 and os.path.isfile(optimized_filename) and \
+            0 < os.path.getsize(optimized_filename) < os.path.getsize(pdf_filename):
+        os.rename(optimized_filename, pdf_filename)
+        return True
+    if os.path.isfile(optimized_filename):
+        os.remove(optimized_filename)
+    return False
+
+def slim_pdf(pdf_filename, out_filename, resolution=72):
+    """
+    Copy of pdf_filename with downsampled images for Grobid,
+    text extraction does not need full-resolution figures.
+    Return out_filename, or pdf_filename if ghostscript failed.
+    """
+    command = "gs -q -dBATCH -dNOPAUSE -sDEVICE=pdfwrite -dCompatibilityLevel=1.4 " \
+              "-dDownsampleColorImages=true -dColorImageResolution=%i " \
+              "-dDownsampleGrayImages=true -dGrayImageResolution=%i " \
+              "-dDownsampleMonoImages=true -dMonoImageResolution=%i " \
+              "-o %s %s" % (resolution, resolution, 2 * resolution, out_filename, pdf_filename)
+    if os.system(command) == 0 and os.path.isfile(out_filename) and os.path.getsize(out_filename):
+        return out_filename
+    return pdf_filename
+
+def verify_pages(pdf_filename, page_filename):
+    """
+    Warn about contributions which don't start with a paper or page number (pageindex.py)
+    Only advisory: if the verification fails the cut goes on
+    """
+    import pageindex
+    try:
+        index = pageindex.open_index(pdf_filename)
+        try:
+            warnings = pageindex.verify_cuts(index, page_filename)
+        finally:
+            index.close()
+    except Exception as err:
+        print 'WARNING: can not verify the page file: %s' % err
+        return []
+    for warning in warnings:
+        print 'WARNING: %s' % warning
+    return warnings
+
+def cut_pdf(pdf_filename, page_filename, working_dir=None, optimize=False, linearize=False,
+            verify=False):
     """
     cut fulltext in contributions according to pdf_filename
+    IOError if the fulltext is missing or a contribution can not be cut
     store pieces in working_dir, default is fname_for_grobid where fname is taken from pdf_filename
+    optimize (and linearize) the pieces with optimize_pdf
+    verify: first check the page file against the text of the fulltext (verify_pages)
     """
 
     if not os.path.isfile(pdf_filename):
-        print "Error: can't find fulltext pdf %s\n" % pdf_fulltext
-        exit()
+        raise IOError("can't find fulltext pdf %s" % pdf_filename)
+
+    with profiling.span('convert_version'):
+        convert_version(pdf_filename)
+    if verify:
+        with profiling.span('verify_pages'):
+            verify_pages(pdf_filename, page_filename)
 
-    convert_version(pdf_filename)
-    
     basename = os.path.basename(pdf_filename)
     basename = re.sub('[-_]?fulltext', '', os.path.splitext(basename)[0])
     if not working_dir:
@@ -130,12 +218,21 @@ def cut_pdf(pdf_filename, page_filename, working_dir=None):
     page_ranges, nopages = read_pages(page_filename)
     artids = page_ranges.keys()
     artids.sort(byPage)
-    for artid in artids:
-        cut_page = page_ranges[artid]
-        out_filename = '%s_%s.pdf' % (basename, artid)
-        cut_files.append(out_filename)
-        print 'split %s pages %s to %s/%s' % (pdf_filename, cut_page, for_grobid, out_filename)
-        extract_pages(pdf_filename, cut_page, for_grobid, out_filename)
+    # own directory for the single pages, several volumes may be cut at the same time
+    cut_tmp = tempfile.mkdtemp(prefix='cut_', dir=tmp_dir())
+    try:
+        for artid in artids:
+            cut_page = page_ranges[artid]
+            out_filename = '%s_%s.pdf' % (basename, artid)
+            cut_files.append(out_filename)
+            print 'split %s pages %s to %s/%s' % (pdf_filename, cut_page, for_grobid, out_filename)
+            with profiling.span('extract_pages'):
+                extract_pages(pdf_filename, cut_page, for_grobid, out_filename, cut_tmp)
+            if optimize or linearize:
+                with profiling.span('optimize_pdf'):
+                    optimize_pdf(os.path.join(for_grobid, out_filename), linearize)
+    finally:
+        shutil.rmtree(cut_tmp, ignore_errors=True)
 
     print 'Extracted %s pdf files into directory\n%s\n' % (len(cut_files), for_grobid)
 
@@ -151,11 +248,18 @@ def cut_pdf(pdf_filename, page_filename, working_dir=None):
 
 def main(argv):
     "main function"
-    helptext = "Usage: cutpdf_for_grobid.py -f pdf_filename -p page_filename\nBoth arguments needed"
+    helptext = "Usage: cutpdf_for_grobid.py -f pdf_filename -p page_filename [-z] [-l] [-v]\nBoth arguments needed\n" \
+               "-z: optimize size of the contributions, -l: also linearize them\n" \
+               "-v: check first pages and page numbers of the contributions before cutting\n" \
+               "--profile: timing of the stages, --cprofile=<stage,...>: also cProfile these stages"
     pdf_filename = ''
     page_filename = ''
+    optimize = False
+    linearize = False
+    verify = False
     try:
-        opts, args = getopt.getopt(argv, "f:p:", ["pdf_filename=", "page_filename="])
+        opts, args = getopt.getopt(argv, "f:p:zlv", ["pdf_filename=", "page_filename=",
+                                                        "profile", "cprofile="])
     except getopt.GetoptError:
         print(helptext)
         sys.exit(2)
@@ -164,9 +268,24 @@ def main(argv):
             pdf_filename = arg
         elif opt in ("-p", "--page_filename"):
             page_filename = arg
+        elif opt == '-z':
+            optimize = True
+        elif opt == '-l':
+            linearize = True
+        elif opt == '-v':
+            verify = True
+        elif opt in ("--profile", "--cprofile"):
+            profiling.parse_option(opt, arg)
 
     if pdf_filename and page_filename:
-        cut_pdf(pdf_filename, page_filename)
+        with profiling.span('cut_pdf'):
+            try:
+                cut_pdf(pdf_filename, page_filename, optimize=optimize, linearize=linearize,
+                        verify=verify)
+            except IOError as err:
+                print 'Error: %s' % err
+                sys.exit(1)
+        profiling.write_report('cutpdf_profile')
     else:
         print helptext
 
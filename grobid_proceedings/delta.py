@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprints of the exported records for delta exports (execute_grobid.py --delta).
+
+An export with --delta writes grobid.split_<id>.fingerprints.json next to
+the output: the sha1 of each record (as it goes into the output, with
+affiliations and references) by artid or page range. The records which are
+new or changed since the previous --delta export go into
+grobid.split_<id>.update.<ext> and the artids / page ranges which are gone
+into grobid.split_<id>.removed.txt, so a correction of two contributions
+means two records to mail and re-ingest. The first --delta export of a
+volume has all records as new.
+
+Fields which depend on the run, not on the contribution (RUN_FIELDS: the
+595 note with the login of the curator, the FFT with the path of the web
+directory), are not part of the fingerprint.
+"""
+
+import hashlib
+import json
+import os
+
+RUN_FIELDS = ('595', 'FFT')
+
+
+def fingerprint(marcdict):
+    """
+    sha1 of the record without RUN_FIELDS, independent of the order of the
+    fields and the output format.
+    """
+    content = dict((tag, value) for tag, value in marcdict.items() if tag not in RUN_FIELDS)
+    return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+
+def fingerprints_filename(output_dir, basename):
+    return os.path.join(output_dir, 'grobid.split_%s.fingerprints.json' % basename)
+
+
+def removed_filename(output_dir, basename):
+    return os.path.join(output_dir, 'grobid.split_%s.removed.txt' % basename)
+
+
+class Fingerprints(object):
+    """Fingerprints of the previous export and of the records of this one."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = {}
+        if os.path.isfile(filename):
+            with open(filename) as fingerprint_file:
+                self.previous = json.load(fingerprint_file)
+        self.current = {}
+
+    def add(self, key, marcdict):
+        """Remember the record of key, return 'new', 'changed' or None if unchanged."""
+        self.current[key] = fingerprint(marcdict)
+        if key not in self.previous:
+            return 'new'
+        if self.previous[key] != self.current[key]:
+            return 'changed'
+        return None
+
+    def removed(self):
+        """Keys of the previous export which are not in this one."""
+        return sorted([key for key in self.previous if key not in self.current])
+
+    def save(self):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fingerprint_file:
+            json.dump(self.current, fingerprint_file, sort_keys=True, indent=0)
+        os.rename(tmp_filename, self.filename)
+
+
+def write_removed(output_dir, basename, keys):
+    """List of the removed artids / page ranges, one per line. Return the filename."""
+    filename = removed_filename(output_dir, basename)
+    with open(filename, 'w') as removed_file:
+        for key in keys:
+            removed_file.write('%s\n' % key)
+    return filename
@@ -42,16 +42,24 @@ import getopt
 import os
 import re
 import copy
+import datetime
 import textwrap
 
 import fnmatch
+import hashlib
 import json
-import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 
-import requests
-
-from cutpdf_for_grobid import read_pages
-import mapping, utils, pdf_upload_path
+# requests and lxml (mapping) are imported when needed, runs with -s (PBN only)
+# never contact Grobid or parse TEI
+from cutpdf_for_grobid import read_pages, slim_pdf
+import utils, pdf_upload_path, serializers, names, pdfstore, profiling
+from affiliations import AffiliationTable
+from shards import ShardWriter
+from delta import Fingerprints, fingerprints_filename, write_removed
 
 #input_dir = "test/"
 #GROBID_HOST = "http://localhost:8080/"  # Local installation
@@ -61,7 +69,221 @@ import mapping, utils, pdf_upload_path
 GROBID_HOST = "https://grobid.inspirebeta.net/api"
 #GROBID_HOST = "https://grobid.inspirehep.net/api"
 
-grobid_likes_not = []
+# shared by all volumes processed in one python process (see batch_grobid.py)
+GROBID_CONCURRENCY = 4
+grobid_slots = threading.BoundedSemaphore(GROBID_CONCURRENCY)
+TEI_CACHE_SIZE = 64
+# cached results are kept per Grobid version (and slim copy), see cache_key
+tei_cache = OrderedDict()
+tei_cache_lock = threading.Lock()
+tei_cache_dir = None
+_session = None
+# reference stage (-r), separate from the fulltext requests
+REFERENCE_CONCURRENCY = 2
+reference_slots = threading.BoundedSemaphore(REFERENCE_CONCURRENCY)
+REFERENCES_SUFFIX = '.refs.tei.xml'
+# TEI responses are parsed while they arrive (mapping.TeiFeed), without the
+# reference stage only up to </teiHeader>; these partial TEIs are cached apart
+TEI_CHUNK_SIZE = 64 * 1024
+HEADER_SUFFIX = '.header.tei.xml'
+# local header extraction (--local): 'fallback' when Grobid fails, 'prepass'
+# skips Grobid if the local guess has at least LOCAL_CONFIDENCE
+LOCAL_MODES = ('fallback', 'prepass')
+LOCAL_CONFIDENCE = 1.0
+# collaboration papers (--max-authors): keep the collaboration and the first
+# MAX_AUTHORS authors of longer author lists, 0 keeps all
+MAX_AUTHORS = 0
+# deadline of a volume (--deadline): no Grobid requests are started and
+# running ones are abandoned DEADLINE_MARGIN seconds before it, the time
+# left for the export; the remaining contributions get PBN-only records
+DEADLINE_MARGIN = 60
+# further Grobid hosts (--hosts), each with GROBID_CONCURRENCY request slots
+GROBID_HOSTS = []
+host_slots = {}
+host_slots_lock = threading.Lock()
+# host: (version, time asked), asked again after GROBID_VERSION_SECONDS to notice upgrades
+grobid_versions = {}
+GROBID_VERSION_SECONDS = 600
+
+
+def set_grobid_concurrency(nrequests):
+    """Limit the number of simultaneous requests to Grobid (per host) for this process."""
+    global grobid_slots, GROBID_CONCURRENCY
+    GROBID_CONCURRENCY = nrequests
+    grobid_slots = threading.BoundedSemaphore(nrequests)
+    with host_slots_lock:
+        host_slots.clear()
+
+
+def set_grobid_hosts(hosts):
+    """Spread the requests of a volume over these Grobid hosts (see schedule.py)."""
+    global GROBID_HOSTS
+    GROBID_HOSTS = list(hosts)
+
+
+def grobid_hosts():
+    """Grobid hosts to use, GROBID_HOST if no others are set."""
+    return GROBID_HOSTS or [GROBID_HOST]
+
+
+def slots_of(host):
+    """Request slots of a Grobid host."""
+    if not host or host == GROBID_HOST:
+        return grobid_slots
+    with host_slots_lock:
+        if host not in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(GROBID_CONCURRENCY)
+        return host_slots[host]
+
+
+def set_reference_concurrency(nrequests):
+    """Limit the number of simultaneous requests to processReferences."""
+    global reference_slots, REFERENCE_CONCURRENCY
+    REFERENCE_CONCURRENCY = nrequests
+    reference_slots = threading.BoundedSemaphore(nrequests)
+
+
+def set_local_confidence(confidence):
+    """
+    Confidence of the local header guess from which on Grobid is skipped (prepass),
+    ValueError outside of 0..1.
+    """
+    global LOCAL_CONFIDENCE
+    if not 0 <= confidence <= 1:
+        raise ValueError("Confidence must be between 0 and 1, not %s" % confidence)
+    LOCAL_CONFIDENCE = confidence
+
+
+def set_max_authors(max_authors):
+    """Collapse author lists longer than max_authors (0: keep all authors)."""
+    global MAX_AUTHORS
+    MAX_AUTHORS = max_authors
+
+
+def collapsed_note(authors_total):
+    """595 note for an author list collapsed to MAX_AUTHORS."""
+    return {"a": "Author list collapsed: collaboration and first %i of %i authors"
+                 % (MAX_AUTHORS, authors_total)}
+
+
+def parse_deadline(text):
+    """
+    Deadline 'HH:MM' (next time of day) or '+<minutes>' as seconds since the epoch.
+    ValueError if text is neither.
+    """
+    if text.startswith('+'):
+        return time.time() + 60 * float(text[1:])
+    hours, minutes = [int(part) for part in text.split(':')]
+    now = datetime.datetime.now()
+    deadline = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += datetime.timedelta(days=1)
+    return time.mktime(deadline.timetuple())
+
+
+def time_left(deadline):
+    """Seconds left for Grobid before deadline (None: no deadline), can be negative."""
+    if deadline is None:
+        return None
+    return deadline - DEADLINE_MARGIN - time.time()
+
+
+def past_deadline(deadline):
+    return deadline is not None and time_left(deadline) <= 0
+
+
+def set_tei_cache_dir(cache_dir):
+    """Keep Grobid results as <cache_dir>/<ab>/<sha1 of pdf>.tei.xml (see pdfstore.py)."""
+    global tei_cache_dir
+    tei_cache_dir = cache_dir
+
+
+def grobid_version(host=None):
+    """
+    Version of the Grobid service at host, asked again every GROBID_VERSION_SECONDS.
+    None if the service does not tell, then it is asked on the next call.
+    """
+    import requests
+    host = host or GROBID_HOST
+    with host_slots_lock:
+        if host in grobid_versions:
+            version, asked = grobid_versions[host]
+            if time.time() - asked < GROBID_VERSION_SECONDS:
+                return version
+    version = None
+    try:
+        response = get_session().get(os.path.join(host, 'version'), verify=False, timeout=10)
+        if response.status_code == 200:
+            version = response.text.strip()
+            if version.startswith('{'):
+                version = json.loads(version).get('version')
+    except (requests.RequestException, ValueError):
+        pass
+    if not version:
+        return None
+    version = re.sub(r'[^\w.-]', '_', version)[:32]
+    with host_slots_lock:
+        grobid_versions[host] = (version, time.time())
+    return version
+
+
+def cache_key(pdf_hash, host=None, slim=False):
+    """
+    Key of the Grobid results of a pdf: the results of another Grobid version
+    or of the slim copy are not reused. The service is part of the suffix.
+    None while the version is unknown, then results are not cached.
+    """
+    version = grobid_version(host)
+    if version is None:
+        return None
+    return '%s.%s%s' % (pdf_hash, version, '-slim' if slim else '')
+
+
+def read_cached_tei(key, suffix='.tei.xml'):
+    """Grobid result for the pdf with hash key from memory or tei_cache_dir, None if unknown."""
+    if key is None:
+        return None
+    with tei_cache_lock:
+        if key + suffix in tei_cache:
+            return tei_cache[key + suffix]
+    if tei_cache_dir:
+        tei_filename = pdfstore.object_path(tei_cache_dir, key, suffix)
+        if os.path.isfile(tei_filename):
+            with open(tei_filename, 'rb') as tei_file:
+                return tei_file.read()
+    return None
+
+
+def write_cached_tei(key, tei, in_memory=True, suffix='.tei.xml'):
+    """Remember the Grobid result for the pdf with hash key (not without a key)."""
+    if key is None:
+        return
+    if in_memory:
+        with tei_cache_lock:
+            tei_cache[key + suffix] = tei
+            if len(tei_cache) > TEI_CACHE_SIZE:
+                tei_cache.popitem(last=False)
+    if tei_cache_dir:
+        tei_filename = pdfstore.object_path(tei_cache_dir, key, suffix)
+        if not os.path.isdir(os.path.dirname(tei_filename)):
+            os.makedirs(os.path.dirname(tei_filename))
+        tmp_filename = '%s.%i.tmp' % (tei_filename, os.getpid())
+        with open(tmp_filename, 'wb') as tei_file:
+            tei_file.write(tei if isinstance(tei, bytes) else tei.encode('utf-8'))
+        os.rename(tmp_filename, tei_filename)
+
+
+def get_session():
+    """One HTTP session (connection pool) for all requests to Grobid."""
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
 
 def byPage(a,b):
     """compare: if both fields are numeric or num-num sort numeric, alphabetic otherwise"""
@@ -87,44 +309,249 @@ def open_pdf(pdf_file):
     return pdf_string
 
 
-def process_pdf_stream(pdf_file):
-    """Process a PDF file stream with Grobid, returning TEI XML results."""
-    response = requests.post(
-        url=os.path.join(GROBID_HOST, "processFulltextDocument"),
-        files={'input': open_pdf(pdf_file)},
-        verify=False,
-        )
+def open_slim_pdf(pdf_file):
+    """Open a copy of the pdf file with downsampled images as a raw string."""
+    tmp_handle, tmp_filename = tempfile.mkstemp(suffix='.pdf')
+    os.close(tmp_handle)
+    try:
+        return open_pdf(slim_pdf(pdf_file, tmp_filename))
+    finally:
+        os.remove(tmp_filename)
+
+
+def post_pdf_file(url, pdf_file, data=None, stream=False, timeout=None):
+    """
+    Upload pdf_file to Grobid without reading it into memory.
+    Needs requests_toolbelt, otherwise requests builds the request in memory.
+    """
+    with open(pdf_file, 'rb') as pfile:
+        try:
+            from requests_toolbelt import MultipartEncoder
+        except ImportError:
+            return get_session().post(url=url, files={'input': pfile}, data=data, verify=False,
+                                      stream=stream, timeout=timeout)
+        fields = dict(data or {})
+        fields['input'] = (os.path.basename(pdf_file), pfile, 'application/pdf')
+        encoder = MultipartEncoder(fields=fields)
+        return get_session().post(url=url, data=encoder, verify=False, stream=stream,
+                                  headers={'Content-Type': encoder.content_type},
+                                  timeout=timeout)
+
+
+def feed_response(response, feed, deadline=None):
+    """
+    Read the body of a streamed response chunk by chunk into feed (mapping.TeiFeed,
+    or None to only read it). Stop and drop the connection when the feed needs no more.
+    Return the bytes read, None if the deadline passed during the download.
+    """
+    chunks = []
+    try:
+        for chunk in response.iter_content(TEI_CHUNK_SIZE):
+            if past_deadline(deadline):
+                chunks = None
+                break
+            chunks.append(chunk)
+            if feed is not None and feed.feed(chunk):
+                feed.truncated = True
+                break
+    finally:
+        response.close()
+    if feed is not None:
+        feed.close()
+    if chunks is None:
+        return None
+    return b''.join(chunks)
+
+
+def request_grobid(service, pdf_file, pdf_string=None, slots=None, span='grobid_request',
+                   data=None, host=None, feed=None, deadline=None):
+    """
+    Post the pdf (pdf_string or streamed from pdf_file) to the Grobid service,
+    at most as many at a time as slots allows. data are further form fields,
+    e.g. {'consolidateHeader': '1'}. host defaults to GROBID_HOST.
+    With a feed (mapping.TeiFeed) the response is parsed while it arrives
+    and the TEI is returned as utf-8 bytes, up to where the feed stopped.
+    With a deadline the request is not sent once its time is up (see time_left)
+    and abandoned if Grobid does not answer in time. The timeout only limits
+    each socket operation, so the response is streamed and the deadline
+    checked after every chunk; the TEI is then utf-8 bytes too.
+    Return the TEI or None.
+    """
+    import requests
+    with slots or slots_of(host):
+        timeout = time_left(deadline)
+        if timeout is not None and timeout <= 0:
+            return None
+        stream = feed is not None or deadline is not None
+        try:
+            with profiling.span(span):
+                url = os.path.join(host or GROBID_HOST, service)
+                if pdf_string is None:
+                    response = post_pdf_file(url, pdf_file, data, stream=stream,
+                                             timeout=timeout)
+                else:
+                    response = get_session().post(
+                        url=url,
+                        files={'input': pdf_string},
+                        data=data,
+                        verify=False,
+                        stream=stream,
+                        timeout=timeout,
+                        )
+                if stream and response.status_code == 200:
+                    tei = feed_response(response, feed, deadline)
+                    if tei is None:
+                        print("Grobid request abandoned at the deadline: %s" % pdf_file)
+                    return tei
+        except requests.RequestException as err:
+            if past_deadline(deadline):
+                print("Grobid request abandoned at the deadline: %s" % pdf_file)
+            else:
+                print("Grobid request failed: %s. Problematic file: %s" % (err, pdf_file))
+            return None
 
     if response.status_code == 200:
         return response.text
-    else:
-        print("Grobid server error, status code: %i. Problematic file: %s" % (response.status_code, pdf_file))
-        grobid_likes_not.append(pdf_file)
+    print("Grobid server error, status code: %i. Problematic file: %s" % (response.status_code, pdf_file))
+    return None
+
+
+def pdf_key(pdf_file, stream=False):
+    """Return the content of the pdf (None with stream) and its hash."""
+    if stream:
+        return None, pdfstore.file_hash(pdf_file)
+    pdf_string = open_pdf(pdf_file)
+    return pdf_string, hashlib.sha1(pdf_string).hexdigest()
+
+
+def process_pdf_stream(pdf_file, slim=False, stream=False, host=None, feed=None, deadline=None):
+    """
+    Process a PDF file stream with Grobid, returning TEI XML results.
+    With slim Grobid gets a copy with downsampled images.
+    With stream (bounded-memory mode) the pdf is not read into memory and
+    the result is not kept in the in-memory cache.
+    With a feed (mapping.TeiFeed) the TEI is parsed while it is downloaded,
+    feed.root is the parsed TEI unless it came from the cache.
+    After the deadline only cached results are returned.
+    """
+    pdf_string, key = pdf_key(pdf_file, stream)
+    key = cache_key(key, host, slim)
+    tei = read_cached_tei(key)
+    if tei is None and feed is not None and feed.header_only:
+        tei = read_cached_tei(key, HEADER_SUFFIX)
+    if tei is not None or past_deadline(deadline):
+        return tei
+    if slim:
+        with profiling.span('slim_pdf'):
+            pdf_string = open_slim_pdf(pdf_file)
+
+    tei = request_grobid("processFulltextDocument", pdf_file, pdf_string, host=host, feed=feed,
+                         deadline=deadline)
+    if tei is None:
         return None
+    suffix = HEADER_SUFFIX if feed is not None and feed.truncated else '.tei.xml'
+    write_cached_tei(key, tei, not stream, suffix)
+    return tei
+
+
+def process_pdf_references(pdf_file, stream=False, deadline=None):
+    """Process a PDF file with Grobid's processReferences, returning TEI XML or None."""
+    pdf_string, key = pdf_key(pdf_file, stream)
+    key = cache_key(key)
+    tei = read_cached_tei(key, REFERENCES_SUFFIX)
+    if tei is None:
+        tei = request_grobid("processReferences", pdf_file, pdf_string,
+                             reference_slots, 'reference_request', deadline=deadline)
+        if tei is not None:
+            write_cached_tei(key, tei, not stream, REFERENCES_SUFFIX)
+    return tei
+
+def local_header_guess(pdf_path):
+    """Header of the pdf from localheader.extract, None without text."""
+    import localheader
+    with profiling.span('local_header'):
+        return localheader.extract(pdf_path)
+
+
+def process_one_pdf(filename, pdf_path, extract_metadata=True, slim=False, stream=False,
+                    work_queue=None, local_header=None, host=None, header_only=False,
+                    deadline=None):
+    """
+    Process one contribution for process_pdf_dir, return its tuple,
+    None if another worker of the work_queue has it.
+    """
+    if work_queue is not None and not work_queue.claim(filename):
+        return None
+    start = time.time()
+    guess = None
+    if extract_metadata and local_header == 'prepass':
+        guess = local_header_guess(pdf_path)
+    grobid_response = None
+    local = None
+    feed = None
+    if guess and guess['confidence'] >= LOCAL_CONFIDENCE:
+        local = guess
+    elif extract_metadata:
+        import mapping
+        feed = mapping.TeiFeed(header_only)
+        grobid_response = process_pdf_stream(pdf_path, slim, stream, host, feed, deadline)
+        if grobid_response is None and local_header and not past_deadline(deadline):
+            local = guess or local_header_guess(pdf_path)
+    deferred = extract_metadata and grobid_response is None and local is None \
+        and past_deadline(deadline)
+    if work_queue is not None:
+        work_queue.finish(filename, grobid_response is not None or bool(local))
+
+    return (
+        os.path.abspath(pdf_path),
+        parse_filename(filename),
+        grobid_response,
+        time.time() - start,
+        local,
+        feed.root if feed is not None and grobid_response is not None else None,
+        deferred,
+        )
 
-def process_pdf_dir(input_dir, extract_metadata=True):
+
+def process_pdf_dir(input_dir, extract_metadata=True, slim=False, stream=False,
+                    work_queue=None, local_header=None, parallel=1, page_plan=None,
+                    header_only=False, deadline=None):
     """Process the entire directory, but take only pdf files.
 
-    Return cnum, first page, and XML (parsed pdf) in Grobid TEI format.
+    Return path, pages, XML (parsed pdf) in Grobid TEI format, seconds it took,
+    the local guess of the header (see LOCAL_MODES) if it is used instead,
+    the TEI as parsed while it was downloaded (None if it came from the cache)
+    and whether it was left out because of the deadline (see time_left).
+    With header_only the download stops after the teiHeader.
+    With a workqueue.WorkQueue only the pdfs this worker can claim are processed.
+
+    The most expensive contributions (pages from the name or page_plan, bytes)
+    are sent first. With parallel > 1 or several Grobid hosts they are processed
+    by parallel threads per host (see schedule.py) and come in the order they finish.
     """
-    paths = []
-    pdf_files = []
+    import schedule
+    jobs = []
     for root, dirnames, filenames in os.walk(input_dir):
         for filename in fnmatch.filter(filenames, '*.pdf'):
-            paths.append(os.path.join(root, filename))
-            pdf_files.append(filename)
+            pdf_path = os.path.join(root, filename)
+            cost = 0
+            if extract_metadata:
+                cost = schedule.estimate_cost(pdf_path, parse_filename(filename), page_plan)
+            jobs.append((cost, (filename, pdf_path)))
 
-    for filename, pdf_path in zip(pdf_files, paths):
-        if extract_metadata:
-            grobid_response = process_pdf_stream(pdf_path)
-        else:
-            grobid_response = None
+    def process_job(job, host):
+        filename, pdf_path = job
+        return process_one_pdf(filename, pdf_path, extract_metadata, slim, stream,
+                               work_queue, local_header, host, header_only, deadline)
 
-        yield (
-            os.path.abspath(pdf_path),
-            parse_filename(filename),
-            grobid_response,
-            )
+    hosts = grobid_hosts()
+    if extract_metadata and (parallel > 1 or len(hosts) > 1):
+        results = schedule.run(jobs, hosts, process_job, parallel)
+    else:
+        results = (process_job(job, None) for cost, job in schedule.lpt_order(jobs))
+    for result in results:
+        if result is not None:
+            yield result
 
 def read_book_dict(input_dir):
     """Read info from Proceedings / Book record from file."""
@@ -199,40 +626,108 @@ def read_book_dict(input_dir):
     book_dict['773'] = [pbn, ]
     return book_dict
 
-def build_dicts(input_dir, extract_metadata=True):
-    """Create dictionaries from the TEI XML data."""
-    for processed_pdf in process_pdf_dir(input_dir, extract_metadata):
+def build_dicts(input_dir, extract_metadata=True, affiliation_table=None, slim=False,
+                stream=False, reference_stage=None, keep_tei=False, local_header=None,
+                parallel=1, page_plan=None, deadline=None):
+    """
+    Create dictionaries from the TEI XML data, or from the local guess of
+    the header (local_header one of LOCAL_MODES).
+    Contributions left out because of the deadline are marked 'deferred'.
+    Contributions are handed to the reference_stage (references.ReferenceStage) if given.
+    With keep_tei the TEI is part of the dictionary (for the resultstore),
+    so the whole TEI is downloaded even without a reference_stage.
+    """
+    if extract_metadata:
+        import mapping
+    for processed_pdf in process_pdf_dir(input_dir, extract_metadata, slim, stream,
+                                         local_header=local_header, parallel=parallel,
+                                         page_plan=page_plan,
+                                         header_only=reference_stage is None and not keep_tei,
+                                         deadline=deadline):
         rec_dict = {}
-        pdf_path, pages, tei = processed_pdf
+        pdf_path, pages, tei, seconds, local, tei_root, deferred = processed_pdf
         if tei:
-            rec_dict = mapping.tei_to_dict(tei)  # NOTE: this includes some empty elements, which is not cool
+            with profiling.span('tei_to_dict'):
+                rec_dict = mapping.tei_to_dict(tei if tei_root is None else tei_root,
+                                               affiliation_table, max_authors=MAX_AUTHORS)  # NOTE: this includes some empty elements, which is not cool
+        elif local:
+            rec_dict = dict(local, local_header=True)
+        if reference_stage is not None:
+            reference_stage.submit(pages, pdf_path, tei)
         # NOTE: create a record even if pdf could not be grobided
+        # (not failed with a local guess of the header, e.g. skipped by the prepass)
+        rec_dict["grobid_failed"] = extract_metadata and not tei and not deferred and not local
+        rec_dict["deferred"] = deferred
         rec_dict["pdf_path"] = pdf_path
         rec_dict["pages"] = pages
+        if keep_tei:
+            rec_dict["tei"] = tei
+            rec_dict["seconds"] = seconds
         yield rec_dict
 
-def get_authors(aut):
-    """Get author name and affiliation. Format: 'lastname, firstname'."""
-    author_name = ''
-    surname = ''
-    surname, given_names = utils.split_fullname(aut.get("name"), surname_first=False)
-    if surname and "collaboration" in surname.lower():
-        author_name = surname
-    if surname and given_names:
-        if len(given_names) == 1:  # Handle initials
-            given_names += "."
-        given_names = re.sub('\. +', '.', given_names)
-        #author_name = u"{}, {}".format(surname, given_names)  # NOTE: this doesn't work with python 2.6
-        author_name = surname + ", " + given_names
-    elif surname:
-        author_name = surname
+
+def store_dicts(store, recid, input_dir, affiliation_table=None, reference_stage=None):
+    """
+    Dictionaries as from build_dicts, but from a resultstore.ResultStore
+    instead of Grobid. The pdfs are expected in input_dir.
+    """
+    from resultstore import STATUS_DEFERRED, STATUS_FAILED
+    for pages, pdf, status, rec_dict, tei in store.mapped(recid):
+        if affiliation_table is not None:
+            for author in rec_dict.get("authors", []):
+                author["affiliations"] = [affiliation_table.intern(aff["value"])
+                                          for aff in author.get("affiliations", [])]
+        pdf_path = os.path.join(os.path.abspath(input_dir), os.path.basename(pdf))
+        if reference_stage is not None:
+            reference_stage.submit(pages, pdf_path, tei)
+        rec_dict["grobid_failed"] = status == STATUS_FAILED
+        rec_dict["deferred"] = status == STATUS_DEFERRED
+        rec_dict["pdf_path"] = pdf_path
+        rec_dict["pages"] = pages
+        yield rec_dict
+
+
+def mapped_dict(dic, affiliation_table=None):
+    """The part of a dictionary of build_dicts which came from Grobid, affiliations as values."""
+    mapped = dict((key, value) for key, value in dic.items()
+                  if key not in ("pdf_path", "pages", "grobid_failed", "deferred", "tei",
+                                 "seconds", "confidence"))
+    if affiliation_table is not None and mapped.get("authors"):
+        mapped["authors"] = [dict(author, affiliations=[
+            {"value": value} for value in affiliation_table.resolve(author.get("affiliations", []))])
+                             for author in mapped["authors"]]
+    return mapped
+
+# fields Grobid should deliver and the MARC fields they end up in
+METADATA_FIELDS = ("authors", "title", "abstract")
+MARC_FIELDS = {"authors": ("100", "110", "700"), "title": ("245",), "abstract": ("520",)}
+GROBID_NOTE = "From Grobid by %s: title, authors, affiliations, abstract"
+
+
+def get_affiliations(aut):
+    """
+    Get affiliations of an author without the enclosing parentheses.
+    Ids of an AffiliationTable are returned as they are.
+    """
     affiliations = []
     aff_raws = aut.get("affiliations")
     if aff_raws:
         for aff in aff_raws:
-            affiliations.append(aff.get("value").strip("()"))
+            if isinstance(aff, int):
+                affiliations.append(aff)
+            else:
+                affiliations.append(aff.get("value").strip("()"))
+    return affiliations
+
+def get_authors(aut):
+    """Get author name and affiliation. Format: 'lastname, firstname'."""
+    author_name = names.normalize_name(aut.get("name"))
+    return author_name, get_affiliations(aut)
 
-    return author_name, affiliations
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
 
 def number_of_pages(pages):
     """Given a page range return number of pages as string"""
@@ -243,17 +738,172 @@ def number_of_pages(pages):
     else:
         return None
 
-def build_marc_xml(input_dir, output_dir, page_filename, extract_metadata=True):
-    """Build a MARCXML file from the HEPRecord dictionary."""
-    all_records = {}
+def add_metadata(marcdict, dic, counter, extract_metadata=True):
+    """
+    Add authors, title and abstract of the Grobid dictionary dic to marcdict.
+    Return the METADATA_FIELDS Grobid did not find.
+    """
+    missing = []
+    # skip authors without name and affiliations; empty values are treated like missing ones
+    authors = [author for author in dic.get("authors") or [] if any(author.itervalues())]
+    if authors:
+        counter["authors"] += 1
+        marcdict["100"] = []
+        marcdict["110"] = []
+        marcdict["700"] = []
+        # Only the first author should be put in the 100 field, others to 700
+        marcfield = "100"
+        author_names = names.normalize_names([aut.get("name") for aut in authors])
+        for aut, author_name in zip(authors, author_names):
+            affiliations = get_affiliations(aut)
+            if not author_name:
+                # "If you have a separate field for the affiliation it should always be 110 and no subfield $$a."
+                marcdict["110"].append({"v":affiliations})
+            else:
+                marcdict[marcfield].append({"a": author_name, "v": affiliations})
+                marcfield = "700"
+    else:
+        missing.append("authors")
+        if extract_metadata:
+            marcdict["100"] = [{"a": ""}, ]
+
+    title = dic.get("title")
+    if title:
+        marcdict["245"] = {"a": title}
+        counter["title"] += 1
+    else:
+        missing.append("title")
+        if extract_metadata:
+            marcdict["245"] = {"a": ""}
+
+    abstract =  dic.get("abstract")
+    if abstract:
+        abstract =  textwrap.fill(abstract, 80) + '\n'
+        # source of the abstract: Grobid or the local guess of localheader.py
+        source = "localheader" if dic.get("local_header") else "Grobid"
+        marcdict["520"] = {"a": abstract, "9": source}
+        counter["abstract"] += 1
+    else:
+        missing.append("abstract")
+    return missing
+
+def state_filename(output_dir, basename):
+    """
+    Sidecar of the output with one line per contribution, see retry_grobid.py.
+    The first line has the output settings of the run.
+    """
+    return os.path.join(output_dir, 'grobid.split_%s.state.jsonl' % basename)
+
 
-    user = os.getlogin()
+def topup_filename(output_dir, basename):
+    """Contributions which only got PBN-only records because of the deadline."""
+    return os.path.join(output_dir, 'grobid.split_%s.topup.txt' % basename)
+
+
+def write_topup(output_dir, basename, contributions):
+    """
+    List the contributions (pages, pdf) left for a top-up run, remove the
+    list of a previous run if there are none. Return the filename or None.
+    """
+    filename = topup_filename(output_dir, basename)
+    if not contributions:
+        if os.path.isfile(filename):
+            os.remove(filename)
+        return None
+    with open(filename, 'w') as topup_file:
+        topup_file.write('# top up with: python retry_grobid.py -s %s -m fulltext\n'
+                         % state_filename(output_dir, basename))
+        for pages, pdf_path in contributions:
+            topup_file.write('%s\t%s\n' % (pages, pdf_path))
+    return filename
+
+
+def build_marc_xml(input_dir, output_dir, page_filename, extract_metadata=True,
+                   output_format='marcxml', max_records=0, max_bytes=0, archive=False,
+                   name_cache=None, publish_dir=None, slim=False, memory_limit=None,
+                   references=False, store=None, from_store=False, local_header=None,
+                   parallel=1, delta=False, deadline=None, topup=None, user=None):
+    """
+    Build a MARCXML file (or one of serializers.FORMATS) from the HEPRecord dictionary.
+    With max_records/max_bytes the output is split in shards, with archive
+    the shards are packed into grobid.split_<id>.tar.gz (see shards.ShardWriter).
+    name_cache is a file to share normalized author names between runs.
+    publish_dir is the web directory for the FFT URLs if input_dir is a local
+    staging copy (see staging.py).
+    With slim Grobid gets copies of the pdfs with downsampled images.
+
+    Bounded-memory mode (memory_limit in bytes): pdfs are streamed to Grobid,
+    Grobid results are not cached in memory and finished records beyond
+    memory_limit are spilled to a temporary file (spool.RecordSpool).
+
+    With references the contributions get 999C5 fields (see references.py).
+
+    With extract_metadata the records and the fields Grobid did not find
+    are also written to grobid.split_<id>.state.jsonl for retry_grobid.py.
+
+    With a resultstore.ResultStore every contribution is saved in the store;
+    from_store exports the contributions saved in the store without Grobid
+    (e.g. after a fix of <recid>_metadata.txt), ValueError if it has none of
+    this volume.
+
+    local_header (one of LOCAL_MODES) guesses title, authors and abstract
+    from the first page (localheader.py) if Grobid fails or instead of Grobid;
+    these records get their own 595 note.
+
+    parallel: number of contributions sent to each Grobid host at the same
+    time, the most expensive first (see schedule.py).
+
+    With delta the new and changed records since the previous delta export
+    are also written to grobid.split_<id>.update.<ext> and the removed ones
+    are listed in grobid.split_<id>.removed.txt; the fingerprints of the
+    records are kept in grobid.split_<id>.fingerprints.json (see delta.py).
+
+    deadline (seconds since the epoch): DEADLINE_MARGIN seconds before it
+    no more requests are sent to Grobid and running ones are abandoned; the
+    remaining contributions get PBN-only records (as with extract_metadata
+    False) and are listed in grobid.split_<id>.topup.txt and the list topup
+    if given. retry_grobid.py with the state file fills them in later.
+
+    user is the login for the 595 note, default is the login of this process.
+
+    Return number of records, output file and the page ranges of the
+    contributions Grobid could not process (without a local header guess).
+    """
+    if memory_limit:
+        from spool import RecordSpool
+        all_records = RecordSpool(memory_limit)
+    else:
+        all_records = {}
+    serializer = serializers.get_format(output_format)
+
+    user = user or pdf_upload_path.get_user()
     page_ranges, add_pages = read_pages(page_filename)
     basename = re.sub('_for_grobid', '', os.path.basename(input_dir))
 
-    book_dict = read_book_dict(input_dir)
-    counter = {"authors": 0, "title": 0, "abstract": 0}
-    for dic in build_dicts(input_dir, extract_metadata):
+    with profiling.span('read_book_dict'):
+        book_dict = read_book_dict(input_dir)
+    names.load_cache(name_cache)
+    affiliation_table = AffiliationTable()
+    contributions = {}
+    not_processed = []
+    counter = {"authors": 0, "title": 0, "abstract": 0, "references": 0, "collapsed": 0}
+    reference_stage = None
+    if references and extract_metadata:
+        from references import ReferenceStage
+        reference_stage = ReferenceStage(
+            lambda pdf_path: process_pdf_references(pdf_path, bool(memory_limit), deadline),
+            REFERENCE_CONCURRENCY)
+    if store is not None and from_store:
+        if not store.status_counts(basename):
+            raise ValueError("No contributions of %s in the store %s"
+                             % (basename, store.filename))
+        dicts = store_dicts(store, basename, input_dir, affiliation_table, reference_stage)
+    else:
+        dicts = build_dicts(input_dir, extract_metadata, affiliation_table, slim,
+                            stream=bool(memory_limit), reference_stage=reference_stage,
+                            keep_tei=store is not None, local_header=local_header,
+                            parallel=parallel, page_plan=page_ranges, deadline=deadline)
+    for dic in dicts:
         marcdict = copy.deepcopy(book_dict)
 
         if "pages" in dic.keys():
@@ -278,52 +928,23 @@ def build_marc_xml(input_dir, output_dir, page_filename, extract_metadata=True):
         else:
             marcdict['773'] = [{'c': pbn_pages}, ]
 
-        if extract_metadata:
-            marcdict["595"] = {"a": "From Grobid by %s: title, authors, affiliations, abstract" % user}
+        deferred = dic.get("deferred", False)
+        if extract_metadata and not deferred:
+            marcdict["595"] = {"a": GROBID_NOTE % user}
         else:
             marcdict["595"] = {"a": "From Grobid by %s: PBN only" % user}
+        if dic.get("local_header"):
+            marcdict["595"] = {"a": "From local header extraction by %s: title, authors, abstract" % user}
+        if dic.get("authors_total"):
+            marcdict["595"] = [marcdict["595"], collapsed_note(dic["authors_total"])]
+            counter["collapsed"] += 1
 
-        authors_raw = dic.get("authors")
-        authors = []
-        if authors_raw:
-            # delete authors which have empty values:
-            for author in authors_raw:
-                author_not_empty = dict((k, v) for k, v in author.iteritems() if v)
-                if author_not_empty:
-                    authors.append(author_not_empty)
-        if authors:
-            counter["authors"] += 1
-            marcdict["100"] = []
-            marcdict["110"] = []
-            marcdict["700"] = []
-            # Only the first author should be put in the 100 field, others to 700
-            marcfield = "100"
-            for aut in authors:
-                author_name, affiliations = get_authors(aut)
-                if not author_name:
-                    # "If you have a separate field for the affiliation it should always be 110 and no subfield $$a."
-                    marcdict["110"].append({"v":affiliations})
-                else:
-                    author_name, affiliations = get_authors(aut)
-                    marcdict[marcfield].append({"a": author_name, "v": affiliations})
-                    marcfield = "700"
-        elif extract_metadata:
-            marcdict["100"] = [{"a": ""}, ]
-
-        title = dic.get("title")
-        if title:
-            marcdict["245"] = {"a": title}
-            counter["title"] += 1
-        elif extract_metadata:
-            marcdict["245"] = {"a": ""}
+        missing = add_metadata(marcdict, dic, counter, extract_metadata and not deferred)
 
-        abstract =  dic.get("abstract")
-        if abstract:
-            abstract =  textwrap.fill(abstract, 80) + '\n'
-            marcdict["520"] = {"a": abstract, "9": "Grobid"}
-            counter["abstract"] += 1
-
-        upload_path = pdf_upload_path.pdf_url(dic["pdf_path"])
+        pdf_path = dic["pdf_path"]
+        if publish_dir:
+            pdf_path = os.path.join(os.path.abspath(publish_dir), os.path.basename(pdf_path))
+        upload_path = pdf_upload_path.pdf_url(pdf_path)
         
         marcdict["FFT"] = {
             "a": upload_path,
@@ -331,25 +952,18 @@ def build_marc_xml(input_dir, output_dir, page_filename, extract_metadata=True):
             "t": "INSPIRE-PUBLIC",
             }
 
-        # NOTE: we don't need the references at this point
-        #marcdict["999C5"] = []
-        #for ref in dic["references"]:
-            #authors = ", ".join([aut["name"] for aut in ref["authors"]])
-            #title = ref["journal_pubnote"].get("journal_title", "")
-            #volume = ref["journal_pubnote"].get("journal_volume", "")
-            #pages = ref["journal_pubnote"].get("page_range", "")
-            #year = ref["journal_pubnote"].get("year", "")
-            #pubnote = u"{},{},{}".format(title, volume, pages)
-            #marcdict["999C5"].append({"s":pubnote, "y":year})
-
+        # the 999C5 fields of the reference stage are added at the export
         all_records[pages] = marcdict
-
-    all_records_marc = ''
-    all_pages = all_records.keys()
-    all_pages.sort(byPage)
-    for pages in all_pages:
-        marcdict = all_records[pages]
-        all_records_marc += utils.legacy_export_as_marc(marcdict, no_empty_fields=False)
+        contributions[pages] = (pdf_path, missing, dic["grobid_failed"], deferred)
+        if dic["grobid_failed"]:
+            not_processed.append(pages)
+        if store is not None and not from_store:
+            from resultstore import contribution_status
+            with profiling.span('store'):
+                store.put(basename, pages, pdf_path, pdfstore.file_hash(dic["pdf_path"]),
+                          contribution_status(extract_metadata, dic["tei"], missing,
+                                              dic.get("local_header"), deferred), missing,
+                          dic["tei"], mapped_dict(dic, affiliation_table), dic["seconds"])
 
 # Write one big file for the whole directory
     basename = 'grobid_' + os.path.basename(input_dir).replace('_for_grobid', '')
@@ -369,26 +983,111 @@ def build_marc_xml(input_dir, output_dir, page_filename, extract_metadata=True):
     basename = '%s' % basename
     basename = re.sub('[^\w.-]','_', basename)
 
+    reference_fields = {}
+    if reference_stage is not None:
+        with profiling.span('reference_wait'):
+            reference_fields = reference_stage.finish()
+
     print("\v\vFinished processing...")
-    filename = "grobid.split_%s.xml" % basename
-    path_filename = os.path.join(output_dir, filename)
-    outfile = open(path_filename, "w")
-    outfile.write("<collection>\n")
-    outfile.write(all_records_marc)
-    outfile.write("</collection>\n")
-    outfile.close()
-    print("Wrote %s records to %s" % (len(all_records.keys()), path_filename))
+    writer = ShardWriter(output_dir, basename, serializer, max_records, max_bytes, archive)
+    fingerprints = None
+    update_writer = None
+    if delta:
+        fingerprints = Fingerprints(fingerprints_filename(output_dir, basename))
+        update_writer = ShardWriter(output_dir, basename + '.update', serializer,
+                                    max_records, max_bytes, archive)
+    changes = {'new': 0, 'changed': 0}
+    topup_contributions = []
+    state = None
+    if extract_metadata:
+        state = open(state_filename(output_dir, basename) + '.tmp', 'w')
+        state.write(json.dumps({"settings": {
+            "output_format": output_format, "max_records": max_records, "max_bytes": max_bytes,
+            "archive": archive, "delta": delta, "max_authors": MAX_AUTHORS,
+            "store": os.path.abspath(store.filename) if store is not None else None}}) + '\n')
+    all_pages = all_records.keys()
+    all_pages.sort(byPage)
+    try:
+        for number, pages in enumerate(all_pages, 1):
+            marcdict = affiliation_table.resolve_record(all_records[pages])
+            if reference_fields.get(pages):
+                marcdict["999C5"] = reference_fields[pages]
+                counter["references"] += 1
+            with profiling.span('export'):
+                record = serializer['record'](marcdict, number)
+            writer.write(pages, record)
+            change = fingerprints.add(pages, marcdict) if fingerprints is not None else None
+            if change:
+                changes[change] += 1
+                with profiling.span('export'):
+                    update_writer.write(pages, serializer['record'](marcdict,
+                                                                    update_writer.nrecords + 1))
+            pdf_path, missing, failed, pbn_only = contributions[pages]
+            if pbn_only:
+                topup_contributions.append((pages, pdf_path))
+            if state is not None:
+                state.write(json.dumps({"pages": pages, "pdf": pdf_path, "missing": missing,
+                                        "failed": failed, "deferred": pbn_only,
+                                        "record": marcdict}) + '\n')
+        path_filename = writer.close()
+        if update_writer is not None:
+            update_filename = update_writer.close()
+    except ValueError:
+        # e.g. a record too long for ISO 2709: no partial output
+        for shard_writer in (writer, update_writer):
+            if shard_writer is not None:
+                shard_writer.abort()
+        if state is not None:
+            state.close()
+            os.remove(state.name)
+        raise
+    if update_writer is not None:
+        removed = fingerprints.removed()
+        removed_filename = write_removed(output_dir, basename, removed)
+        fingerprints.save()
+    if state is not None:
+        state.close()
+        os.rename(state.name, state_filename(output_dir, basename))
+        topup_path = write_topup(output_dir, basename, topup_contributions)
+    if topup is not None:
+        topup.extend([pages for pages, pdf_path in topup_contributions])
+    if store is not None:
+        store.commit()
+    nrecords = len(all_records)
+    if writer.sharded:
+        print("Wrote %s records in %s shards to %s" % (nrecords, writer.shard_number, path_filename))
+    else:
+        print("Wrote %s records to %s" % (nrecords, path_filename))
+    if update_writer is not None:
+        print("Delta: %i new and %i changed records in %s, %i removed in %s"
+              % (changes['new'], changes['changed'], update_filename, len(removed), removed_filename))
     if extract_metadata:
         print("%5d records with authors" % (counter["authors"]))
         print("%5d records with titles" % (counter["title"]))
-        print("%5d records with abstracts\n" % (counter["abstract"]))
+        print("%5d records with abstracts" % (counter["abstract"]))
+        if reference_stage is not None:
+            print("%5d records with references" % (counter["references"]))
+        if MAX_AUTHORS:
+            print("%5d records with collapsed author lists" % (counter["collapsed"]))
+        if topup_contributions:
+            print("%5d records PBN only because of the deadline, listed in %s"
+                  % (len(topup_contributions), topup_path))
+        print("%5d distinct affiliations\n" % len(affiliation_table))
     else:
         print("Metadata extraction skipped\n")
 
-    if grobid_likes_not:
-        print("Following pdfs were not processed: " + ", ".join(grobid_likes_not))
+    names.save_cache(name_cache)
+    if memory_limit:
+        print("%5d records spilled to disk" % all_records.spilled())
+        all_records.close()
+    print("Peak memory (RSS): %.1f MB" % peak_rss_mb())
+
+    not_processed.sort(byPage)
+    if not_processed:
+        print("Following pdfs were not processed: "
+              + ", ".join([contributions[pages][0] for pages in not_processed]))
 
-    return len(all_records.keys()), path_filename
+    return nrecords, path_filename, not_processed
 
 def main(argv):
     """Main function."""
@@ -401,19 +1100,62 @@ def main(argv):
         "* There should be a file <base_dir>_metadata.txt (i.e. 1776837_metadata.txt)\n"
         "  that contains information from the Book or Proceedings record in text marc,\n"
         "* -s: Skip extraction of metadata from pdf.\n"
+        "* -f <format>: output format, one of %s (default marcxml)\n"
+        "* -n <records>, -b <bytes>: split output in shards of at most <records> or <bytes>\n"
+        "* -z: pack output into grobid.split_<id>.tar.gz\n"
+        "* -c <file>: cache of normalized author names shared between runs\n"
+        "* --slim: send copies with downsampled images to Grobid\n"
+        "* -m <MB>: bounded-memory mode, keep at most <MB> of records in memory\n"
+        "* -r: add the references as 999C5 (processReferences for pdfs without bibliography)\n"
+        "* --ref-requests=<n>: parallel requests of the reference stage (default %i)\n"
+        "* --local=fallback|prepass: guess the header from the first page if Grobid fails,\n"
+        "  or before Grobid, which is skipped if the guess is complete\n"
+        "* --local-confidence=<0..1>: confidence of the guess to skip Grobid (default 1.0)\n"
+        "* --max-authors=<n>: keep only the collaboration and the first <n> of longer author lists\n"
+        "* -j <n>: send <n> contributions to Grobid at the same time, largest first\n"
+        "* --hosts=<url,url,...>: spread the contributions over these Grobid hosts\n"
+        "* -d <file>: save the results per contribution in this SQLite store\n"
+        "* --from-store: export the contributions of the store again, without Grobid\n"
+        "* --delta: also write only the records changed since the last export to\n"
+        "  grobid.split_<id>.update.<ext> and the removed ones to grobid.split_<id>.removed.txt\n"
+        "* --deadline=<HH:MM|+minutes>: finish by then, contributions Grobid has not done\n"
+        "  %i seconds before get PBN-only records and are listed in grobid.split_<id>.topup.txt\n"
+        "* --profile: write timing of the stages to grobid_profile.trace.json/.txt\n"
+        "* --cprofile=<stage,...>: also run these stages under cProfile, e.g. tei_to_dict,export\n"
         "* Output MARCXML record will be written to <output_dir>, default is '.'\n "
-        )
+        ) % (', '.join(sorted(serializers.FORMATS.keys())), REFERENCE_CONCURRENCY,
+             DEADLINE_MARGIN)
     input_dir = ''
     output_dir = '.'
 
     try:
-        opts, args = getopt.getopt(argv, "hsi:o:p:", ["idir=", "odir=", "pfile=" ])
+        opts, args = getopt.getopt(argv, "hszri:o:p:f:n:b:c:m:d:j:",
+                                   ["idir=", "odir=", "pfile=", "format=", "records=", "bytes=",
+                                    "name-cache=", "slim", "profile", "cprofile=",
+                                    "memory=", "references", "ref-requests=",
+                                    "store=", "from-store", "local=",
+                                    "local-confidence=", "parallel=", "hosts=", "delta",
+                                    "max-authors=", "deadline="])
     except getopt.GetoptError:
         print(helptext)
         sys.exit(2)
 
     page_filename = ""
     extract_metadata = True
+    output_format = 'marcxml'
+    max_records = 0
+    max_bytes = 0
+    archive = False
+    name_cache = None
+    slim = False
+    memory_limit = None
+    references = False
+    store_filename = None
+    from_store = False
+    local_header = None
+    parallel = 1
+    delta = False
+    deadline = None
     for opt, arg in opts:
         if opt == '-h':
             print(helptext)
@@ -426,11 +1168,82 @@ def main(argv):
             output_dir = arg
         elif opt in ("-p", "--pfile"):
             page_filename = arg
+        elif opt in ("-f", "--format"):
+            if arg not in serializers.FORMATS:
+                print(helptext)
+                sys.exit(2)
+            output_format = arg
+        elif opt in ("-n", "--records"):
+            max_records = int(arg)
+        elif opt in ("-b", "--bytes"):
+            max_bytes = int(arg)
+        elif opt == '-z':
+            archive = True
+        elif opt in ("-c", "--name-cache"):
+            name_cache = arg
+        elif opt == "--slim":
+            slim = True
+        elif opt in ("-m", "--memory"):
+            memory_limit = int(float(arg) * 1024 * 1024)
+        elif opt in ("-r", "--references"):
+            references = True
+        elif opt == "--ref-requests":
+            set_reference_concurrency(int(arg))
+        elif opt in ("-d", "--store"):
+            store_filename = arg
+        elif opt == "--from-store":
+            from_store = True
+        elif opt == "--local":
+            if arg not in LOCAL_MODES:
+                print(helptext)
+                sys.exit(2)
+            local_header = arg
+        elif opt == "--local-confidence":
+            try:
+                set_local_confidence(float(arg))
+            except ValueError:
+                print(helptext)
+                sys.exit(2)
+        elif opt == "--max-authors":
+            set_max_authors(int(arg))
+        elif opt in ("-j", "--parallel"):
+            parallel = int(arg)
+        elif opt == "--hosts":
+            set_grobid_hosts(arg.split(','))
+        elif opt == "--delta":
+            delta = True
+        elif opt == "--deadline":
+            try:
+                deadline = parse_deadline(arg)
+            except ValueError:
+                print(helptext)
+                sys.exit(2)
+        elif opt in ("--profile", "--cprofile"):
+            profiling.parse_option(opt, arg)
     if not output_dir:
         output_dir = input_dir
+    if from_store and not store_filename:
+        print(helptext)
+        sys.exit(2)
     if os.path.isdir(input_dir) and os.path.isdir(output_dir):
         print('Processing directory:', input_dir )
-        build_marc_xml(input_dir, output_dir, page_filename, extract_metadata)
+        store = None
+        if store_filename:
+            from resultstore import ResultStore
+            store = ResultStore(store_filename)
+        try:
+            with profiling.span('build_marc_xml'):
+                build_marc_xml(input_dir, output_dir, page_filename, extract_metadata,
+                               output_format, max_records, max_bytes, archive, name_cache,
+                               slim=slim, memory_limit=memory_limit, references=references,
+                               store=store, from_store=from_store, local_header=local_header,
+                               parallel=parallel, delta=delta, deadline=deadline)
+        except ValueError as err:
+            print(err)
+            sys.exit(1)
+        if store is not None:
+            store.close()
+        profiling.write_report(os.path.join(output_dir, 'grobid_profile'))
     else:
         print(helptext)
         print(opts)
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP/JSON service which runs the volumes of several curators in one
+process: one Grobid concurrency budget for everybody, warm connection pool
+and caches (like watch_grobid.py, but jobs are submitted).
+
+    POST /jobs        {"recid": ..., "fulltext": ..., "page_file": ...,
+                       "metadata": ..., "dir_pdf": ..., "output_dir": ...,
+                       "user": <login of the curator, for the 595 note>,
+                       "options": {"extract_metadata": false, ...}}
+                      -> the job with its "id"
+    GET  /jobs        all jobs
+    GET  /jobs/<id>   one job: "state" queued, running or done, and as "result"
+                      the status of batch_grobid.run_job (exit_code, output, records)
+Paths must be absolute and readable by the service. The jobs are kept in
+memory only. The pdfstore (-x), result store (-S), Grobid hosts (-H), --max-authors
+(-A) and the local confidence (-C) are shared by all jobs, so they are options
+of the service, not of a job.
+
+start_grobid.py --service=<url> and batch_grobid.py -u <url> submit their
+volumes to the service instead of running them.
+
+USAGE EXAMPLES:
+$ python jobservice.py -p 8071 -o /data/xml -g 8              # run the service
+$ python jobservice.py -u http://localhost:8071 -l           # list the jobs
+$ python jobservice.py -u http://localhost:8071 -j 12345-1
+"""
+
+from __future__ import print_function
+
+import getopt
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+
+from six.moves import BaseHTTPServer, queue, socketserver
+
+import batch_grobid
+import execute_grobid
+import pdf_upload_path
+import pdfstore
+
+DEFAULT_PORT = 8071
+DEFAULT_URL = 'http://localhost:%i' % DEFAULT_PORT
+POLL_SECONDS = 5
+
+# keyword arguments of batch_grobid.run_job a job may set
+JOB_OPTIONS = ('extract_metadata', 'cut', 'output_format', 'archive', 'stage', 'optimize',
+               'slim', 'references', 'local_header', 'parallel', 'delta', 'verify',
+               'deadline', 'memory_limit', 'max_records', 'max_bytes')
+
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+
+RE_USER = re.compile(r'^[\w.-]+$')
+
+
+class JobService(object):
+    """Queue of submitted jobs, run by nworkers threads."""
+
+    def __init__(self, output_dir, dir_pdf, nworkers=2, ngrobid=4, ncut=1, **options):
+        self.output_dir = output_dir
+        self.dir_pdf = dir_pdf
+        self.options = options
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.job_queue = queue.Queue()
+        self.numbers = itertools.count(1)
+        execute_grobid.set_grobid_concurrency(ngrobid)
+        batch_grobid.set_cut_concurrency(ncut)
+        for i in range(max(1, nworkers)):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, request):
+        """Queue the job of a request (dictionary), return the job. ValueError if invalid."""
+        for key in ('recid', 'page_file'):
+            if not request.get(key):
+                raise ValueError('%s is missing' % key)
+        options = request.get('options') or {}
+        unknown = [key for key in options if key not in JOB_OPTIONS]
+        if unknown:
+            raise ValueError('unknown options: %s' % ', '.join(sorted(unknown)))
+        for key in ('fulltext', 'page_file', 'metadata', 'dir_pdf', 'output_dir'):
+            if request.get(key) and not os.path.isabs(request[key]):
+                raise ValueError('%s must be an absolute path' % key)
+        if request.get('user') and not RE_USER.match(request['user']):
+            raise ValueError('invalid user %s' % request['user'])
+        with self.lock:
+            job_id = '%s-%i' % (request['recid'], next(self.numbers))
+            job = {'id': job_id, 'recid': str(request['recid']),
+                   'fulltext': request.get('fulltext') or '',
+                   'page_file': request['page_file'],
+                   'metadata': request.get('metadata') or '',
+                   'dir_pdf': request.get('dir_pdf') or self.dir_pdf,
+                   'output_dir': request.get('output_dir') or self.output_dir,
+                   'user': str(request.get('user') or '') or None,
+                   'options': dict((str(key), value) for key, value in options.items()),
+                   'state': STATE_QUEUED, 'submitted': time.time(),
+                   'started': None, 'finished': None, 'result': None}
+            self.jobs[job_id] = job
+            self.job_queue.put(job_id)
+            return dict(job)
+
+    def get(self, job_id):
+        """Copy of the job, None if unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def update(self, job_id, **values):
+        with self.lock:
+            self.jobs[job_id].update(values)
+
+    def worker(self):
+        while True:
+            job_id = self.job_queue.get()
+            job = self.get(job_id)
+            self.update(job_id, state=STATE_RUNNING, started=time.time())
+            options = dict(self.options)
+            options.update(job['options'])
+            try:
+                result = batch_grobid.run_job(job, job['output_dir'], job['dir_pdf'],
+                                              user=job['user'], **options)
+            except Exception:
+                result = batch_grobid.job_status(job['recid'], exit_code=batch_grobid.EXIT_GROBID,
+                                                 status='failed', message=traceback.format_exc())
+            print('Job %s: %s' % (job_id, result['status']))
+            self.update(job_id, state=STATE_DONE, finished=time.time(), result=result)
+
+
+class JobHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """JSON API of the JobService of the server."""
+
+    def send_json(self, code, data):
+        body = json.dumps(data, indent=2, sort_keys=True)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self.send_json(200, self.server.service.list())
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.server.service.get(parts[1])
+            if job is None:
+                self.send_json(404, {'error': 'unknown job %s' % parts[1]})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length))
+            job = self.server.service.submit(request)
+        except (ValueError, AttributeError) as err:
+            self.send_json(400, {'error': str(err)})
+            return
+        self.send_json(201, job)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class JobServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server with the JobService as attribute."""
+    daemon_threads = True
+
+
+def serve(service, port=DEFAULT_PORT, host='127.0.0.1', background=False):
+    """Run the HTTP server of service forever, with background in a thread. Return the server."""
+    server = JobServer((host, port), JobHandler)
+    server.service = service
+    print('Job service on http://%s:%i' % server.server_address)
+    if not background:
+        server.serve_forever()
+        return server
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# client side
+
+def submit(url, job, dir_pdf=None, output_dir=None, **options):
+    """
+    Submit a job dictionary (recid, fulltext, page_file, metadata) of batch_grobid,
+    options are keyword arguments of run_job. The records are credited to the
+    login of this process. Return the job of the service.
+    """
+    import requests
+    request = {'recid': job['recid'],
+               'user': pdf_upload_path.get_user(),
+               'fulltext': os.path.abspath(job['fulltext']) if job.get('fulltext') else '',
+               'page_file': os.path.abspath(job['page_file']),
+               'metadata': os.path.abspath(job['metadata']) if job.get('metadata') else '',
+               'options': dict((key, value) for key, value in options.items()
+                               if key in JOB_OPTIONS)}
+    if dir_pdf:
+        request['dir_pdf'] = os.path.abspath(dir_pdf)
+    if output_dir:
+        request['output_dir'] = os.path.abspath(output_dir)
+    response = requests.post(url.rstrip('/') + '/jobs', data=json.dumps(request))
+    if response.status_code != 201:
+        raise ValueError('job service: %s' % response.text)
+    return response.json()
+
+
+def get_job(url, job_id):
+    import requests
+    response = requests.get('%s/jobs/%s' % (url.rstrip('/'), job_id))
+    response.raise_for_status()
+    return response.json()
+
+
+def wait(url, job_ids, poll=POLL_SECONDS):
+    """Wait until the jobs are done, return them in the order of job_ids."""
+    done = {}
+    while len(done) < len(job_ids):
+        for job_id in job_ids:
+            if job_id not in done:
+                job = get_job(url, job_id)
+                if job['state'] == STATE_DONE:
+                    done[job_id] = job
+                    print('Job %s: %s' % (job_id, job['result']['status']))
+        if len(done) < len(job_ids):
+            time.sleep(poll)
+    return [done[job_id] for job_id in job_ids]
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("\v* Usage: python jobservice.py [-p <port>] [-o <output_dir>] [-d <dir_pdf>]\n"
+        "         python jobservice.py -u <url> -l | -j <job_id>\n\v"
+        "* -p: port of the service on localhost (default %i)\n"
+        "* -o: default directory for the output, default is '.'\n"
+        "* -d: default directory for the contributions, default is the personal web directory\n"
+        "* -n: number of volumes processed in parallel (default 2)\n"
+        "* -g: number of requests to Grobid in parallel, for all jobs (default 4)\n"
+        "* -c: number of pdfs cut in parallel (default 1)\n"
+        "* -x: store contributions and Grobid results by content in <dir_pdf>/.objects\n"
+        "* -S <file>: save the results per contribution in this SQLite store\n"
+        "* -H <url,url,...>: spread the contributions over these Grobid hosts\n"
+        "* -A <n>: keep only the collaboration and the first <n> of longer author lists\n"
+        "* -C <0..1>: confidence of the local guess to skip Grobid (local_header prepass)\n"
+        "* -u <url>: talk to the service at <url>: -l list the jobs, -j <job_id> show one\n"
+        % DEFAULT_PORT)
+    try:
+        opts, args = getopt.getopt(argv, "hlxp:o:d:n:g:c:u:j:S:H:A:C:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+
+    port = DEFAULT_PORT
+    output_dir = '.'
+    dir_pdf = None
+    url = None
+    job_id = None
+    list_jobs = False
+    use_store = False
+    options = {'nworkers': 2, 'ngrobid': 4, 'ncut': 1}
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-p':
+            port = int(arg)
+        elif opt == '-o':
+            output_dir = arg
+        elif opt == '-d':
+            dir_pdf = arg
+        elif opt == '-n':
+            options['nworkers'] = int(arg)
+        elif opt == '-g':
+            options['ngrobid'] = int(arg)
+        elif opt == '-c':
+            options['ncut'] = int(arg)
+        elif opt == '-u':
+            url = arg
+        elif opt == '-l':
+            list_jobs = True
+        elif opt == '-j':
+            job_id = arg
+        elif opt == '-x':
+            use_store = True
+        elif opt == '-S':
+            from resultstore import ResultStore
+            options['store'] = ResultStore(arg)
+        elif opt == '-H':
+            execute_grobid.set_grobid_hosts(arg.split(','))
+        elif opt == '-A':
+            execute_grobid.set_max_authors(int(arg))
+        elif opt == '-C':
+            try:
+                execute_grobid.set_local_confidence(float(arg))
+            except ValueError:
+                print(helptext)
+                sys.exit(2)
+
+    if url:
+        if job_id:
+            print(json.dumps(get_job(url, job_id), indent=2, sort_keys=True))
+        elif list_jobs:
+            import requests
+            for job in requests.get(url.rstrip('/') + '/jobs').json():
+                result = job['result'] or {}
+                print('%s\t%s\t%s\t%s' % (job['id'], job['state'], result.get('status', ''),
+                                          result.get('output') or ''))
+        else:
+            print(helptext)
+            sys.exit(2)
+        return
+    if not os.path.isdir(output_dir):
+        print(helptext)
+        sys.exit(2)
+    if not dir_pdf:
+        dir_pdf = pdf_upload_path.dir_pdf(os.getcwd())
+    if use_store:
+        options['objects_dir'] = pdfstore.default_objects_dir(os.path.abspath(dir_pdf))
+        execute_grobid.set_tei_cache_dir(options['objects_dir'])
+    service = JobService(os.path.abspath(output_dir), os.path.abspath(dir_pdf), **options)
+    serve(service, port)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Local guess of title, authors and abstract from the text layout of the
+first page of a contribution, without Grobid (execute_grobid.py --local=...).
+
+The text lines with their font size come from PyMuPDF (fitz) if it is
+installed - a few ms per contribution - or from poppler's
+`pdftotext -bbox-layout`. The rules:
+  title     the largest font in the upper part of the page, clearly larger
+            than the body text; consecutive lines of that size
+  authors   the lines between title and abstract/affiliations which look
+            like lists of names
+  abstract  from a line starting with 'Abstract' to the introduction,
+            keywords or the next heading
+extract returns a dictionary like mapping.tei_to_dict (no affiliations)
+with a confidence between 0 and 1.
+"""
+
+import re
+import subprocess
+
+from xml.sax.saxutils import unescape
+
+TITLE_REGION = 0.6       # title in the upper 60% of the page
+TITLE_SIZE_RATIO = 1.15  # title font at least 15% larger than the body text
+TITLE_MAX_LENGTH = 300
+MAX_AUTHOR_LINES = 4
+ABSTRACT_MAX_LENGTH = 3000
+
+RE_ABSTRACT = re.compile(u'^\\s*abstract\\b[\\s.:\\-\u2013\u2014]*', re.I | re.U)
+RE_END_OF_ABSTRACT = re.compile(
+    r'^\s*(?:(?:1|I)\.?\s+introduction|introduction|keywords|key words|pacs)\b', re.I | re.U)
+RE_INSTITUTION = re.compile(
+    r'\b(?:universit|institut|laborator|department|dept\.|facult|school|college|'
+    r'centre|center|academy|cern|desy|fermilab|infn|kek|slac|cnrs)', re.I | re.U)
+RE_NAME_SEPARATOR = re.compile(r'\s*(?:,|;|\band\b|&)\s*', re.U)
+RE_MARKERS = re.compile(u'[\\d*\u2020\u2021\u00a7\u00b6]+', re.U)
+RE_NAME = re.compile(u"^(?:[A-Z\u00c0-\u00de][\\w'\\-]*\\.?\\s+){1,4}[A-Z\u00c0-\u00de][\\w'\\-]+$",
+                     re.U)
+RE_SPACES = re.compile(r'\s+', re.U)
+
+RE_BBOX_PAGE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">')
+RE_BBOX_LINE = re.compile(
+    r'<line xMin="[\d.]+" yMin="([\d.]+)" xMax="[\d.]+" yMax="([\d.]+)">(.*?)</line>', re.S)
+RE_BBOX_WORD = re.compile(r'<word[^>]*>(.*?)</word>', re.S)
+
+
+def fitz_lines(pdf_file):
+    """Lines (text, size, y) and page height of the first page with PyMuPDF."""
+    import fitz
+    doc = fitz.open(pdf_file)
+    try:
+        page = doc[0]
+        get_text = getattr(page, 'get_text', None) or page.getText
+        layout = get_text('dict')
+        height = page.rect.height
+    finally:
+        doc.close()
+    lines = []
+    for block in layout['blocks']:
+        for line in block.get('lines', []):
+            spans = [span for span in line['spans'] if span['text'].strip()]
+            if spans:
+                text = u''.join([span['text'] for span in spans])
+                lines.append((text, max([span['size'] for span in spans]), line['bbox'][1]))
+    return lines, height
+
+
+def pdftotext_lines(pdf_file):
+    """Lines (text, height of the line as size, y) and page height with poppler."""
+    layout = subprocess.check_output(
+        ['pdftotext', '-f', '1', '-l', '1', '-bbox-layout', pdf_file, '-']).decode('utf-8')
+    page = RE_BBOX_PAGE.search(layout)
+    height = float(page.group(2)) if page else 842.0
+    lines = []
+    for y_min, y_max, words in RE_BBOX_LINE.findall(layout):
+        text = u' '.join([unescape(word, {'&quot;': '"', '&apos;': "'"})
+                          for word in RE_BBOX_WORD.findall(words)])
+        if text.strip():
+            lines.append((text, float(y_max) - float(y_min), float(y_min)))
+    return lines, height
+
+
+def first_page_lines(pdf_file):
+    """Text lines of the first page, ([], 0) if no extractor works."""
+    try:
+        return fitz_lines(pdf_file)
+    except ImportError:
+        pass
+    except Exception:
+        return [], 0
+    try:
+        return pdftotext_lines(pdf_file)
+    except (OSError, subprocess.CalledProcessError):
+        return [], 0
+
+
+def clean(text):
+    return RE_SPACES.sub(' ', text).strip()
+
+
+def body_size(lines):
+    """Font size of most of the text."""
+    chars = {}
+    for text, size, y in lines:
+        size = round(size, 1)
+        chars[size] = chars.get(size, 0) + len(text)
+    return max(chars, key=chars.get)
+
+
+def find_title(lines, height, body):
+    """Index after the title and the title, (0, None) if there is no outstanding font."""
+    candidates = [i for i, (text, size, y) in enumerate(lines)
+                  if y < TITLE_REGION * height and size >= TITLE_SIZE_RATIO * body]
+    if not candidates:
+        return 0, None
+    size = max([lines[i][1] for i in candidates])
+    first = [i for i in candidates if lines[i][1] >= size - 0.5][0]
+    last = first
+    while last + 1 < len(lines) and abs(lines[last + 1][1] - size) < 0.5:
+        last += 1
+    title = clean(u' '.join([text for text, size, y in lines[first:last + 1]]))
+    if not title or len(title) > TITLE_MAX_LENGTH:
+        return 0, None
+    return last + 1, title
+
+
+def split_names(text):
+    """Names in an author line, [] if it does not look like one."""
+    names = []
+    for part in RE_NAME_SEPARATOR.split(RE_MARKERS.sub(' ', text)):
+        part = clean(part)
+        if not part:
+            continue
+        if not RE_NAME.match(part):
+            return []
+        names.append(part)
+    return names
+
+
+def find_authors(lines, start):
+    """Author names in the lines after the title."""
+    names = []
+    for text, size, y in lines[start:start + MAX_AUTHOR_LINES]:
+        if RE_ABSTRACT.match(text) or RE_INSTITUTION.search(text) or '@' in text:
+            break
+        line_names = split_names(text)
+        if not line_names:
+            if names:
+                break
+            continue
+        names.extend(line_names)
+    return names
+
+
+def find_abstract(lines, body):
+    """Text from the 'Abstract' line to the introduction or the next heading."""
+    for i, (text, size, y) in enumerate(lines):
+        if not RE_ABSTRACT.match(text):
+            continue
+        parts = [RE_ABSTRACT.sub(u'', text, count=1)]
+        length = len(parts[0])
+        for text, size, y in lines[i + 1:]:
+            if RE_END_OF_ABSTRACT.match(text) or size > body + 1 or length > ABSTRACT_MAX_LENGTH:
+                break
+            parts.append(text)
+            length += len(text)
+        abstract = clean(u' '.join(parts))
+        return abstract or None
+    return None
+
+
+def guess_header(lines, height):
+    """Title, authors and abstract from text lines (text, size, y) of the first page."""
+    result = {'confidence': 0.0}
+    if not lines:
+        return result
+    body = body_size(lines)
+    after_title, title = find_title(lines, height, body)
+    if title:
+        result['title'] = title
+        result['confidence'] += 0.4
+    names = find_authors(lines, after_title) if title else []
+    if names:
+        result['authors'] = [{'name': name, 'affiliations': []} for name in names]
+        result['confidence'] += 0.3
+    abstract = find_abstract(lines, body)
+    if abstract:
+        result['abstract'] = abstract
+        result['confidence'] += 0.3
+    return result
+
+
+def extract(pdf_file):
+    """Guess of the header of pdf_file as dictionary, None without text."""
+    lines, height = first_page_lines(pdf_file)
+    if not lines:
+        return None
+    return guess_header(lines, height)
@@ -29,12 +29,62 @@ from six import text_type
 
 
 NS = {'tei': 'http://www.tei-c.org/ns/1.0'}
+TEI_HEADER = '{%s}teiHeader' % NS['tei']
+PERSNAME = '{%s}persName' % NS['tei']
+FORENAME = '{%s}forename' % NS['tei']
+SURNAME = '{%s}surname' % NS['tei']
+AFFILIATION = '{%s}affiliation' % NS['tei']
+ORGNAME = '{%s}orgName' % NS['tei']
 
 
-def tei_to_dict(tei):
+def parse_tei(tei):
+    """Parse TEI (unicode or utf-8) leniently, return the root element."""
     parser = etree.XMLParser(encoding='UTF-8', recover=True)
     tei = tei if not isinstance(tei, text_type) else tei.encode('utf-8')
-    root = etree.fromstring(tei, parser)
+    return etree.fromstring(tei, parser)
+
+
+class TeiFeed(object):
+    """
+    Parse TEI while it arrives in chunks (execute_grobid.request_grobid).
+    Title, authors, abstract and keywords are in the teiHeader: with
+    header_only feed returns True as soon as </teiHeader> is parsed and
+    the rest of the document is not needed.
+    """
+
+    def __init__(self, header_only=False):
+        self.parser = etree.XMLPullParser(events=('end', ), tag=TEI_HEADER, recover=True)
+        self.header_only = header_only
+        self.header_done = False
+        self.truncated = False
+        self.root = None
+
+    def feed(self, chunk):
+        """Parse the next chunk, return True if no more is needed."""
+        self.parser.feed(chunk)
+        for event, element in self.parser.read_events():
+            self.header_done = True
+        return self.header_only and self.header_done
+
+    def close(self):
+        """Root element of what was fed (open elements are closed), None if it is no XML."""
+        try:
+            self.root = self.parser.close()
+        except etree.XMLSyntaxError:
+            self.root = None
+        return self.root
+
+
+def tei_to_dict(tei, affiliation_table=None, with_references=False, max_authors=0):
+    """
+    Map TEI (text or the root element, e.g. of a TeiFeed) to a dict.
+    With an affiliations.AffiliationTable the affiliations of the authors
+    are given as ids in that table.
+    The bibliography is only mapped with_references.
+    With max_authors longer author lists are collapsed to the collaboration
+    and the first max_authors authors, 'authors_total' is the full number.
+    """
+    root = tei if etree.iselement(tei) else parse_tei(tei)
 
     result = {}
 
@@ -42,9 +92,7 @@ def tei_to_dict(tei):
     if abstract and len(abstract) == 1:
         result['abstract'] = abstract[0].text
 
-    authors = get_authors(root)
-    if authors:
-        result['authors'] = map(element_to_author, authors)
+    result.update(map_authors(root, affiliation_table, max_authors))
 
     keywords = get_keywords(root)
     if keywords and len(keywords) == 1:
@@ -54,45 +102,111 @@ def tei_to_dict(tei):
     if title and len(title) == 1:
         result['title'] = title[0].text
 
-    references = get_references(root)
-    if references:
-        result['references'] = map(element_to_reference, references)
+    if with_references:
+        references = map(element_to_reference, get_references(root))
+        if references:
+            result['references'] = references
 
-    return result
+    # everything is copied to python strings, free the tree right away;
+    # lxml's clear is slow while elements are still referenced from python
+    del abstract, keywords, title
+    root.clear()
 
+    return result
 
-def element_to_author(el):
-    result = {}
 
+def map_authors(root, affiliation_table=None, max_authors=0):
+    """'authors' (and 'authors_total') for tei_to_dict, the elements are released on return."""
+    authors = get_authors(root)
+    if authors and max_authors and len(authors) > max_authors:
+        return {'authors': collapse_authors(authors, max_authors, affiliation_table),
+                'authors_total': len(authors)}
+    if authors:
+        return {'authors': [element_to_author(el, affiliation_table) for el in authors]}
+    return {}
+
+
+def tei_to_references(tei):
+    """Map only the bibliography of TEI (e.g. from processReferences)."""
+    root = parse_tei(tei)
+    references = map(element_to_reference, get_references(root))
+    root.clear()
+    return references
+
+
+def author_parts(el):
+    """
+    First names, middle names, surnames and institutions of a TEI author,
+    collected in one pass over the element (no XPath, authors of
+    collaboration papers come by the thousands).
+    """
+    first = []
+    middle = []
+    surname = []
+    institutions = []
+    for child in el.iter(FORENAME, SURNAME, ORGNAME):
+        tag = child.tag
+        if tag == ORGNAME:
+            if child.get('type') == 'institution' and in_affiliation(child, el):
+                institutions.append(child.text)
+        elif child.getparent().tag == PERSNAME:
+            if tag == SURNAME:
+                surname.append(child.text)
+            elif child.get('type') == 'first':
+                first.append(child.text)
+            elif child.get('type') == 'middle':
+                middle.append(child.text)
+    return first, middle, surname, institutions
+
+
+def in_affiliation(child, el):
+    """Is child inside an affiliation of the author element el?"""
+    for ancestor in child.iterancestors():
+        if ancestor is el:
+            return False
+        if ancestor.tag == AFFILIATION:
+            return True
+    return False
+
+
+def author_name(first, middle, surname):
+    """'First M. Surname' from the parts of author_parts, parts given more than once are left out."""
     name = []
+    if len(first) == 1:
+        name.append(first[0])
+    if len(middle) == 1:
+        name.append(middle[0] + '.')
+    if len(surname) == 1:
+        name.append(surname[0])
+    return ' '.join(name)
 
-    first = el.xpath('.//tei:persName/tei:forename[@type="first"]',
-                     namespaces=NS)
-    if first and len(first) == 1:
-        name.append(first[0].text)
-
-    middle = el.xpath('.//tei:persName/tei:forename[@type="middle"]',
-                      namespaces=NS)
-    if middle and len(middle) == 1:
-        name.append(middle[0].text + '.')
 
-    surname = el.xpath('.//tei:persName/tei:surname', namespaces=NS)
-    if surname and len(surname) == 1:
-        name.append(surname[0].text)
+def element_to_author(el, affiliation_table=None):
+    first, middle, surname, institutions = author_parts(el)
+    result = {'name': author_name(first, middle, surname)}
 
-    result['name'] = ' '.join(name)
+    if affiliation_table is not None:
+        result['affiliations'] = [affiliation_table.intern(institution)
+                                  for institution in institutions]
+    else:
+        result['affiliations'] = [{'value': institution} for institution in institutions]
 
-    affiliations = []
-    for aff in el.xpath('.//tei:affiliation', namespaces=NS):
-        for institution in aff.xpath('.//tei:orgName[@type="institution"]',
-                                     namespaces=NS):
-            affiliations.append({
-                'value': institution.text
-            })
+    return result
 
-    result['affiliations'] = affiliations
 
-    return result
+def collapse_authors(authors, max_authors, affiliation_table=None):
+    """
+    Collaborations and the first max_authors of the author elements.
+    Only these are mapped completely, the others are only looked at for
+    the name of the collaboration.
+    """
+    collaborations = []
+    for el in authors[max_authors:]:
+        first, middle, surname, institutions = author_parts(el)
+        if len(surname) == 1 and surname[0] and 'collaboration' in surname[0].lower():
+            collaborations.append(element_to_author(el, affiliation_table))
+    return collaborations + [element_to_author(el, affiliation_table)
+                             for el in authors[:max_authors]]
 
 
 def extract_keywords(el):
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Normalization of author names from Grobid: 'Firstname Lastname' -> 'Lastname, Firstname'
+
+The same names appear in many contributions of a volume (and in many volumes),
+so results are kept in a bounded cache. The cache can be stored in a json file
+and shared between runs (load_cache/save_cache).
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import utils
+
+CACHE_SIZE = 100000
+
+_cache = OrderedDict()
+# build_marc_xml runs in several threads (batch_grobid.py, jobservice.py)
+_cache_lock = threading.Lock()
+RE_INITIAL_SPACE = re.compile(r'\. +')
+
+
+def format_name(name):
+    """Name as 'lastname, firstname', uncached. Collaborations are kept as they are."""
+    author_name = ''
+    surname, given_names = utils.split_fullname(name, surname_first=False)
+    if surname and "collaboration" in surname.lower():
+        author_name = surname
+    if surname and given_names:
+        if len(given_names) == 1:  # Handle initials
+            given_names += "."
+        given_names = RE_INITIAL_SPACE.sub('.', given_names)
+        author_name = surname + ", " + given_names
+    elif surname:
+        author_name = surname
+    return author_name
+
+
+def normalize_name(name):
+    """Cached format_name, the least recently used names are dropped first."""
+    if not name:
+        return ''
+    with _cache_lock:
+        author_name = _cache.pop(name, None)
+        if author_name is not None:
+            _cache[name] = author_name
+            return author_name
+    author_name = format_name(name)
+    with _cache_lock:
+        _cache.pop(name, None)
+        if len(_cache) >= CACHE_SIZE:
+            _cache.popitem(last=False)
+        _cache[name] = author_name
+    return author_name
+
+
+def normalize_names(names):
+    """Normalize a whole author list, every distinct name only once."""
+    seen = {}
+    result = []
+    for name in names:
+        if name not in seen:
+            seen[name] = normalize_name(name)
+        result.append(seen[name])
+    return result
+
+
+def load_cache(filename):
+    """Fill the cache from a json file written by save_cache."""
+    if not filename or not os.path.isfile(filename):
+        return 0
+    with open(filename, 'r') as cache_file:
+        try:
+            entries = json.load(cache_file)
+        except ValueError:
+            print('Ignoring unreadable name cache %s' % filename)
+            return 0
+    with _cache_lock:
+        for name, author_name in entries[-CACHE_SIZE:]:
+            _cache[name] = author_name
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return len(entries)
+
+
+def save_cache(filename):
+    """Write the cache to a json file, replacing the old file atomically."""
+    if not filename:
+        return
+    tmp_filename = '%s.%i.tmp' % (filename, os.getpid())
+    with _cache_lock:
+        entries = list(_cache.items())
+    with open(tmp_filename, 'w') as cache_file:
+        json.dump(entries, cache_file)
+    os.rename(tmp_filename, filename)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Per-page text index of a fulltext to check a page file before the cut
+(cutpdf_for_grobid.py -v), e.g. a wrong #offset which otherwise is only
+noticed when the contributions start in the middle of a paper.
+
+The text is extracted once (PyMuPDF or poppler's pdftotext) and the first
+HEAD_LINES and last TAIL_LINES lines of every page are written to
+<fulltext>.pageindex:
+    header      magic, number of pages, size and mtime of the pdf
+    offsets     (pages + 1) * uint32 into the text
+    text        utf-8, per page head lines \\0 tail lines
+The index is memory-mapped, a check reads a few hundred bytes of one page
+and never opens the pdf again. It is rebuilt when the pdf changes.
+
+USAGE EXAMPLES:
+$ python pageindex.py -f 12345_fulltext.pdf -p 12345.txt
+"""
+
+from __future__ import print_function
+
+import getopt
+import mmap
+import os
+import re
+import struct
+import subprocess
+import sys
+
+import localheader
+
+MAGIC = b'PGX1'
+HEADER = struct.Struct('<4sIQd')
+OFFSET = struct.Struct('<I')
+HEAD_LINES = 12
+TAIL_LINES = 3
+MAX_LINE_LENGTH = 200
+TITLE_LINES = 4     # the title starts in one of the first lines of the page
+AUTHOR_LINES = 4    # authors or affiliations follow within these lines
+
+RE_RANGE = re.compile(r'^\s*(\d+)\s*-\s*\d+\s*$')
+RE_PAGE_NUMBER = re.compile(r'^(\d{1,5})$|^(\d{1,5})\s{2,}\S|\S\s{2,}(\d{1,5})$', re.U)
+RE_WORD = re.compile(r'\w+', re.U)
+
+
+def fitz_page_texts(pdf_filename):
+    """Text of every page with PyMuPDF."""
+    import fitz
+    doc = fitz.open(pdf_filename)
+    try:
+        texts = []
+        for page in doc:
+            get_text = getattr(page, 'get_text', None) or page.getText
+            texts.append(get_text('text'))
+        return texts
+    finally:
+        doc.close()
+
+
+def pdftotext_page_texts(pdf_filename):
+    """Text of every page with poppler, pages are separated by form feeds."""
+    text = subprocess.check_output(['pdftotext', '-layout', pdf_filename, '-']).decode('utf-8')
+    texts = text.split(u'\f')
+    if texts and not texts[-1].strip():
+        texts.pop()
+    return texts
+
+
+def page_texts(pdf_filename):
+    """Text of every page, RuntimeError if there is no extractor."""
+    try:
+        return fitz_page_texts(pdf_filename)
+    except ImportError:
+        pass
+    try:
+        return pdftotext_page_texts(pdf_filename)
+    except (OSError, subprocess.CalledProcessError):
+        raise RuntimeError("Can't extract text of %s (PyMuPDF or pdftotext needed)" % pdf_filename)
+
+
+def page_entry(text):
+    """Head and tail lines of the text of a page as stored in the index."""
+    # NUL separates head and tail in the index
+    lines = [line.strip()[:MAX_LINE_LENGTH] for line in text.replace(u'\0', u'').splitlines()
+             if line.strip()]
+    head = lines[:HEAD_LINES]
+    tail = lines[-TAIL_LINES:]
+    return (u'\n'.join(head) + u'\0' + u'\n'.join(tail)).encode('utf-8')
+
+
+def default_index_filename(pdf_filename):
+    """<pdf>.pageindex, in tmp_dir if the directory of the pdf is not writable."""
+    directory = os.path.dirname(os.path.abspath(pdf_filename))
+    if os.access(directory, os.W_OK):
+        return pdf_filename + '.pageindex'
+    from cutpdf_for_grobid import tmp_dir
+    return os.path.join(tmp_dir(), os.path.basename(pdf_filename) + '.pageindex')
+
+
+def build(pdf_filename, index_filename):
+    """Extract the text of pdf_filename and write the index."""
+    stat = os.stat(pdf_filename)
+    entries = [page_entry(text) for text in page_texts(pdf_filename)]
+    offsets = [0]
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry))
+    tmp_filename = index_filename + '.tmp'
+    with open(tmp_filename, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(entries), stat.st_size, stat.st_mtime))
+        index_file.write(b''.join([OFFSET.pack(offset) for offset in offsets]))
+        index_file.write(b''.join(entries))
+    os.rename(tmp_filename, index_filename)
+
+
+class PageIndex(object):
+    """Memory-mapped index written by build."""
+
+    def __init__(self, index_filename):
+        self.index_file = open(index_filename, 'rb')
+        self.map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.npages, self.pdf_size, self.pdf_mtime = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a page index' % index_filename)
+        self.text_start = HEADER.size + OFFSET.size * (self.npages + 1)
+
+    def __len__(self):
+        return self.npages
+
+    def is_current(self, pdf_filename):
+        """Was the index built from this version of the pdf?"""
+        stat = os.stat(pdf_filename)
+        return stat.st_size == self.pdf_size and stat.st_mtime == self.pdf_mtime
+
+    def page(self, number):
+        """Head and tail lines of page number (1-based), ([], []) outside of the pdf."""
+        if not 1 <= number <= self.npages:
+            return [], []
+        start = OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * (number - 1))[0]
+        end = OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * number)[0]
+        entry = self.map[self.text_start + start:self.text_start + end].decode('utf-8')
+        head, sep, tail = entry.partition(u'\0')
+        return head.split(u'\n') if head else [], tail.split(u'\n') if tail else []
+
+    def close(self):
+        self.map.close()
+        self.index_file.close()
+
+
+def open_index(pdf_filename, index_filename=None):
+    """PageIndex of pdf_filename, built if it is missing or out of date."""
+    index_filename = index_filename or default_index_filename(pdf_filename)
+    if os.path.isfile(index_filename):
+        try:
+            index = PageIndex(index_filename)
+        except ValueError:
+            pass
+        else:
+            if index.is_current(pdf_filename):
+                return index
+            index.close()
+    build(pdf_filename, index_filename)
+    return PageIndex(index_filename)
+
+
+def title_like(line):
+    """A line which can be (the start of) a title."""
+    words = RE_WORD.findall(line)
+    return 2 <= len(words) <= 30 and line[0].isupper() and line[-1] not in '.,;' \
+        and not RE_PAGE_NUMBER.match(line)
+
+
+def looks_like_start(head):
+    """Do the first lines of a page look like title and authors / affiliations?"""
+    for i, line in enumerate(head[:TITLE_LINES]):
+        if not title_like(line):
+            continue
+        for author_line in head[i + 1:i + 1 + AUTHOR_LINES]:
+            if localheader.split_names(author_line) or localheader.RE_INSTITUTION.search(author_line):
+                return True
+    return False
+
+
+def printed_numbers(lines):
+    """Page numbers in running headers or footers."""
+    numbers = []
+    for line in lines:
+        match = RE_PAGE_NUMBER.search(line)
+        if match:
+            numbers.append(int([group for group in match.groups() if group][0]))
+    return numbers
+
+
+def check_page_number(index, pdf_page, printed):
+    """
+    None if page pdf_page shows page number printed or no number at all,
+    otherwise the number it shows.
+    """
+    head, tail = index.page(pdf_page)
+    numbers = printed_numbers(head[:2] + tail[-2:])
+    if not numbers or printed in numbers:
+        return None
+    return numbers[0]
+
+
+def verify_cuts(index, page_filename):
+    """Check the page file against the index, return list of warnings."""
+    from cutpdf_for_grobid import read_pages, byPage
+    page_ranges, add_pages = read_pages(page_filename)
+    warnings = []
+    for artid in sorted(page_ranges.keys(), byPage):
+        cut_page = page_ranges[artid]
+        try:
+            first, last = [int(page) for page in cut_page.split('-')]
+        except ValueError:
+            warnings.append('%s: bad page range %s' % (artid, cut_page))
+            continue
+        if last > len(index):
+            warnings.append('%s: pages %s, but the pdf has only %i pages' % (artid, cut_page, len(index)))
+            continue
+        if not looks_like_start(index.page(first)[0]):
+            warnings.append('%s: pdf page %i does not look like the start of a paper'
+                            % (artid, first))
+        match = RE_RANGE.match(artid)
+        if add_pages and match:
+            printed = int(match.group(1))
+            shown = check_page_number(index, first, printed)
+            if shown is not None:
+                warnings.append('%s: pdf page %i shows page number %i, not %i (#offset=%i?)'
+                                % (artid, first, shown, printed, first - shown))
+    return warnings
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: python pageindex.py -f <fulltext_pdf> -p <page_file> [-i index_file]\n"
+                "Check whether the contributions of the page file start with title and\n"
+                "authors and whether the printed page numbers fit the #offset.")
+    try:
+        opts, args = getopt.getopt(argv, "hf:p:i:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    pdf_filename = ''
+    page_filename = ''
+    index_filename = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-f':
+            pdf_filename = arg
+        elif opt == '-p':
+            page_filename = arg
+        elif opt == '-i':
+            index_filename = arg
+    if not os.path.isfile(pdf_filename) or not os.path.isfile(page_filename):
+        print(helptext)
+        sys.exit(2)
+    index = open_index(pdf_filename, index_filename)
+    warnings = verify_cuts(index, page_filename)
+    index.close()
+    for warning in warnings:
+        print('WARNING: %s' % warning)
+    if warnings:
+        sys.exit(1)
+    print('Page file looks fine')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -4,10 +4,26 @@
 # Upload to INSPIRE via URL
 # Here you can define which path should be used and what is the corresponding URL
 
+import getpass
 import os
 import re
 
-THISLAB = os.uname()[1].split('.')[1].lower()
+_thislab = None
+
+def this_lab():
+    """ Lab from the host name (cern, desy, ...), determined on first use """
+    global _thislab
+    if _thislab is None:
+        domain = os.uname()[1].split('.')
+        _thislab = domain[1].lower() if len(domain) > 1 else ''
+    return _thislab
+
+def get_user():
+    """ Login name, also for runs without terminal (cron, batch jobs) """
+    try:
+        return os.getlogin()
+    except OSError:
+        return getpass.getuser()
 
 def dir_pdf(dir_home):
     """
@@ -15,10 +31,11 @@ def dir_pdf(dir_home):
     CERN: /eos/home-s/sachs/www/for_grobid/
     DESY: /afs/desy.de/user/s/sachs/www/for_grobid/
     """
-    user = os.getlogin()
-    if THISLAB == 'cern':
+    user = get_user()
+    thislab = this_lab()
+    if thislab == 'cern':
         grobid_dir = '/eos/home-%s/%s/www/for_grobid/' % (user[0], user)
-    elif THISLAB == 'desy':
+    elif thislab == 'desy':
         grobid_dir = '/afs/desy.de/user/%s/%s/www/for_grobid/' % (user[0], user)
     else:
         grobid_dir = dir_home
@@ -26,10 +43,10 @@ def dir_pdf(dir_home):
     
 def pdf_url(pdf_path):  
     """ Return URL for path. Keep path as default """
-    
-    if THISLAB == 'cern':
+    thislab = this_lab()
+    if thislab == 'cern':
         url = re.sub(r'^/eos/home-./([a-z]+)/www/', r'https://\1.web.cern.ch/', pdf_path)        
-    elif THISLAB == 'desy':
+    elif thislab == 'desy':
         url = re.sub(r'^/afs/desy.de/user/./([a-z]+)/www/',r'https://www.desy.de/~\1/', pdf_path)        
     else:
         url = pdf_path
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed storage of contribution pdfs.
+
+Re-cuts and volumes sharing contributions leave many identical pdfs in the
+<recid>_for_grobid directories. Every pdf is stored once as
+    <objects_dir>/<ab>/<sha1>.pdf
+and the files in <recid>_for_grobid are hard links to it (symbolic links where
+the filesystem does not allow hard links, e.g. between AFS directories).
+Writers replace these files (write elsewhere and rename), never write into them.
+Grobid results are kept next to the object as <sha1>.<grobid version>.tei.xml
+(see execute_grobid.set_tei_cache_dir and cache_key), so known content is not
+sent again.
+
+gc removes objects which are not referenced from any _for_grobid directory.
+
+USAGE EXAMPLES:
+$ python pdfstore.py -g                     # garbage collection in the web directory
+$ python pdfstore.py -s 12345_for_grobid    # move existing pdfs into the store
+"""
+
+import errno
+import getopt
+import hashlib
+import os
+import shutil
+import sys
+
+import pdf_upload_path
+
+OBJECTS = '.objects'
+BLOCKSIZE = 1 << 20
+
+
+def file_hash(filename):
+    """sha1 of the file content."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        block = infile.read(BLOCKSIZE)
+        while block:
+            sha1.update(block)
+            block = infile.read(BLOCKSIZE)
+    return sha1.hexdigest()
+
+
+def default_objects_dir(dir_pdf):
+    """Object directory in the web directory."""
+    return os.path.join(dir_pdf, OBJECTS)
+
+
+def object_path(objects_dir, key, suffix='.pdf'):
+    """Path of the object with hash key."""
+    return os.path.join(objects_dir, key[:2], key + suffix)
+
+
+def add_object(filename, objects_dir):
+    """Copy filename into the store unless it is there already. Return hash and object path."""
+    key = file_hash(filename)
+    obj = object_path(objects_dir, key)
+    if not os.path.isfile(obj):
+        obj_dir = os.path.dirname(obj)
+        if not os.path.isdir(obj_dir):
+            try:
+                os.makedirs(obj_dir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        tmp_obj = '%s.%i.tmp' % (obj, os.getpid())
+        shutil.copyfile(filename, tmp_obj)
+        os.chmod(tmp_obj, 0o644)
+        os.rename(tmp_obj, obj)
+    return key, obj
+
+
+def link_object(obj, dst):
+    """Let dst point to obj (hard link, symbolic link as fallback), replace dst atomically."""
+    if os.path.exists(dst) and os.path.samefile(obj, dst):
+        return False
+    tmp_dst = os.path.join(os.path.dirname(dst), '.%s.%i.tmp' % (os.path.basename(dst), os.getpid()))
+    try:
+        os.link(obj, tmp_dst)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        os.symlink(os.path.relpath(obj, os.path.dirname(dst)), tmp_dst)
+    os.rename(tmp_dst, dst)
+    return True
+
+
+def store_file(src, dst, objects_dir):
+    """
+    Store the content of src and link dst to it, src and dst may be the same.
+    Return True if dst changed.
+    """
+    key, obj = add_object(src, objects_dir)
+    return link_object(obj, dst)
+
+
+def store_dir(dir_for_grobid, objects_dir):
+    """Replace all pdfs in dir_for_grobid by links into the store."""
+    nchanged = 0
+    for filename in sorted(os.listdir(dir_for_grobid)):
+        path = os.path.join(dir_for_grobid, filename)
+        if filename.lower().endswith('.pdf') and os.path.isfile(path) and not os.path.islink(path):
+            if store_file(path, path, objects_dir):
+                nchanged += 1
+    return nchanged
+
+
+def referenced_objects(dir_pdf):
+    """Objects referenced by symbolic links in the _for_grobid directories."""
+    referenced = set()
+    for dirname in os.listdir(dir_pdf):
+        path = os.path.join(dir_pdf, dirname)
+        if not dirname.endswith('_for_grobid') or not os.path.isdir(path):
+            continue
+        for filename in os.listdir(path):
+            link = os.path.join(path, filename)
+            if os.path.islink(link):
+                referenced.add(os.path.realpath(link))
+    return referenced
+
+
+def gc(dir_pdf, objects_dir=None):
+    """Remove unreferenced objects and their Grobid results. Return number of files and bytes."""
+    if not objects_dir:
+        objects_dir = default_objects_dir(dir_pdf)
+    referenced = referenced_objects(dir_pdf)
+    nfiles = 0
+    nbytes = 0
+    for root, dirnames, filenames in os.walk(objects_dir):
+        for filename in filenames:
+            if not filename.endswith('.pdf'):
+                continue
+            obj = os.path.join(root, filename)
+            stat = os.stat(obj)
+            if stat.st_nlink > 1 or os.path.realpath(obj) in referenced:
+                continue
+            base = os.path.basename(obj)[:-len('.pdf')]
+            for unused in [obj] + [os.path.join(root, name) for name in filenames
+                                   if name.startswith(base + '.') and name.endswith('.tei.xml')]:
+                if os.path.isfile(unused):
+                    nbytes += os.path.getsize(unused)
+                    nfiles += 1
+                    os.remove(unused)
+    print('Removed %i files (%i bytes) from %s' % (nfiles, nbytes, objects_dir))
+    return nfiles, nbytes
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: pdfstore.py [-d dir_pdf] [-g] [-s dir_for_grobid]\n"
+                "-d: web directory, default from pdf_upload_path\n"
+                "-g: remove unreferenced objects\n"
+                "-s: move the pdfs of a _for_grobid directory into the store")
+    try:
+        opts, args = getopt.getopt(argv, "hgd:s:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    dir_pdf = None
+    collect = False
+    to_store = []
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-d':
+            dir_pdf = arg
+        elif opt == '-g':
+            collect = True
+        elif opt == '-s':
+            to_store.append(arg)
+    if not dir_pdf:
+        dir_pdf = pdf_upload_path.dir_pdf(os.getcwd())
+    if not collect and not to_store:
+        print(helptext)
+        sys.exit(2)
+    objects_dir = default_objects_dir(dir_pdf)
+    for dir_for_grobid in to_store:
+        print('%i files of %s moved into the store' % (store_dir(dir_for_grobid, objects_dir), dir_for_grobid))
+    if collect:
+        gc(dir_pdf, objects_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of the stages of a run (--profile / --cprofile=<stages> on the command line).
+
+Code marks a stage with
+    with profiling.span('tei_to_dict'):
+        ...
+As long as profiling is not enabled, span returns a shared no-op object.
+When enabled, every span is recorded with start time, duration and thread,
+and stages given in cprofile_stages are run under cProfile.
+
+write_report(basename) writes
+    <basename>.trace.json  timeline in Chrome trace format (chrome://tracing, Perfetto)
+    <basename>.txt         time per stage and the top functions of the cProfiled stages
+"""
+
+import json
+import os
+import threading
+import time
+
+ENABLED = False
+TOP_FUNCTIONS = 15
+
+_events = []
+_profiles = {}
+_lock = threading.Lock()
+_local = threading.local()
+_start = time.time()
+
+
+class _NoSpan(object):
+    """Span which does nothing, used while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+class _Span(object):
+    """Record duration of a stage, optionally under cProfile."""
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        if self.name in _profiles and not getattr(_local, 'profiling', False):
+            import cProfile
+            self.profile = cProfile.Profile()
+            _local.profiling = True
+            self.profile.enable()
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.time()
+        if self.profile is not None:
+            self.profile.disable()
+            _local.profiling = False
+        with _lock:
+            _events.append((self.name, self.begin, end - self.begin, threading.current_thread().ident))
+            if self.profile is not None:
+                import pstats
+                if _profiles[self.name] is None:
+                    _profiles[self.name] = pstats.Stats(self.profile)
+                else:
+                    _profiles[self.name].add(self.profile)
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager for the stage name."""
+    if not ENABLED:
+        return NO_SPAN
+    return _Span(name)
+
+
+def enable(cprofile_stages=()):
+    """Start recording spans, run cprofile_stages under cProfile."""
+    global ENABLED, _start
+    ENABLED = True
+    _start = time.time()
+    for stage in cprofile_stages:
+        if stage:
+            _profiles[stage] = None
+
+
+def parse_option(opt, arg):
+    """Handle --profile and --cprofile=<stage,stage> of the command line scripts."""
+    if opt == '--profile':
+        enable()
+    elif opt == '--cprofile':
+        enable(arg.split(','))
+
+
+def summary():
+    """Text summary: calls and time per stage, top functions of cProfiled stages."""
+    from six import StringIO
+    totals = {}
+    with _lock:
+        events = list(_events)
+    for name, begin, duration, thread in events:
+        calls, seconds, longest = totals.get(name, (0, 0.0, 0.0))
+        totals[name] = (calls + 1, seconds + duration, max(longest, duration))
+    lines = ['%-24s %8s %12s %12s' % ('stage', 'calls', 'total [s]', 'max [s]')]
+    for name in sorted(totals, key=lambda name: -totals[name][1]):
+        calls, seconds, longest = totals[name]
+        lines.append('%-24s %8i %12.3f %12.3f' % (name, calls, seconds, longest))
+    for name in sorted(_profiles):
+        stats = _profiles[name]
+        if stats is None:
+            continue
+        stream = StringIO()
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        lines.append('\n==== cProfile of stage %s ====' % name)
+        lines.append(stream.getvalue())
+    return '\n'.join(lines) + '\n'
+
+
+def chrome_trace():
+    """Recorded spans in Chrome trace event format."""
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+    trace = [{'name': name, 'cat': 'grobid', 'ph': 'X', 'pid': pid, 'tid': thread,
+              'ts': int((begin - _start) * 1e6), 'dur': int(duration * 1e6)}
+             for name, begin, duration, thread in events]
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def write_report(basename):
+    """Write <basename>.trace.json and <basename>.txt, nothing if profiling is off."""
+    if not ENABLED:
+        return None
+    trace_file = open(basename + '.trace.json', 'w')
+    json.dump(chrome_trace(), trace_file)
+    trace_file.close()
+    summary_file = open(basename + '.txt', 'w')
+    summary_file.write(summary())
+    summary_file.close()
+    print('Profile written to %s.trace.json and %s.txt' % (basename, basename))
+    return basename
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Optional reference stage of build_marc_xml (execute_grobid.py -r):
+999C5 fields for the references of the contributions.
+
+The references are taken from the bibliography Grobid already found in the
+fulltext; only for contributions without one Grobid's processReferences is
+asked. This happens in a few background threads (with their own limit of
+requests to Grobid), so the header metadata is not slowed down; the 999C5
+fields are added to the records at the export.
+"""
+
+import re
+import threading
+
+from six.moves import queue
+
+# normalization of pubnotes to the INSPIRE form 'Phys.Rev.Lett.,19,1264'
+RE_SPACES = re.compile(r'\s+')
+RE_DOT_SPACE = re.compile(r'\.\s+')
+RE_VOLUME_PREFIX = re.compile(r'^(?:vol(?:ume)?\.?|v\.)\s*', re.I)
+RE_PAGE_PREFIX = re.compile(r'^(?:pp?\.|pages?)\s*', re.I)
+RE_FIRST_PAGE = re.compile(r'^\s*([A-Za-z]?\d+[A-Za-z]?)')
+RE_YEAR = re.compile(r'(?:1[89]|20)\d\d')
+
+NWORKERS = 2
+
+
+def clean(value):
+    """Collapse whitespace."""
+    return RE_SPACES.sub(' ', value or '').strip()
+
+
+def normalize_journal(title):
+    """'Phys. Rev.  Lett.' -> 'Phys.Rev.Lett.'"""
+    return RE_DOT_SPACE.sub('.', clean(title)).strip(' ,;')
+
+
+def normalize_volume(volume):
+    """'Vol. 66' -> '66'"""
+    return RE_VOLUME_PREFIX.sub('', clean(volume))
+
+
+def first_page(page_range):
+    """'pp. 1264-1266' -> '1264'"""
+    match = RE_FIRST_PAGE.match(RE_PAGE_PREFIX.sub('', clean(page_range)))
+    if match:
+        return match.group(1)
+    return ''
+
+
+def normalize_year(year):
+    """'2015-03-01' -> '2015'"""
+    match = RE_YEAR.search(year or '')
+    if match:
+        return match.group(0)
+    return ''
+
+
+def reference_field(reference):
+    """999C5 subfields for one reference of mapping.element_to_reference, None if empty."""
+    pubnote = reference.get('journal_pubnote', {})
+    field = {}
+    journal = normalize_journal(pubnote.get('journal_title'))
+    volume = normalize_volume(pubnote.get('journal_volume'))
+    page = first_page(pubnote.get('page_range'))
+    if journal and (volume or page):
+        field['s'] = u'%s,%s,%s' % (journal, volume, page)
+    year = normalize_year(pubnote.get('year'))
+    if year:
+        field['y'] = year
+    authors = [aut['name'] for aut in reference.get('authors', []) if aut.get('name')]
+    if authors:
+        field['h'] = u', '.join(authors)
+    title = clean(reference.get('ref_title'))
+    if title:
+        field['t'] = title
+    if 's' in field or 't' in field:
+        return field
+    return None
+
+
+def reference_fields(references):
+    """Yield the 999C5 fields of a list of references."""
+    for reference in references:
+        field = reference_field(reference)
+        if field:
+            yield field
+
+
+class ReferenceStage(object):
+    """
+    Collect the 999C5 fields of contributions in background threads.
+    fetch(pdf_path) returns the TEI of processReferences or None.
+    """
+
+    def __init__(self, fetch, nworkers=NWORKERS):
+        self.fetch = fetch
+        self.nworkers = nworkers
+        self.jobs = queue.Queue()
+        self.results = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        """Start the workers (done by the first submit)."""
+        for i in range(self.nworkers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, pdf_path, tei=None):
+        """
+        Get the references of the contribution key. The bibliography of the
+        fulltext tei is used if there is one, otherwise pdf_path is sent to Grobid.
+        """
+        if not self.threads:
+            self.start()
+        self.jobs.put((key, pdf_path, tei))
+
+    def work(self):
+        """Worker: map references or fetch them from Grobid."""
+        import mapping
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            key, pdf_path, tei = job
+            try:
+                references = mapping.tei_to_references(tei) if tei else []
+                if not references:
+                    tei = self.fetch(pdf_path)
+                    references = mapping.tei_to_references(tei) if tei else []
+                fields = list(reference_fields(references))
+            except Exception as err:
+                print('References of %s failed: %s' % (pdf_path, err))
+                fields = []
+            with self.lock:
+                self.results[key] = fields
+
+    def finish(self):
+        """Wait for the workers, return {key: list of 999C5 fields}."""
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.results
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite store of the results per contribution (execute_grobid.py -d <file>).
+
+For every contribution of a volume the store keeps page range, pdf and its
+sha1, Grobid status, the TEI (zlib compressed), the mapped dictionary and
+the time it took. One file can be used per volume or shared by many.
+
+With the store a volume can be exported again without Grobid, e.g. after
+fixing <recid>_metadata.txt (execute_grobid.py --from-store), and questions
+like "which contributions of volume X failed?" are a query:
+
+USAGE EXAMPLES:
+$ python resultstore.py -d results.sqlite                 # status of all volumes
+$ python resultstore.py -d results.sqlite -r 12345 -s failed,incomplete
+"""
+
+from __future__ import print_function
+
+import getopt
+import json
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+# status of a contribution
+STATUS_OK = 'ok'
+STATUS_INCOMPLETE = 'incomplete'
+STATUS_FAILED = 'failed'
+STATUS_PBN = 'pbn'
+STATUS_LOCAL = 'local'
+STATUS_DEFERRED = 'deferred'   # PBN only because of the deadline
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contributions (
+    recid TEXT NOT NULL,
+    pages TEXT NOT NULL,
+    pdf TEXT,
+    pdf_hash TEXT,
+    status TEXT,
+    missing TEXT,
+    tei BLOB,
+    mapped TEXT,
+    seconds REAL,
+    updated REAL,
+    PRIMARY KEY (recid, pages)
+);
+CREATE INDEX IF NOT EXISTS contributions_recid ON contributions (recid);
+CREATE INDEX IF NOT EXISTS contributions_status ON contributions (status);
+"""
+
+COLUMNS = ('recid', 'pages', 'pdf', 'pdf_hash', 'status', 'missing', 'seconds', 'updated')
+
+
+class ResultStore(object):
+    """Results of the contributions in one SQLite file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+
+    def put(self, recid, pages, pdf, pdf_hash, status, missing, tei, mapped, seconds=None):
+        """Store (or replace) the result of one contribution, commit with commit()."""
+        if tei is not None:
+            if not isinstance(tei, bytes):
+                tei = tei.encode('utf-8')
+            tei = sqlite3.Binary(zlib.compress(tei))
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO contributions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(recid), pages, pdf, pdf_hash, status, ','.join(missing), tei,
+                 json.dumps(mapped), seconds, time.time()))
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def contributions(self, recid=None, statuses=None):
+        """Rows (dictionaries of COLUMNS) of a volume or all, optionally only with statuses."""
+        query = "SELECT %s FROM contributions" % ', '.join(COLUMNS)
+        conditions = []
+        args = []
+        if recid is not None:
+            conditions.append("recid = ?")
+            args.append(str(recid))
+        if statuses:
+            conditions.append("status IN (%s)" % ', '.join(['?'] * len(statuses)))
+            args.extend(statuses)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY recid, pages"
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def mapped(self, recid):
+        """Yield (pages, pdf, status, mapped dictionary, TEI) of the contributions of a volume."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT pages, pdf, status, mapped, tei FROM contributions WHERE recid = ?",
+                (str(recid), )).fetchall()
+        for pages, pdf, status, mapped, tei in rows:
+            if tei is not None:
+                tei = zlib.decompress(tei).decode('utf-8', 'replace')
+            yield pages, pdf, status, json.loads(mapped), tei
+
+    def tei(self, recid, pages):
+        """TEI of one contribution, None if unknown."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT tei FROM contributions WHERE recid = ? AND pages = ?",
+                (str(recid), pages)).fetchone()
+        if row and row[0] is not None:
+            return zlib.decompress(row[0]).decode('utf-8', 'replace')
+        return None
+
+    def status_counts(self, recid=None):
+        """{recid: {status: number of contributions}}"""
+        query = "SELECT recid, status, COUNT(*) FROM contributions"
+        args = []
+        if recid is not None:
+            query += " WHERE recid = ?"
+            args.append(str(recid))
+        query += " GROUP BY recid, status"
+        counts = {}
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        for row_recid, status, number in rows:
+            counts.setdefault(row_recid, {})[status] = number
+        return counts
+
+
+def contribution_status(extract_metadata, tei, missing, local=False, deferred=False):
+    """Status of a contribution for the store."""
+    if not extract_metadata:
+        return STATUS_PBN
+    if deferred:
+        return STATUS_DEFERRED
+    if not tei:
+        return STATUS_LOCAL if local else STATUS_FAILED
+    if missing:
+        return STATUS_INCOMPLETE
+    return STATUS_OK
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: python resultstore.py -d <store> [-r recid] [-s status,...]\n"
+                "-d: SQLite file written by execute_grobid.py -d\n"
+                "-r: only this volume\n"
+                "-s: list the contributions with these statuses (%s)"
+                % ', '.join([STATUS_OK, STATUS_INCOMPLETE, STATUS_FAILED, STATUS_LOCAL, STATUS_PBN,
+                              STATUS_DEFERRED]))
+    try:
+        opts, args = getopt.getopt(argv, "hd:r:s:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    filename = None
+    recid = None
+    statuses = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-d':
+            filename = arg
+        elif opt == '-r':
+            recid = arg
+        elif opt == '-s':
+            statuses = arg.split(',')
+    if not filename:
+        print(helptext)
+        sys.exit(2)
+    store = ResultStore(filename)
+    if statuses:
+        for row in store.contributions(recid, statuses):
+            print('%(recid)s\t%(pages)s\t%(status)s\t%(missing)s\t%(pdf)s' % row)
+    else:
+        for row_recid, counts in sorted(store.status_counts(recid).items()):
+            print('%s\t%s' % (row_recid, ', '.join(['%s: %i' % item for item in sorted(counts.items())])))
+    store.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
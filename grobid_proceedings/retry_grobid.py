@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Second pass for the contributions of a volume which came back from Grobid
+without authors, title or abstract (or not at all).
+
+build_marc_xml writes grobid.split_<id>.state.jsonl next to its output, one
+line per contribution with the record and the fields Grobid did not find.
+Only these contributions are sent to Grobid again, with other options:
+header instead of fulltext service, consolidation, a window of pages.
+What is found now is filled into the records, the output and the state are
+rewritten with the output settings of the first run (format, shards, archive,
+--max-authors), the result store and the delta fingerprints of the first run
+are updated. Complete contributions are not sent to Grobid again, so several
+passes with different options are cheap.
+This is also the top-up run for the contributions which only got PBN-only
+records because of a deadline (execute_grobid.py --deadline, -m fulltext).
+
+USAGE EXAMPLES:
+$ python retry_grobid.py -s grobid.split_C19-01-01.state.jsonl
+$ python retry_grobid.py -s grobid.split_C19-01-01.state.jsonl -m fulltext -c -w 2-3
+"""
+
+from __future__ import print_function
+
+import getopt
+import json
+import os
+import sys
+
+from multiprocessing.pool import ThreadPool
+
+import execute_grobid
+import pdf_upload_path
+import pdfstore
+import serializers
+from affiliations import AffiliationTable
+from delta import Fingerprints, fingerprints_filename
+from resultstore import ResultStore
+from shards import ShardWriter
+
+SERVICES = {'header': 'processHeaderDocument', 'fulltext': 'processFulltextDocument'}
+# output settings of state files written before they were recorded
+DEFAULT_SETTINGS = {'output_format': 'marcxml', 'max_records': 0, 'max_bytes': 0,
+                    'archive': False, 'delta': False, 'max_authors': 0, 'store': None}
+
+
+def str_keys(dic):
+    """Tags and subfield codes as byte strings, as the serializers expect."""
+    return dict((str(key), value) for key, value in dic.items())
+
+
+def read_state(filename):
+    """
+    Output settings of the first run ({} in old state files) and the
+    contributions of the state file in the order of the output.
+    """
+    settings = {}
+    entries = []
+    with open(filename) as state:
+        for line in state:
+            if line.strip():
+                entry = json.loads(line, object_hook=str_keys)
+                if 'settings' in entry:
+                    settings = entry['settings']
+                    if settings.get('output_format'):
+                        settings['output_format'] = str(settings['output_format'])
+                else:
+                    # page ranges and artids as byte strings, as in build_marc_xml
+                    entry['pages'] = entry['pages'].encode('utf-8')
+                    entries.append(entry)
+    return settings, entries
+
+
+def write_state(filename, settings, entries):
+    """Replace the state file."""
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as state:
+        state.write(json.dumps({'settings': settings}) + '\n')
+        for entry in entries:
+            state.write(json.dumps(entry) + '\n')
+    os.rename(tmp_filename, filename)
+
+
+def grobid_options(mode='header', consolidate=False, window=None):
+    """Grobid service and form fields, window is 'start-end' (pages of the pdf)."""
+    data = {}
+    if consolidate:
+        data['consolidateHeader'] = '1'
+    if window:
+        start, end = (window.split('-') + [''])[:2]
+        data['start'] = start
+        data['end'] = end or start
+    return SERVICES[mode], data
+
+
+def needs_retry(entry, fields):
+    """Did Grobid miss one of fields for this contribution?"""
+    return any([field in entry['missing'] for field in fields])
+
+
+def retry_entry(entry, service, data, fields, affiliation_table):
+    """
+    Send the contribution to Grobid again, fill in found fields.
+    Return them, the dictionary of the TEI and the TEI (None if Grobid failed).
+    Affiliations are spelled as in affiliation_table, i.e. as in the first pass.
+    """
+    import mapping
+    if not os.path.isfile(entry['pdf']):
+        print("Can't read %s" % entry['pdf'])
+        return [], None, None
+    tei = execute_grobid.request_grobid(service, entry['pdf'],
+                                        execute_grobid.open_pdf(entry['pdf']), data=data)
+    if tei is None:
+        return [], None, None
+    entry['failed'] = False
+    if entry.get('deferred'):
+        entry['record']['595'] = {'a': execute_grobid.GROBID_NOTE % pdf_upload_path.get_user()}
+        entry['deferred'] = False
+    counter = {"authors": 0, "title": 0, "abstract": 0}
+    new = {}
+    rec_dict = mapping.tei_to_dict(tei, affiliation_table, max_authors=execute_grobid.MAX_AUTHORS)
+    still_missing = execute_grobid.add_metadata(new, rec_dict, counter)
+    new = affiliation_table.resolve_record(new)
+    found = [field for field in entry['missing']
+             if field in fields and field not in still_missing]
+    for field in found:
+        for tag in execute_grobid.MARC_FIELDS[field]:
+            if tag in new:
+                entry['record'][tag] = new[tag]
+    if 'authors' in found and rec_dict.get('authors_total'):
+        notes = entry['record'].get('595') or []
+        if isinstance(notes, dict):
+            notes = [notes]
+        entry['record']['595'] = notes + [execute_grobid.collapsed_note(rec_dict['authors_total'])]
+    entry['missing'] = [field for field in entry['missing'] if field not in found]
+    return found, rec_dict, tei
+
+
+# keys of the dictionaries of mapping.tei_to_dict per field
+DICT_KEYS = {'authors': ('authors', 'authors_total'), 'title': ('title', ), 'abstract': ('abstract', )}
+
+
+def update_store(store, recid, retried, affiliation_table):
+    """
+    Put the fields found by the retry into the result store, so --from-store
+    exports have them. retried are (entry, found, dictionary, TEI).
+    """
+    from resultstore import contribution_status
+    previous = dict((pages, (mapped, tei)) for pages, pdf, status, mapped, tei
+                    in store.mapped(recid))
+    for entry, found, rec_dict, tei in retried:
+        if rec_dict is None:
+            continue
+        mapped, old_tei = previous.get(entry['pages'], ({}, None))
+        new = execute_grobid.mapped_dict(rec_dict, affiliation_table)
+        for field in found:
+            for key in DICT_KEYS[field]:
+                mapped.pop(key, None)
+                if key in new:
+                    mapped[key] = new[key]
+        tei = old_tei or tei
+        store.put(recid, entry['pages'], entry['pdf'], pdfstore.file_hash(entry['pdf']),
+                  contribution_status(True, tei, entry['missing'], deferred=entry.get('deferred')),
+                  entry['missing'], tei, mapped)
+    store.commit()
+
+
+def basename_of(state_filename):
+    """grobid.split_<id>.state.jsonl -> <id>"""
+    name = os.path.basename(state_filename)
+    return name[len('grobid.split_'):-len('.state.jsonl')]
+
+
+def retry(state_filename, mode='header', consolidate=False, window=None,
+          fields=execute_grobid.METADATA_FIELDS, output_format=None,
+          max_records=None, max_bytes=None, archive=None, max_authors=None):
+    """
+    Re-process the incomplete contributions of the state file and rewrite
+    the output of the volume. Output settings which are None are taken from the
+    first run. Return number of retried and improved contributions.
+    """
+    service, data = grobid_options(mode, consolidate, window)
+    settings, entries = read_state(state_filename)
+    for key, value in (('output_format', output_format), ('max_records', max_records),
+                       ('max_bytes', max_bytes), ('archive', archive),
+                       ('max_authors', max_authors)):
+        if value is not None:
+            settings[key] = value
+    settings = dict(DEFAULT_SETTINGS, **settings)
+    execute_grobid.set_max_authors(settings['max_authors'])
+    recid = basename_of(state_filename)
+    todo = [entry for entry in entries if needs_retry(entry, fields)]
+    affiliation_table = AffiliationTable()
+    for entry in entries:
+        affiliation_table.intern_record(entry['record'])
+    print('%i of %i contributions to retry with %s %s' % (len(todo), len(entries), service, data))
+    pool = ThreadPool(execute_grobid.GROBID_CONCURRENCY)
+    try:
+        results = pool.map(lambda entry: retry_entry(entry, service, data, fields,
+                                                     affiliation_table), todo)
+    finally:
+        pool.close()
+    found = [fields_found for fields_found, rec_dict, tei in results]
+    improved = len([fields_found for fields_found in found if fields_found])
+    for field in fields:
+        print('%5d records got %s' % (len([f for f in found if field in f]), field))
+
+    output_dir = os.path.dirname(os.path.abspath(state_filename))
+    serializer = serializers.get_format(settings['output_format'])
+    writer = ShardWriter(output_dir, recid, serializer, settings['max_records'],
+                         settings['max_bytes'], settings['archive'])
+    fingerprints = None
+    if settings['delta']:
+        fingerprints = Fingerprints(fingerprints_filename(output_dir, recid))
+        update_writer = ShardWriter(output_dir, recid + '.update', serializer,
+                                    settings['max_records'], settings['max_bytes'],
+                                    settings['archive'])
+    for number, entry in enumerate(entries, 1):
+        writer.write(entry['pages'], serializer['record'](entry['record'], number))
+        if fingerprints is not None and fingerprints.add(entry['pages'], entry['record']):
+            update_writer.write(entry['pages'], serializer['record'](entry['record'],
+                                                                     update_writer.nrecords + 1))
+    path_filename = writer.close()
+    write_state(state_filename, settings, entries)
+    print('Wrote %i records to %s' % (len(entries), path_filename))
+    if fingerprints is not None:
+        update_filename = update_writer.close()
+        fingerprints.save()
+        print('Delta: %i changed records in %s' % (update_writer.nrecords, update_filename))
+    if settings['store']:
+        if os.path.isfile(settings['store']):
+            store = ResultStore(settings['store'])
+            update_store(store, recid, [(entry,) + result for entry, result in zip(todo, results)],
+                         affiliation_table)
+            store.close()
+        else:
+            print("Can't update the result store %s, it is gone" % settings['store'])
+    deferred = [(entry['pages'], entry['pdf']) for entry in entries if entry.get('deferred')]
+    topup_filename = execute_grobid.write_topup(output_dir, recid, deferred)
+    if topup_filename:
+        print('%i contributions still PBN only, listed in %s' % (len(deferred), topup_filename))
+    return len(todo), improved
+
+
+def main(argv):
+    """Main function."""
+    helptext = (
+        "Usage: python retry_grobid.py -s <state_file> [-m header|fulltext] [-c] [-w start-end]\n"
+        "* <state_file>: grobid.split_<id>.state.jsonl written by execute_grobid.py\n"
+        "* -m: Grobid service for the retry (default header)\n"
+        "* -c: consolidate the header with Grobid\n"
+        "* -w <start-end>: only these pages of the contributions, e.g. 2-3\n"
+        "* -t <fields>: retry contributions missing these fields (default authors,title,abstract)\n"
+        "* -f <format>, -n <records>, -b <bytes>, -z, --max-authors=<n>: output format,\n"
+        "  shards, archive and author lists as for execute_grobid.py, default as in the first run\n"
+        )
+    try:
+        opts, args = getopt.getopt(argv, "hczs:m:w:t:f:n:b:", ["max-authors="])
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    state_filename = ''
+    options = {}
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-s':
+            state_filename = arg
+        elif opt == '-m':
+            if arg not in SERVICES:
+                print(helptext)
+                sys.exit(2)
+            options['mode'] = arg
+        elif opt == '-c':
+            options['consolidate'] = True
+        elif opt == '-w':
+            options['window'] = arg
+        elif opt == '-t':
+            options['fields'] = tuple(arg.split(','))
+        elif opt == '-f':
+            options['output_format'] = arg
+        elif opt == '-n':
+            options['max_records'] = int(arg)
+        elif opt == '-b':
+            options['max_bytes'] = int(arg)
+        elif opt == '-z':
+            options['archive'] = True
+        elif opt == '--max-authors':
+            options['max_authors'] = int(arg)
+    if not os.path.isfile(state_filename):
+        print(helptext)
+        sys.exit(2)
+    retry(state_filename, **options)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Longest-processing-time-first scheduling of the contributions of a volume
+(execute_grobid.py -j <n>, --hosts=...).
+
+The cost of a contribution is estimated from its number of pages (page
+range in the file name, the page plan, or the pdf) and its size in bytes.
+The most expensive contributions are started first and distributed over
+the Grobid hosts so that every host gets about the same amount of work;
+a worker whose host queue runs empty takes the cheapest job of the most
+loaded host. Like this one long review paper does not start last and
+hold up the whole volume.
+"""
+
+import os
+import re
+import threading
+
+from collections import deque
+
+from six.moves import queue
+
+PAGE_COST = 1.0
+MB_COST = 0.5
+DEFAULT_PAGES = 10
+
+RE_PAGE_RANGE = re.compile(r'^\s*(\d+)\s*-\s*(\d+)\s*$')
+
+
+def page_count(pages):
+    """Number of pages of a page range like '12-25', None for others."""
+    match = RE_PAGE_RANGE.match(pages or '')
+    if match:
+        return max(1, int(match.group(2)) - int(match.group(1)) + 1)
+    return None
+
+
+def pdf_page_count(pdf_file):
+    """Number of pages from the pdf with PyMuPDF, None without it."""
+    try:
+        import fitz
+    except ImportError:
+        return None
+    try:
+        doc = fitz.open(pdf_file)
+    except Exception:
+        return None
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def estimate_cost(pdf_file, pages, page_plan=None):
+    """Relative cost of sending the contribution to Grobid."""
+    npages = page_count(pages)
+    if npages is None and page_plan and pages in page_plan:
+        npages = page_count(page_plan[pages])
+    if npages is None:
+        npages = pdf_page_count(pdf_file) or DEFAULT_PAGES
+    return PAGE_COST * npages + MB_COST * os.path.getsize(pdf_file) / float(1 << 20)
+
+
+def lpt_order(jobs):
+    """Jobs (cost, job) with the most expensive first."""
+    return sorted(jobs, key=lambda cost_job: -cost_job[0])
+
+
+def assign(jobs, hosts):
+    """Distribute jobs (cost, job) over hosts, LPT: next job to the least loaded host."""
+    queues = dict((host, deque()) for host in hosts)
+    load = dict((host, 0.0) for host in hosts)
+    for cost, job in lpt_order(jobs):
+        host = min(hosts, key=lambda host: load[host])
+        queues[host].append((cost, job))
+        load[host] += cost
+    return queues, load
+
+
+class Scheduler(object):
+    """Per-host queues of jobs in LPT order with stealing from the most loaded host."""
+
+    def __init__(self, jobs, hosts):
+        self.queues, self.load = assign(jobs, hosts)
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def stop(self):
+        """No more jobs for the workers, e.g. after an error."""
+        with self.lock:
+            self.stopped = True
+
+    def next_job(self, host):
+        """Next job for a worker of host, None if all jobs are taken or stopped."""
+        with self.lock:
+            if self.stopped:
+                return None
+            if not self.queues[host]:
+                host = max(self.load, key=lambda other: self.load[other])
+                if not self.queues[host]:
+                    return None
+                cost, job = self.queues[host].pop()
+            else:
+                cost, job = self.queues[host].popleft()
+            self.load[host] -= cost
+            return job
+
+
+def run(jobs, hosts, func, workers_per_host=1):
+    """
+    Run func(job, host) for jobs (cost, job) with workers_per_host threads per host.
+    Yield the results as they come; exceptions of func are raised here,
+    the workers then stop after their current job. Jobs of a generator
+    which is closed early are not started either.
+    """
+    scheduler = Scheduler(jobs, hosts)
+    results = queue.Queue()
+
+    def worker(host):
+        while True:
+            job = scheduler.next_job(host)
+            if job is None:
+                results.put((False, None))
+                return
+            try:
+                results.put((True, func(job, host)))
+            except Exception as err:
+                results.put((None, err))
+
+    nworkers = 0
+    for host in hosts:
+        for i in range(workers_per_host):
+            thread = threading.Thread(target=worker, args=(host, ))
+            thread.daemon = True
+            thread.start()
+            nworkers += 1
+    try:
+        while nworkers:
+            ok, result = results.get()
+            if ok is None:
+                raise result
+            if ok:
+                yield result
+            else:
+                nworkers -= 1
+    finally:
+        scheduler.stop()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Output formats for the records created by execute_grobid.build_marc_xml
+
+Every format writes one record at a time, so a volume can be streamed to disk.
+  marcxml  - MARCXML for upload to INSPIRE (default), see utils.legacy_export_as_marc
+  jsonl    - JSON Lines, one record dictionary per line
+  textmarc - '%09i TAG $$x...' lines, the format read by execute_grobid.read_book_dict
+  iso2709  - binary MARC (ISO 2709), UTF-8 encoded
+
+A format is a dictionary with the file extension, header and footer of the file
+and a function record(marcdict, number) which returns the record as a byte string.
+More formats can be added with register_format.
+"""
+
+import json
+
+import utils
+
+FIELD_TERMINATOR = '\x1e'
+SUBFIELD_DELIMITER = '\x1f'
+RECORD_TERMINATOR = '\x1d'
+# lengths the ISO 2709 leader (5 digits) and directory (4 digits) can hold
+MAX_RECORD_LENGTH = 99999
+MAX_FIELD_LENGTH = 9999
+
+FORMATS = {}
+
+
+def register_format(name, extension, record, header='', footer=''):
+    """Make a serializer available for build_marc_xml and the command line."""
+    FORMATS[name] = {
+        'extension': extension,
+        'record': record,
+        'header': header,
+        'footer': footer,
+        }
+
+
+def get_format(name):
+    """Return the serializer for name, raise ValueError for unknown formats."""
+    if name not in FORMATS:
+        raise ValueError("Unknown output format %s, use one of: %s"
+                         % (name, ', '.join(sorted(FORMATS.keys()))))
+    return FORMATS[name]
+
+
+def to_bytes(value):
+    """Subfield value as utf-8 byte string."""
+    if not value:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+
+def iter_fields(marcdict):
+    """
+    Walk through a record dictionary in the same order as legacy_export_as_marc.
+    Yield (tag, ind1, ind2, subfields) for datafields and (tag, None, None, value)
+    for controlfields. Subfields is a list of (code, value); empty fields are kept.
+    """
+    for key, value in sorted(marcdict.items()):
+        if key.startswith('00') and len(key) == 3:
+            if isinstance(value, list):
+                value = value[0]
+            yield key, None, None, to_bytes(value)
+            continue
+        tag = key[:3]
+        ind1 = key[3:4].replace('_', '')
+        ind2 = key[4:5].replace('_', '')
+        if isinstance(value, dict):
+            value = [value]
+        for field in value:
+            subfields = []
+            if field:
+                for code, subfieldvalue in field.items():
+                    if isinstance(subfieldvalue, list):
+                        for val in subfieldvalue:
+                            subfields.append((code, to_bytes(val)))
+                    else:
+                        subfields.append((code, to_bytes(subfieldvalue)))
+            yield tag, ind1, ind2, subfields
+
+
+def record_marcxml(marcdict, number):
+    """One <record> of MARCXML."""
+    return utils.legacy_export_as_marc(marcdict, no_empty_fields=False)
+
+
+def record_jsonl(marcdict, number):
+    """One line of JSON."""
+    return json.dumps(marcdict, sort_keys=True) + '\n'
+
+
+def textmarc_value(value):
+    """
+    Value on one line. '$$' (e.g. TeX in an abstract) would start a subfield,
+    it is written as '$ $', a '$' at the end gets a space before the next '$$'.
+    """
+    value = value.replace('\n', ' ').strip()
+    while '$$' in value:
+        value = value.replace('$$', '$ $')
+    if value.endswith('$'):
+        value += ' '
+    return value
+
+
+def record_textmarc(marcdict, number):
+    """Textmarc lines of one record, the record number is used as recid."""
+    lines = []
+    for tag, ind1, ind2, subfields in iter_fields(marcdict):
+        if ind1 is None:
+            lines.append('%09i %s__ %s\n' % (number, tag, textmarc_value(subfields)))
+            continue
+        key = tag + (ind1 or '_') + (ind2 or '_')
+        values = ''.join(['$$%s%s' % (code, textmarc_value(value))
+                          for code, value in subfields])
+        lines.append('%09i %s %s\n' % (number, key, values))
+    return ''.join(lines)
+
+
+def record_iso2709(marcdict, number):
+    """
+    One record in binary MARC (ISO 2709).
+    ValueError if a field or the record is too long for the format, e.g. the
+    author list of a collaboration paper (see execute_grobid.py --max-authors).
+    """
+    directory = []
+    data = []
+    offset = 0
+    for tag, ind1, ind2, subfields in iter_fields(marcdict):
+        if ind1 is None:
+            field = subfields + FIELD_TERMINATOR
+        else:
+            field = (ind1 or ' ') + (ind2 or ' ') + ''.join(
+                [SUBFIELD_DELIMITER + code + value for code, value in subfields]
+                ) + FIELD_TERMINATOR
+        if len(field) > MAX_FIELD_LENGTH:
+            raise ValueError("Record %i: field %s has %i bytes, ISO 2709 allows %i"
+                             % (number, tag, len(field), MAX_FIELD_LENGTH))
+        directory.append('%3s%04i%05i' % (tag, len(field), offset))
+        data.append(field)
+        offset += len(field)
+    directory = ''.join(directory) + FIELD_TERMINATOR
+    base_address = 24 + len(directory)
+    length = base_address + offset + 1
+    if length > MAX_RECORD_LENGTH:
+        raise ValueError("Record %i has %i bytes, ISO 2709 allows %i, "
+                         "use --max-authors or another output format"
+                         % (number, length, MAX_RECORD_LENGTH))
+    leader = '%05inam a22%05i   4500' % (length, base_address)
+    return leader + directory + ''.join(data) + RECORD_TERMINATOR
+
+
+register_format('marcxml', 'xml', record_marcxml,
+                header='<collection>\n', footer='</collection>\n')
+register_format('jsonl', 'jsonl', record_jsonl)
+register_format('textmarc', 'txt', record_textmarc)
+register_format('iso2709', 'mrc', record_iso2709)
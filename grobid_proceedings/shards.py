@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Write the records of build_marc_xml into one file or into shards
+capped by number of records and/or bytes:
+    grobid.split_<id>.001.xml, grobid.split_<id>.002.xml, ...
+With an archive every shard is added compressed to grobid.split_<id>.tar.gz
+as soon as it is complete - no second pass over the files.
+An index grobid.split_<id>.index.txt lists the contributions in each shard.
+The archive gets its name when it is complete; abort removes what was written.
+"""
+
+import os
+import tarfile
+import time
+
+from io import BytesIO
+
+
+class ShardWriter(object):
+    """Collect serialized records and write them shard by shard."""
+
+    def __init__(self, output_dir, basename, serializer,
+                 max_records=0, max_bytes=0, archive=False):
+        self.output_dir = output_dir
+        self.basename = basename
+        self.serializer = serializer
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.sharded = bool(max_records or max_bytes)
+        self.tar = None
+        self.archive_filename = None
+        if archive:
+            self.archive_filename = os.path.join(
+                output_dir, 'grobid.split_%s.tar.gz' % basename)
+            self.tar = tarfile.open(self.archive_filename + '.tmp', 'w:gz')
+        self.shard_number = 0
+        self.shard = None
+        self.shard_keys = []
+        self.shard_size = 0
+        self.index = []
+        self.filenames = []
+        self.nrecords = 0
+
+    def shard_filename(self):
+        """Name of the current shard."""
+        extension = self.serializer['extension']
+        if self.sharded:
+            return 'grobid.split_%s.%03i.%s' % (self.basename, self.shard_number, extension)
+        return 'grobid.split_%s.%s' % (self.basename, extension)
+
+    def open_shard(self):
+        """Start a new shard with the header of the format."""
+        self.shard_number += 1
+        self.shard = BytesIO()
+        self.shard.write(self.serializer['header'])
+        self.shard_keys = []
+        self.shard_size = len(self.serializer['header'])
+
+    def shard_full(self, record):
+        """Would record exceed one of the limits of the current shard?"""
+        if not self.shard_keys:
+            return False
+        if self.max_records and len(self.shard_keys) >= self.max_records:
+            return True
+        if self.max_bytes and self.shard_size + len(record) + \
+                len(self.serializer['footer']) > self.max_bytes:
+            return True
+        return False
+
+    def write(self, key, record):
+        """Add one serialized record, key is the page range or artid."""
+        if self.shard is not None and self.shard_full(record):
+            self.close_shard()
+        if self.shard is None:
+            self.open_shard()
+        self.shard.write(record)
+        self.shard_keys.append(key)
+        self.shard_size += len(record)
+        self.nrecords += 1
+
+    def add_file(self, filename, data):
+        """Write data to output_dir or as member of the archive."""
+        if self.tar is not None:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.tar.addfile(info, BytesIO(data))
+        else:
+            path_filename = os.path.join(self.output_dir, filename)
+            outfile = open(path_filename, 'wb')
+            outfile.write(data)
+            outfile.close()
+        self.filenames.append(filename)
+
+    def close_shard(self):
+        """Write the current shard and forget it."""
+        self.shard.write(self.serializer['footer'])
+        filename = self.shard_filename()
+        self.add_file(filename, self.shard.getvalue())
+        for key in self.shard_keys:
+            self.index.append((filename, key))
+        self.shard = None
+
+    def close(self):
+        """
+        Write the last shard and the index.
+        Return the archive, the only file or the index file.
+        """
+        if self.shard is None and not self.filenames:
+            self.open_shard()
+        if self.shard is not None:
+            self.close_shard()
+        if self.sharded:
+            index = ''.join(['%s\t%s\n' % (filename, key) for filename, key in self.index])
+            self.add_file('grobid.split_%s.index.txt' % self.basename, index)
+        if self.tar is not None:
+            self.tar.close()
+            os.rename(self.archive_filename + '.tmp', self.archive_filename)
+            return self.archive_filename
+        # the only shard or the index
+        return os.path.join(self.output_dir, self.filenames[-1])
+
+    def abort(self):
+        """Remove the shards and the archive written so far, e.g. after a serializer error."""
+        if self.tar is not None:
+            self.tar.close()
+            if os.path.exists(self.archive_filename + '.tmp'):
+                os.remove(self.archive_filename + '.tmp')
+        else:
+            for filename in self.filenames:
+                os.remove(os.path.join(self.output_dir, filename))
+        self.filenames = []
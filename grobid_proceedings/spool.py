@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Record store for build_marc_xml in bounded-memory mode.
+
+Behaves like the dictionary all_records (pages -> record dictionary), but keeps
+records pickled and only up to max_bytes in memory. Further records are
+spilled to a temporary file on disk and read back one by one for the export.
+"""
+
+import os
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class RecordSpool(object):
+    """Dictionary of records with a memory ceiling."""
+
+    def __init__(self, max_bytes, tmp_dir=None):
+        self.max_bytes = max_bytes
+        self.memory_bytes = 0
+        self.in_memory = {}
+        self.on_disk = {}
+        tmp_handle, self.filename = tempfile.mkstemp(prefix='grobid_spool_', dir=tmp_dir)
+        self.spill_file = os.fdopen(tmp_handle, 'w+b')
+
+    def __setitem__(self, key, record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self.discard(key)
+        if self.memory_bytes + len(data) <= self.max_bytes:
+            self.in_memory[key] = data
+            self.memory_bytes += len(data)
+        else:
+            self.spill_file.seek(0, os.SEEK_END)
+            self.on_disk[key] = (self.spill_file.tell(), len(data))
+            self.spill_file.write(data)
+
+    def __getitem__(self, key):
+        if key in self.in_memory:
+            return pickle.loads(self.in_memory[key])
+        offset, length = self.on_disk[key]
+        self.spill_file.seek(offset)
+        return pickle.loads(self.spill_file.read(length))
+
+    def __contains__(self, key):
+        return key in self.in_memory or key in self.on_disk
+
+    def __len__(self):
+        return len(self.in_memory) + len(self.on_disk)
+
+    def discard(self, key):
+        """Forget key (the spilled bytes stay in the file)."""
+        if key in self.in_memory:
+            self.memory_bytes -= len(self.in_memory.pop(key))
+        self.on_disk.pop(key, None)
+
+    def keys(self):
+        return list(self.in_memory.keys()) + list(self.on_disk.keys())
+
+    def spilled(self):
+        """Number of records on disk."""
+        return len(self.on_disk)
+
+    def close(self):
+        """Remove the spill file."""
+        self.spill_file.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
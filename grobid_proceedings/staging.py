@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Local staging of the contributions.
+
+The web directory for the upload (see pdf_upload_path) is on AFS/EOS, where
+every small write is slow. The fulltext is cut and the contributions are sent
+to Grobid in a local scratch directory <scratch>/<recid>_for_grobid instead.
+publish copies the finished files to the web directory in one go:
+unchanged files are skipped, changed files are written to a temporary file
+and renamed into place, so INSPIRE never fetches a half written pdf.
+The FFT URLs are taken from the web directory (build_marc_xml(publish_dir=...)).
+With an objects_dir the pdfs are published into the content-addressed store
+(see pdfstore.py) and only linked into the web directory.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pdfstore
+from pdfstore import file_hash
+
+LOCAL_SCRATCH = None  # None: tempfile.gettempdir(), i.e. $TMPDIR or /tmp
+
+
+def local_dir(dir_for_grobid, scratch=LOCAL_SCRATCH):
+    """
+    Create a local directory with the same name as dir_for_grobid
+    and copy the metadata file(s) into it.
+    """
+    stage = tempfile.mkdtemp(prefix='grobid_', dir=scratch)
+    local = os.path.join(stage, os.path.basename(os.path.normpath(dir_for_grobid)))
+    os.mkdir(local)
+    if os.path.isdir(dir_for_grobid):
+        for filename in os.listdir(dir_for_grobid):
+            if filename.endswith('_metadata.txt'):
+                shutil.copy(os.path.join(dir_for_grobid, filename), local)
+    return local
+
+
+def remove_local_dir(local):
+    """Remove the staging directory created by local_dir."""
+    shutil.rmtree(os.path.dirname(local), ignore_errors=True)
+
+
+def same_content(src, dst):
+    """Do both files exist with the same content?"""
+    if not os.path.isfile(dst):
+        return False
+    if os.path.getsize(src) != os.path.getsize(dst):
+        return False
+    return file_hash(src) == file_hash(dst)
+
+
+def publish(local, dir_for_grobid, objects_dir=None):
+    """
+    Copy changed files from local to dir_for_grobid, atomically per file.
+    Return number of copied and of unchanged files.
+    """
+    if not os.path.isdir(dir_for_grobid):
+        os.mkdir(dir_for_grobid)
+    copied = 0
+    unchanged = 0
+    for filename in sorted(os.listdir(local)):
+        src = os.path.join(local, filename)
+        dst = os.path.join(dir_for_grobid, filename)
+        if not os.path.isfile(src):
+            continue
+        if objects_dir and filename.lower().endswith('.pdf'):
+            if pdfstore.store_file(src, dst, objects_dir):
+                copied += 1
+            else:
+                unchanged += 1
+            continue
+        if same_content(src, dst):
+            unchanged += 1
+            continue
+        tmp_dst = os.path.join(dir_for_grobid, '.%s.%i.tmp' % (filename, os.getpid()))
+        shutil.copyfile(src, tmp_dst)
+        os.chmod(tmp_dst, 0o644)
+        os.rename(tmp_dst, dst)
+        copied += 1
+    print('Published %i files to %s (%i unchanged)' % (copied, dir_for_grobid, unchanged))
+    return copied, unchanged
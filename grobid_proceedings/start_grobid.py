@@ -9,9 +9,9 @@ import sys
 from cutpdf_for_grobid import cut_pdf
 from execute_grobid import build_marc_xml
 import pdf_upload_path
+import profiling
+import staging
 
-DIR_HOME = os.getcwd()
-DIR_PDF = pdf_upload_path.dir_pdf(DIR_HOME)
 DESYDOC = 'desydoc@desy.de'
 
 
@@ -29,8 +29,22 @@ def create_dummy_metadata(record_id, metadata_filename):
         dummyfile.close()
 
 
+def setup_dir_for_grobid(recid, dir_pdf):
+    """
+    Create the directory <recid>_for_grobid in dir_pdf with a metadata file.
+    Return the directory and the name of the metadata file.
+    """
+    dir_for_grobid = os.path.join(dir_pdf, '%s_for_grobid' % recid)
+    if not os.path.isdir(dir_for_grobid):
+        os.mkdir(dir_for_grobid)
+    metadata_filename = os.path.join(dir_for_grobid, "%s_metadata.txt" % recid)
+    create_dummy_metadata(recid, metadata_filename)
+    return dir_for_grobid, metadata_filename
+
+
 def main(argv):
     """Main function. Talk the user through the process."""
+    import jobservice
     helptext = """Usage:
 Download of fulltext from INSPIRE is currently not possible.
 Please download the fulltext manually to your working directory and rename it to [recid]_fulltext.pdf
@@ -67,12 +81,37 @@ There are 2 possibilities to call the program:
     <page_filename> is the name of a file holding info how to cut the pdf
     In the 1st example <recid>.txt is the page_filename.
     The resulting xml file will be written to your current directory.
-    """
+
+    --profile               write timing of the stages to grobid_profile.trace.json/.txt
+    --cprofile=<stage,...>  also run these stages under cProfile
+    --service[=<url>]       let the job service run Grobid and the export
+                            (see jobservice.py, default %s)
+    --max-records=<n>       split the output in shards of at most <n> records
+    --max-bytes=<n>         split the output in shards of at most <n> bytes
+    --archive               pack the output into grobid.split_<id>.tar.gz
+    """ % jobservice.DEFAULT_URL
 
     recid = None
     page_filename = ''
+    service_url = None
+    output_options = {'archive': False, 'max_records': 0, 'max_bytes': 0}
+    dir_home = os.getcwd()
+    dir_pdf = pdf_upload_path.dir_pdf(dir_home)
     for arg in argv:
-        if os.path.isfile(arg):
+        if arg == '--profile' or arg.startswith('--cprofile='):
+            opt, sep, value = arg.partition('=')
+            profiling.parse_option(opt, value)
+        elif arg == '--service' or arg.startswith('--service='):
+            service_url = arg.partition('=')[2] or jobservice.DEFAULT_URL
+        elif arg == '--archive':
+            output_options['archive'] = True
+        elif arg.startswith('--max-records=') or arg.startswith('--max-bytes='):
+            opt, sep, value = arg.partition('=')
+            if not value.isdigit():
+                print helptext
+                sys.exit(2)
+            output_options[opt[2:].replace('-', '_')] = int(value)
+        elif os.path.isfile(arg):
             page_filename = arg
         elif arg.isdigit():
             recid = arg
@@ -93,8 +132,8 @@ There are 2 possibilities to call the program:
             print "Can't read pages file", page_filename
         sys.exit(1)
 
-    if not os.access(DIR_HOME, os.W_OK) or not os.access(DIR_PDF, os.W_OK) or not os.access(DIR_PDF, os.X_OK):
-        print "You need write permission in the current directory and %s" % DIR_PDF
+    if not os.access(dir_home, os.W_OK) or not os.access(dir_pdf, os.W_OK) or not os.access(dir_pdf, os.X_OK):
+        print "You need write permission in the current directory and %s" % dir_pdf
         answer = raw_input("Are you sure you want to continue? y/[n]\n")
         if not answer or answer[0].lower() == 'n':
             sys.exit(1)
@@ -102,15 +141,11 @@ There are 2 possibilities to call the program:
     print 'Hi!\nYou are starting the process to extract contributions \
 from an INSPIRE fulltext of record %s' % recid
 
-    dir_for_grobid = os.path.join(DIR_PDF, '%s_for_grobid' % recid)
-    if not os.path.isdir(dir_for_grobid):
-        os.mkdir(dir_for_grobid)
+    dir_for_grobid, metadata_filename = setup_dir_for_grobid(recid, dir_pdf)
 
-    fulltext_filename = os.path.join(DIR_HOME, "%s_fulltext.pdf" % recid) 
-    metadata_filename = os.path.join(dir_for_grobid, "%s_metadata.txt" % recid)
-    metadata_linkname = os.path.join(DIR_HOME, "%s_metadata.txt" % recid)
+    fulltext_filename = os.path.join(dir_home, "%s_fulltext.pdf" % recid) 
+    metadata_linkname = os.path.join(dir_home, "%s_metadata.txt" % recid)
     
-    create_dummy_metadata(recid, metadata_filename)
     if os.path.isfile(metadata_linkname):
         os.unlink(metadata_linkname)
     os.symlink(metadata_filename, metadata_linkname)
@@ -126,7 +161,8 @@ from an INSPIRE fulltext of record %s' % recid
     print ' otherwise there will be wrong metadata in the records'
     print '#############################################'
 
-# cut fulltext pdf in pieces
+# cut fulltext pdf in pieces in local scratch, then publish them to the web directory
+    local_dir = None
     answer = raw_input(
         "Do you want to cut the pdf? (possibly skip if it was already done)     [y]/n\nType q to exit\n")
     if not answer or answer[0].lower() == 'y':
@@ -137,7 +173,18 @@ from an INSPIRE fulltext of record %s' % recid
             print 'Then run start_grobid.py again'
             exit()
 
-        cut_pdf(fulltext_filename, page_filename, dir_for_grobid)
+        local_dir = staging.local_dir(dir_for_grobid)
+        with profiling.span('cut_pdf'):
+            try:
+                cut_pdf(fulltext_filename, page_filename, local_dir, verify=True)
+            except IOError as err:
+                print '\n\nCUTTING THE PDF FAILED: %s' % err
+                print 'Please check the page file and the fulltext.'
+                print 'Then run start_grobid.py again'
+                staging.remove_local_dir(local_dir)
+                exit()
+        with profiling.span('publish'):
+            staging.publish(local_dir, dir_for_grobid)
     elif answer[0].lower() == 'q':
         exit()
     
@@ -149,17 +196,49 @@ from an INSPIRE fulltext of record %s' % recid
         else:
             extract_metadata = True
 
-        nrecs, xml_file = build_marc_xml(dir_for_grobid, DIR_HOME, page_filename, extract_metadata)
-
-        if nrecs:
-            basename = os.path.basename(xml_file)
-            print "You should now check %s\n" % basename
+        if service_url:
+            job = jobservice.submit(service_url, {'recid': recid, 'page_file': page_filename},
+                                    dir_pdf, dir_home, cut=False,
+                                    extract_metadata=extract_metadata, **output_options)
+            print "Submitted job %s to %s, waiting for it..." % (job['id'], service_url)
+            result = jobservice.wait(service_url, [job['id']])[0]['result']
+            nrecs, output_file = result['records'], result['output']
+            if result['message']:
+                print result['message']
+        else:
+            with profiling.span('build_marc_xml'):
+                if local_dir:
+                    nrecs, output_file, failed = build_marc_xml(local_dir, dir_home, page_filename,
+                                                                extract_metadata,
+                                                                publish_dir=dir_for_grobid,
+                                                                **output_options)
+                else:
+                    nrecs, output_file, failed = build_marc_xml(dir_for_grobid, dir_home,
+                                                                page_filename, extract_metadata,
+                                                                **output_options)
+        profiling.write_report(os.path.join(dir_home, 'grobid_profile'))
+
+        if nrecs and output_options['archive']:
+            basename = os.path.basename(output_file)
+            print "You should now check %s (tar -tzf / tar -xzf)\n" % basename
             print "Then send it to the journal workflow:"
-            print "> tar -cf grobid.tar %s" % (basename)
+            print "> echo %s | mail -s Grobid -a %s %s" % (basename, basename, DESYDOC)
+        elif nrecs:
+            basename = os.path.basename(output_file)
+            files = [basename]
+            if output_options['max_records'] or output_options['max_bytes']:
+                # output_file is the index of the shards
+                files = sorted(set(line.split('\t')[0] for line in open(output_file))) + files
+            print "You should now check %s\n" % ' '.join(files)
+            print "Then send it to the journal workflow:"
+            print "> tar -cf grobid.tar %s" % ' '.join(files)
             print "> echo %s | mail -s Grobid -a grobid.tar %s" % (basename, DESYDOC)
         else:
             print "execute_grobid failed?"
 
+    if local_dir:
+        staging.remove_local_dir(local_dir)
+
 # delete unnessesary files
     print "\nYou can delete some files now:\n rm %s %s\n" % (fulltext_filename,  metadata_linkname)
     print "Other files in %s can be deleted when the records are in INSPIRE\n" % dir_for_grobid
@@ -19,8 +19,6 @@
 
 """DoJSON related utilities."""
 
-import six
-
 import re
 
 def encode_for_xml(text, wash=False, xml_version='1.0', quote=False):
@@ -73,60 +71,72 @@ def wash_for_xml(text, xml_version='1.0'):
             '', unicode(text, 'utf-8')).encode('utf-8')
 
 
+# escaped subfield values, names and affiliations repeat within and across records;
+# titles and abstracts don't, only values up to MARCXML_MEMO_LENGTH are kept
+MARCXML_MEMO_SIZE = 100000
+MARCXML_MEMO_LENGTH = 200
+_marcxml_memo = {}
+
+
+def encode_for_marcxml(value):
+    """Subfield value as washed and escaped utf-8 (short values memoized)."""
+    try:
+        return _marcxml_memo[value]
+    except (KeyError, TypeError):
+        pass
+    encoded = value
+    if not encoded:
+        encoded = ""
+    if isinstance(encoded, unicode):
+        encoded = encoded.encode('utf8')
+    encoded = encode_for_xml(str(encoded), wash=True)
+    if len(encoded) > MARCXML_MEMO_LENGTH:
+        return encoded
+    try:
+        if len(_marcxml_memo) >= MARCXML_MEMO_SIZE:
+            _marcxml_memo.clear()
+        _marcxml_memo[value] = encoded
+    except TypeError:
+        pass
+    return encoded
+
+
 def legacy_export_as_marc(json, tabsize=4, no_empty_fields=True):
     """Create the MARCXML representation using the producer rules."""
-
-    def encode_for_marcxml(value):
-        #from invenio_utils.text import encode_for_xml  # FIXME: is this really needed? Investigate!
-        if not value:
-            value = ""
-        if isinstance(value, unicode):
-            value = value.encode('utf8')
-        return encode_for_xml(str(value), wash=True)
+    controlfield = '\t<controlfield tag="%s">%s</controlfield>\n'.expandtabs(tabsize)
+    datafield = '\t<datafield tag="%s" ind1="%s" ind2="%s">\n'.expandtabs(tabsize)
+    subfield = '\t\t<subfield code="%s">%s</subfield>\n'.expandtabs(tabsize)
+    end_datafield = '\t</datafield>\n'.expandtabs(tabsize)
 
     export = ['<record>\n']
+    append = export.append
 
-    for key, value in sorted(six.iteritems(json)):
+    for key, value in sorted(json.items()):
         if no_empty_fields and not value:
             continue
         if key.startswith('00') and len(key) == 3:
             # Controlfield
             if isinstance(value, list):
                 value = value[0]
-            export += ['\t<controlfield tag="%s">%s'
-                       '</controlfield>\n'.expandtabs(tabsize)
-                       % (key, encode_for_marcxml(value))]
+            append(controlfield % (key, encode_for_marcxml(value)))
         else:
             tag = key[:3]
-            try:
-                ind1 = key[3].replace("_", "")
-            except:
-                ind1 = ""
-            try:
-                ind2 = key[4].replace("_", "")
-            except:
-                ind2 = ""
+            ind1 = key[3:4].replace("_", "")
+            ind2 = key[4:5].replace("_", "")
             if isinstance(value, dict):
                 value = [value]
             for field in value:
-                export += ['\t<datafield tag="%s" ind1="%s" '
-                           'ind2="%s">\n'.expandtabs(tabsize)
-                           % (tag, ind1, ind2)]
+                append(datafield % (tag, ind1, ind2))
                 if field:
-                    for code, subfieldvalue in six.iteritems(field):
+                    for code, subfieldvalue in field.items():
                         if subfieldvalue or not no_empty_fields:
                             if isinstance(subfieldvalue, list):
                                 for val in subfieldvalue:
-                                    export += ['\t\t<subfield code="%s">%s'
-                                               '</subfield>\n'.expandtabs(tabsize)
-                                               % (code, encode_for_marcxml(val))]
+                                    append(subfield % (code, encode_for_marcxml(val)))
                             else:
-                                export += ['\t\t<subfield code="%s">%s'
-                                           '</subfield>\n'.expandtabs(tabsize)
-                                           % (code,
-                                              encode_for_marcxml(subfieldvalue))]
-                export += ['\t</datafield>\n'.expandtabs(tabsize)]
-    export += ['</record>\n']
+                                append(subfield % (code, encode_for_marcxml(subfieldvalue)))
+                append(end_datafield)
+    append('</record>\n')
     return "".join(export)
 
 
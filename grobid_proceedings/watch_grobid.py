@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Daemon which processes fulltexts as they arrive in a watch directory.
+
+A job is complete when the watch directory holds
+    <recid>_fulltext.pdf
+    <recid>.txt               (page file, see cutpdf_for_grobid.read_pages)
+    <recid>_metadata.txt      (optional)
+and none of these files has changed for some seconds (partially written files).
+Each job is cut, sent to Grobid and exported like in batch_grobid.py, all in
+one long running process with warm connection pool and caches.
+Afterwards the input files are moved to done/ or failed/ in the watch directory
+together with a json status file.
+
+Uses inotify (pyinotify) if available, otherwise the directory is polled.
+
+USAGE EXAMPLES:
+$ python watch_grobid.py
+$ python watch_grobid.py -w /afs/desy.de/user/s/sachs/www/for_grobid/incoming -o xml/
+"""
+
+from __future__ import print_function
+
+import getopt
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import traceback
+
+from six.moves import queue
+
+import batch_grobid
+import execute_grobid
+import pdf_upload_path
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+RE_FULLTEXT = re.compile(r'^(\d+)_fulltext\.pdf$')
+
+
+def job_files(watch_dir, recid):
+    """Input files of a job."""
+    return {'fulltext': os.path.join(watch_dir, '%s_fulltext.pdf' % recid),
+            'page_file': os.path.join(watch_dir, '%s.txt' % recid),
+            'metadata': os.path.join(watch_dir, '%s_metadata.txt' % recid)}
+
+
+def file_state(filename):
+    """Size and modification time, None if the file does not exist."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def scan(watch_dir, states, settle):
+    """
+    Return recids of complete jobs, i.e. fulltext and page file exist
+    and no input file changed for settle seconds.
+    states keeps (files, time of last change) of every recid between calls,
+    recids without fulltext in watch_dir (e.g. finished jobs) are dropped.
+    """
+    ready = []
+    now = time.time()
+    seen = set()
+    for filename in os.listdir(watch_dir):
+        match = RE_FULLTEXT.match(filename)
+        if not match:
+            continue
+        recid = match.group(1)
+        seen.add(recid)
+        files = job_files(watch_dir, recid)
+        current = tuple([file_state(files[key]) for key in ('fulltext', 'page_file', 'metadata')])
+        if current[1] is None:
+            continue
+        if recid not in states or states[recid][0] != current:
+            states[recid] = (current, now)
+        elif now - states[recid][1] >= settle:
+            ready.append(recid)
+    for recid in list(states):
+        if recid not in seen:
+            del states[recid]
+    return ready
+
+
+def finish_job(watch_dir, recid, status):
+    """Move the input files to done/ or failed/ and write the status there."""
+    target = os.path.join(watch_dir, 'done' if status['exit_code'] == 0 else 'failed')
+    if not os.path.isdir(target):
+        os.mkdir(target)
+    filenames = job_files(watch_dir, recid).values()
+    # cutpdf_for_grobid.convert_version keeps the original fulltext
+    filenames.append(os.path.join(watch_dir, '%s_fulltext_original.pdf' % recid))
+    for filename in filenames:
+        if os.path.isfile(filename):
+            shutil.move(filename, os.path.join(target, os.path.basename(filename)))
+    status_file = open(os.path.join(target, '%s_status.json' % recid), 'w')
+    json.dump(status, status_file, indent=2, sort_keys=True)
+    status_file.close()
+
+
+def wait_for_change(notifier, poll):
+    """Sleep until inotify reports a change or poll seconds passed."""
+    if notifier is None:
+        time.sleep(poll)
+        return
+    if notifier.check_events(timeout=poll * 1000):
+        notifier.read_events()
+        notifier.process_events()
+
+
+def make_notifier(watch_dir):
+    """inotify notifier for watch_dir, None without pyinotify."""
+    if pyinotify is None:
+        return None
+
+    class IgnoreEvents(pyinotify.ProcessEvent):
+        """Events only wake up the scan of the directory."""
+        def process_default(self, event):
+            pass
+
+    manager = pyinotify.WatchManager()
+    notifier = pyinotify.Notifier(manager, IgnoreEvents())
+    manager.add_watch(watch_dir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                      pyinotify.IN_CREATE | pyinotify.IN_MODIFY)
+    return notifier
+
+
+def watch(watch_dir, output_dir, dir_pdf, settle=10, poll=30, nworkers=2, ngrobid=4,
+          **kwargs):
+    """Watch watch_dir forever and process every complete job."""
+    execute_grobid.set_grobid_concurrency(ngrobid)
+    job_queue = queue.Queue()
+    queued = set()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            recid = job_queue.get()
+            files = job_files(watch_dir, recid)
+            job = {'recid': recid, 'fulltext': files['fulltext'], 'page_file': files['page_file'],
+                   'metadata': files['metadata'] if os.path.isfile(files['metadata']) else ''}
+            try:
+                status = batch_grobid.run_job(job, output_dir, dir_pdf, **kwargs)
+            except Exception:
+                status = batch_grobid.job_status(recid, exit_code=batch_grobid.EXIT_GROBID,
+                                                 status='failed', message=traceback.format_exc())
+            print('Job %s: %s' % (recid, status['status']))
+            try:
+                finish_job(watch_dir, recid, status)
+            except Exception:
+                # the input files are still in watch_dir, don't process them again and again
+                print('Job %s: could not move the input files, not queued again until restart\n%s'
+                      % (recid, traceback.format_exc()))
+                continue
+            with lock:
+                queued.discard(recid)
+
+    for i in range(max(1, nworkers)):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    notifier = make_notifier(watch_dir)
+    print('Watching %s (%s)' % (watch_dir, 'inotify' if notifier else 'polling every %is' % poll))
+    states = {}
+    while True:
+        for recid in scan(watch_dir, states, settle):
+            with lock:
+                if recid in queued:
+                    continue
+                queued.add(recid)
+            del states[recid]
+            print('Queued job %s' % recid)
+            job_queue.put(recid)
+        # wake up in time to see settled files
+        wait_for_change(notifier, min(poll, settle) if states else poll)
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("\v* Usage: python watch_grobid.py [-w <watch_dir>] [-o <output_dir>]\n\v"
+        "* -w: directory to watch for <recid>_fulltext.pdf and <recid>.txt,\n"
+        "      default is the personal web directory\n"
+        "* -d: directory for the contributions, default is the personal web directory\n"
+        "* -o: directory for the output, default is '.'\n"
+        "* -t: seconds a job must be unchanged before it is processed (default 10)\n"
+        "* -p: seconds between scans of the directory (default 30)\n"
+        "* -n: number of volumes processed in parallel (default 2)\n"
+        "* -g: number of requests to Grobid in parallel (default 4)\n"
+        "* -s: Skip extraction of metadata from pdf.\n"
+        )
+    try:
+        opts, args = getopt.getopt(argv, "hsw:d:o:t:p:n:g:")
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+
+    dir_pdf = pdf_upload_path.dir_pdf(os.getcwd())
+    watch_dir = None
+    output_dir = '.'
+    options = {'settle': 10, 'poll': 30, 'nworkers': 2, 'ngrobid': 4, 'extract_metadata': True}
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-w':
+            watch_dir = arg
+        elif opt == '-d':
+            dir_pdf = arg
+        elif opt == '-o':
+            output_dir = arg
+        elif opt == '-t':
+            options['settle'] = int(arg)
+        elif opt == '-p':
+            options['poll'] = int(arg)
+        elif opt == '-n':
+            options['nworkers'] = int(arg)
+        elif opt == '-g':
+            options['ngrobid'] = int(arg)
+        elif opt == '-s':
+            options['extract_metadata'] = False
+    if not watch_dir:
+        watch_dir = dir_pdf
+
+    if not os.path.isdir(watch_dir) or not os.path.isdir(output_dir):
+        print(helptext)
+        sys.exit(2)
+    watch(watch_dir, output_dir, dir_pdf, **options)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
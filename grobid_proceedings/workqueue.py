@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Split the contributions of one volume between several workers (processes
+or nodes) which share a filesystem (AFS, EOS, NFS or a local temp directory).
+
+The queue is a directory, by default <recid>_for_grobid/.queue:
+    <pdf>.lease.<n>  claimed by a worker: '<worker> <expiry time>'
+    <pdf>.done       Grobid result is in results/ (as in pdfstore, by sha1 of the pdf)
+    <pdf>.failed     Grobid did not process the pdf
+    slim             the workers sent slim copies (--slim), results are keyed by that
+A worker claims a contribution by hard-linking its lease file into place as
+<pdf>.lease.0, which succeeds for exactly one worker. Leases of crashed or
+stuck workers expire (clocks of the nodes should agree to a few seconds); the
+expired lease <n> is taken over by linking <pdf>.lease.<n+1>, which again
+succeeds for exactly one worker. Leases are never removed, so a take-over
+can't drop the live lease of another worker.
+
+benchmarks/check_workqueue.py runs several worker processes against a mock
+Grobid and checks that every contribution is processed exactly once.
+
+When all contributions are done the merge step runs build_marc_xml with the
+results as Grobid cache, i.e. the output is assembled in byPage order without
+sending the done contributions to Grobid again (failed ones get a last try).
+The merge uses --slim if the workers did.
+
+USAGE EXAMPLES:
+$ python workqueue.py -i 12345_for_grobid              # on every node
+$ python workqueue.py -i 12345_for_grobid -m -p 12345.txt -o xml/
+"""
+
+from __future__ import print_function
+
+import errno
+import fnmatch
+import getopt
+import os
+import socket
+import sys
+import time
+
+import execute_grobid
+
+LEASE_SECONDS = 900
+POLL_SECONDS = 10
+
+
+def default_queue_dir(input_dir):
+    return os.path.join(input_dir, '.queue')
+
+
+class WorkQueue(object):
+    """Claims of one worker on the contributions of a _for_grobid directory."""
+
+    def __init__(self, queue_dir, worker=None, lease_seconds=LEASE_SECONDS):
+        self.queue_dir = queue_dir
+        self.results_dir = os.path.join(queue_dir, 'results')
+        self.worker = worker or '%s.%i' % (socket.gethostname(), os.getpid())
+        self.lease_seconds = lease_seconds
+        for directory in (queue_dir, self.results_dir):
+            try:
+                os.makedirs(directory)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def path(self, name, state):
+        return os.path.join(self.queue_dir, '%s.%s' % (name, state))
+
+    def finished(self, name):
+        """Done or failed?"""
+        return os.path.exists(self.path(name, 'done')) or os.path.exists(self.path(name, 'failed'))
+
+    def expired(self, lease):
+        """Has the lease in file lease run out? Unreadable leases count as expired."""
+        try:
+            with open(lease) as lease_file:
+                return float(lease_file.read().split()[1]) < time.time()
+        except (IOError, OSError, IndexError, ValueError):
+            return True
+
+    def lease_path(self, name, generation):
+        return self.path(name, 'lease.%i' % generation)
+
+    def current_lease(self, name):
+        """Generation of the newest lease of name, -1 if it was never claimed."""
+        generation = -1
+        while os.path.exists(self.lease_path(name, generation + 1)):
+            generation += 1
+        return generation
+
+    def link_lease(self, name, generation):
+        """Create lease generation atomically, False if it exists."""
+        tmp_filename = self.path(name, 'tmp.%s' % self.worker)
+        with open(tmp_filename, 'w') as lease_file:
+            lease_file.write('%s %f\n' % (self.worker, time.time() + self.lease_seconds))
+        try:
+            os.link(tmp_filename, self.lease_path(name, generation))
+            return True
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.remove(tmp_filename)
+
+    def claim(self, name):
+        """Claim the contribution name (pdf filename), True if this worker got it."""
+        if self.finished(name):
+            return False
+        generation = self.current_lease(name)
+        if generation >= 0 and not self.expired(self.lease_path(name, generation)):
+            return False
+        if not self.link_lease(name, generation + 1):
+            return False
+        if generation >= 0:
+            print('%s took over %s' % (self.worker, name))
+        return not self.finished(name)
+
+    def finish(self, name, ok):
+        """Mark the claimed contribution as done or failed."""
+        with open(self.path(name, 'done' if ok else 'failed'), 'w') as marker:
+            marker.write('%s\n' % self.worker)
+
+    def mark_slim(self):
+        """Remember that the workers send slim copies."""
+        open(os.path.join(self.queue_dir, 'slim'), 'w').close()
+
+    def slim(self):
+        """Did the workers send slim copies?"""
+        return os.path.exists(os.path.join(self.queue_dir, 'slim'))
+
+    def pending(self, names):
+        """Contributions which are neither done nor failed."""
+        return [name for name in names if not self.finished(name)]
+
+
+def pdf_names(input_dir):
+    """Filenames of the contributions as seen by execute_grobid.process_pdf_dir."""
+    names = []
+    for root, dirnames, filenames in os.walk(input_dir):
+        names.extend(fnmatch.filter(filenames, '*.pdf'))
+    return names
+
+
+def work(input_dir, queue_dir=None, worker=None, lease_seconds=LEASE_SECONDS,
+         poll=POLL_SECONDS, slim=False, parallel=1):
+    """
+    Process contributions of input_dir until all are done or failed.
+    Return the number processed by this worker.
+    """
+    queue_dir = queue_dir or default_queue_dir(input_dir)
+    work_queue = WorkQueue(queue_dir, worker, lease_seconds)
+    execute_grobid.set_tei_cache_dir(work_queue.results_dir)
+    if slim:
+        work_queue.mark_slim()
+    names = pdf_names(input_dir)
+    processed = 0
+    while True:
+        for processed_pdf in execute_grobid.process_pdf_dir(input_dir, slim=slim,
+                                                            work_queue=work_queue,
+                                                            parallel=parallel):
+            processed += 1
+        pending = work_queue.pending(names)
+        if not pending:
+            break
+        print('%s: %i contributions claimed by other workers, waiting' % (work_queue.worker, len(pending)))
+        time.sleep(poll)
+    print('%s processed %i of %i contributions' % (work_queue.worker, processed, len(names)))
+    return processed
+
+
+def merge(input_dir, output_dir, page_filename, queue_dir=None, wait=False,
+          poll=POLL_SECONDS, slim=False, **kwargs):
+    """
+    Assemble the output of the volume from the results of the workers.
+    Without wait nothing is done while contributions are pending.
+    With slim, or if the workers sent slim copies, the results of slim copies are used.
+    Return the result of build_marc_xml or None.
+    """
+    queue_dir = queue_dir or default_queue_dir(input_dir)
+    work_queue = WorkQueue(queue_dir)
+    names = pdf_names(input_dir)
+    pending = work_queue.pending(names)
+    while pending and wait:
+        time.sleep(poll)
+        pending = work_queue.pending(names)
+    if pending:
+        print('%i of %i contributions are not finished: %s'
+              % (len(pending), len(names), ', '.join(sorted(pending))))
+        return None
+    execute_grobid.set_tei_cache_dir(work_queue.results_dir)
+    return execute_grobid.build_marc_xml(input_dir, output_dir, page_filename,
+                                         slim=slim or work_queue.slim(), **kwargs)
+
+
+def main(argv):
+    """Main function."""
+    helptext = ("Usage: python workqueue.py -i <input_dir> [-q queue_dir] [-l lease_seconds]\n"
+                "       python workqueue.py -i <input_dir> -m -p <page_file> [-o output_dir] [-w]\n"
+                "* without -m: work on the contributions of <input_dir> with the other workers\n"
+                "* -m: merge the results into grobid.split_<id>.xml, -w: wait for pending ones\n"
+                "* -q: queue directory, default <input_dir>/.queue\n"
+                "* -l: seconds after which a claim can be taken over (default %i)\n"
+                "* -j: contributions sent to Grobid at the same time by this worker\n"
+                "* --slim: send copies with downsampled images to Grobid\n"
+                "  (-m uses it if the workers did)" % LEASE_SECONDS)
+    try:
+        opts, args = getopt.getopt(argv, "hmwi:q:l:p:o:j:", ["slim"])
+    except getopt.GetoptError:
+        print(helptext)
+        sys.exit(2)
+    input_dir = ''
+    queue_dir = None
+    output_dir = '.'
+    page_filename = ''
+    do_merge = False
+    wait = False
+    lease_seconds = LEASE_SECONDS
+    slim = False
+    parallel = 1
+    for opt, arg in opts:
+        if opt == '-h':
+            print(helptext)
+            sys.exit()
+        elif opt == '-i':
+            input_dir = arg
+        elif opt == '-q':
+            queue_dir = arg
+        elif opt == '-l':
+            lease_seconds = float(arg)
+        elif opt == '-m':
+            do_merge = True
+        elif opt == '-w':
+            wait = True
+        elif opt == '-p':
+            page_filename = arg
+        elif opt == '-o':
+            output_dir = arg
+        elif opt == '-j':
+            parallel = int(arg)
+        elif opt == '--slim':
+            slim = True
+    if not os.path.isdir(input_dir) or (do_merge and not os.path.isfile(page_filename)):
+        print(helptext)
+        sys.exit(2)
+    if do_merge:
+        if merge(input_dir, output_dir, page_filename, queue_dir, wait, slim=slim) is None:
+            sys.exit(1)
+    else:
+        work(input_dir, queue_dir, lease_seconds=lease_seconds, slim=slim, parallel=parallel)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])